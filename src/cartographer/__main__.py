@@ -24,8 +24,12 @@ from typing import Dict, Iterable, Set
 import httpx
 
 from sl_maptools import MapBounds, MapCoord, MapTile
-from sl_maptools.fetcher import MapCanvas, MapConnectionError, MapFetcher
+from sl_maptools.cache import DEFAULT_CACHE_DIR, DEFAULT_VOIDS_FILE, TileCache, VoidRegistry
+from sl_maptools.fetcher import DEFA_DECODE_WORKERS, MapCanvas, MapConnectionError, MapFetcher, TileDecoder
 from sl_maptools.knowns import KNOWN_AREAS
+from sl_maptools.reporter import ProgressReporter
+from sl_maptools.retry import CircuitBreaker
+from sl_maptools.throttle import RateLimiter
 
 SAVE_DIR = Path("~/Pictures/SLMap/Carto").expanduser()
 CONN_LIMIT = 20
@@ -34,6 +38,19 @@ CONN_LIMIT = 20
 def options():
     parser = argparse.ArgumentParser()
     parser.add_argument("--conti", "-c", default="", help="Continents to fetch (case-insensitive, comma-separated)")
+    parser.add_argument(
+        "--tilecache",
+        type=Path,
+        nargs="?",
+        const=DEFAULT_CACHE_DIR,
+        default=None,
+        help=f"Use an on-disk tile cache; if no directory given, uses {DEFAULT_CACHE_DIR}",
+    )
+    parser.add_argument("--no-voids", dest="voids", action="store_false", help="Don't use the void registry")
+    parser.add_argument(
+        "--decode-workers", type=int, default=DEFA_DECODE_WORKERS, help="Number of threads decoding JPEG tiles"
+    )
+    parser.add_argument("--rate-limit", type=float, default=None, help="Maximum requests per second to the map CDN")
     return parser.parse_args()
 
 
@@ -68,6 +85,10 @@ class Cartographer(object):
         conn_limit: int = CONN_LIMIT,
         retries: int = 5,
         retry_pause: float = 3.0,
+        cache: TileCache = None,
+        rate_limiter: RateLimiter = None,
+        voids: VoidRegistry = None,
+        decoder: TileDecoder = None,
     ):
         skip_coords = skip_coords or set()
         skip_subareas = skip_subareas or []
@@ -85,29 +106,41 @@ class Cartographer(object):
             if not skip_this(x, y)
         }
         limits = httpx.Limits(max_connections=conn_limit)
-        async with httpx.AsyncClient(limits=limits, http2=True) as client:
-            fetcher = MapFetcher(a_session=client)
-            print(f"{len(coords_to_fetch)} tiles to process", end="", flush=True)
-            for _ in range(0, retries):
-                tasks = [fetcher.async_get_tile(coord) for coord in coords_to_fetch]
-                for task in asyncio.as_completed(tasks):
-                    try:
-                        result: MapTile = await task
-                        self.add_tile(result)
-                        coords_to_fetch.discard(result.coord)
-                    except MapConnectionError:
-                        pass
-                if not coords_to_fetch:
-                    break
-                print("\nGot errors, retrying...", end="", flush=True)
-                time.sleep(retry_pause)
-            else:
-                raise CartographerError("Retries exceeded")
-            print()
-
-
-def main(conti: str):
+        with ProgressReporter() as reporter:
+            async with httpx.AsyncClient(limits=limits, http2=True) as client:
+                fetcher = MapFetcher(
+                    a_session=client,
+                    cache=cache,
+                    rate_limiter=rate_limiter,
+                    voids=voids,
+                    decoder=decoder,
+                    breaker=CircuitBreaker(message=reporter.message),
+                    reporter=reporter,
+                )
+                reporter.message(f"{len(coords_to_fetch)} tiles to process")
+                for _ in range(0, retries):
+                    tasks = [fetcher.async_get_tile(coord) for coord in coords_to_fetch]
+                    for task in asyncio.as_completed(tasks):
+                        try:
+                            result: MapTile = await task
+                            self.add_tile(result)
+                            coords_to_fetch.discard(result.coord)
+                        except MapConnectionError:
+                            pass
+                    if not coords_to_fetch:
+                        break
+                    reporter.message("Got errors, retrying...")
+                    time.sleep(retry_pause)
+                else:
+                    raise CartographerError("Retries exceeded")
+
+
+def main(conti: str, tilecache: Path | None, voids: bool, decode_workers: int, rate_limit: float | None):
     conti_set = set(c.casefold() for c in conti.split(",")) if conti else None
+    cache = TileCache(tilecache) if tilecache is not None else None
+    rate_limiter = RateLimiter(requests_per_sec=rate_limit) if rate_limit else None
+    void_registry = VoidRegistry(DEFAULT_VOIDS_FILE) if voids else None
+    decoder = TileDecoder(decode_workers)
 
     start_t = time.monotonic()
 
@@ -118,7 +151,13 @@ def main(conti: str):
         fetch_t = time.monotonic()
         print(f"\n===== Fetching {selector} =====")
         cartographer = Cartographer(*area)
-        asyncio.run(cartographer.fetch())
+        asyncio.run(
+            cartographer.fetch(cache=cache, rate_limiter=rate_limiter, voids=void_registry, decoder=decoder)
+        )
+        if cache is not None:
+            cache.save()
+        if void_registry is not None:
+            void_registry.save()
 
         print("Fetching done, saving ... ", end="")
         save_t = time.monotonic()
@@ -129,8 +168,14 @@ def main(conti: str):
         print(f"  Finished in {time.monotonic() - fetch_t:,.2f} seconds.")
 
     print()
+    decoder.shutdown()
     print("=" * 40)
     print(f"{time.monotonic() - start_t:,.2f}s in total")
+    print(f"Decoding: {decoder.stats}")
+    if cache is not None:
+        print(f"Tile cache: {cache.stats}")
+    if void_registry is not None:
+        print(f"Void registry: {void_registry.stats}")
 
 
 if __name__ == "__main__":
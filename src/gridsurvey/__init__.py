@@ -18,6 +18,7 @@ import httpx
 from bs4 import BeautifulSoup
 
 from sl_maptools import MapCoord
+from sl_maptools.throttle import RateLimiter
 
 RE_COORD = re.compile(r"\((\d+),(\d+)\)")
 STATE_DIR = Path(appdirs.site_data_dir("sl-cartography"))
@@ -70,9 +71,10 @@ class GridSurveyWeb(object):
     URL_TEMPLATE = "http://www.gridsurvey.com/index.php?page={page}"
     _ACCEPTABLE_EX = (httpx.ConnectError, httpx.RemoteProtocolError, httpx.ReadTimeout)
 
-    def __init__(self, client: httpx.Client, cache: Path = None):
+    def __init__(self, client: httpx.Client, cache: Path = None, rate_limiter: RateLimiter = None):
         self.client = client
         self.cache = cache
+        self.rate_limiter = rate_limiter
         self._cached_pages: Dict[str, Union[str, Tuple[datetime.date, str]]] = {}
 
     def read_cache(self):
@@ -138,6 +140,8 @@ class GridSurveyWeb(object):
         st_t = time.monotonic()
         for retry in range(retries):
             try:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire_sync(url)
                 resp = client.get(url)
                 if resp.status_code == 200:
                     break
@@ -5,7 +5,6 @@
 # This source file uses data & API provided by Tyche Shepherd & gridsurvey.com
 
 import re
-import time
 from pathlib import Path
 from typing import Generator, List, Set
 
@@ -14,6 +13,7 @@ import msgpack
 from bs4 import BeautifulSoup
 
 from gridsurvey import STATE_DIR, GridSurveyWeb, GridSurveyWebDatum
+from sl_maptools.throttle import RateLimiter
 from sl_maptools.utils import make_backup
 
 RE_PAGEOF = re.compile(r"Showing page \d+ of (\d+) pages")
@@ -48,7 +48,9 @@ def main(timeout: float = 90.0, interpage_delay: int = 5):
     doubles: List[GridSurveyWebDatum] = []
     try:
         with httpx.Client(timeout=timeout, http2=True) as client:
-            gridsurvey = GridSurveyWeb(client, PAGE_CACHE)
+            # Pages served from cache don't hit the server, so only real fetches are spaced apart
+            rate_limiter = RateLimiter(requests_per_sec=1.0 / interpage_delay)
+            gridsurvey = GridSurveyWeb(client, PAGE_CACHE, rate_limiter=rate_limiter)
 
             print("Initializing", flush=True)
             gridsurvey.prime()
@@ -70,7 +72,7 @@ def main(timeout: float = 90.0, interpage_delay: int = 5):
 
                 print(f"Grab page {page}/{last_page} ...", end="", flush=True)
                 try:
-                    soup, from_cache = gridsurvey.get_page_soup(page)
+                    soup, _ = gridsurvey.get_page_soup(page)
                 except Exception as egs:
                     print(f"get_page_soup exception {type(egs)}: {egs}")
                     raise
@@ -82,12 +84,7 @@ def main(timeout: float = 90.0, interpage_delay: int = 5):
                     doubles.extend(intersect)
                 regions.update(new_regions)
 
-                print(" done", end="", flush=True)
-                if not from_cache:
-                    for _ in range(interpage_delay):
-                        print(".", end="", flush=True)
-                        time.sleep(1.0)
-                print()
+                print(" done", flush=True)
         print("ALL DONE!")
     except KeyboardInterrupt:
         print("\nUser aborted!")
@@ -26,17 +26,36 @@ from pathlib import Path
 from pprint import PrettyPrinter
 from typing import List, Set, Tuple
 
-import httpx
-
 from mosaic_v3.builder import build_world_maps
 from mosaic_v3.config import *
-from mosaic_v3.dispatcher import async_fetch_area
-from mosaic_v3.progress import MosaicProgress, MosaicProgressProxy
+from mosaic_v3.dispatcher import (
+    INITIAL_IN_FLIGHT,
+    MAX_IN_FLIGHT,
+    MIN_IN_FLIGHT,
+    async_discover_area,
+    async_fetch_area,
+)
+from mosaic_v3.leases import LeaseRenewer, LeaseStore, fetch_leases, report_leases
+from mosaic_v3.progress import MosaicProgress, MosaicProgressProxy, TileBitmap
+from mosaic_v3.scheduler import make_scheduler
 from mosaic_v3.workers import WorkTeam
 from mosaic_v3.workers.recorder import TileRecorder
 from mosaic_v3.workers.tile_processor import ProcessorJob, TileProcessor
-from sl_maptools import MapCoord
+from sl_maptools import MapBounds, MapCoord
+from sl_maptools.cache import (
+    DEFAULT_FINGERPRINTS_FILE,
+    DEFAULT_VOIDS_FILE,
+    FingerprintStore,
+    TileCache,
+    VoidRegistry,
+)
 from sl_maptools.fetcher import RawTile
+from sl_maptools.metrics import FetchMetrics
+from sl_maptools.pool import ClientPool
+from sl_maptools.reporter import ProgressReporter
+from sl_maptools.retry import CircuitBreaker, RetryBudget, RetryPolicy
+from sl_maptools.singleflight import SingleFlight
+from sl_maptools.throttle import AdaptiveLimiter, RateLimiter
 from sl_maptools.utils import make_backup
 
 
@@ -49,6 +68,32 @@ async def async_main(
     redo: List[int],
     savedir: Path,
     workers: int,
+    processor_backlog: int,
+    batch_size: int,
+    batch_wait: float,
+    tilecache: Path | None,
+    tilecache_size: int,
+    rate_limit: float | None,
+    bandwidth_limit: float | None,
+    discover: bool,
+    voids: bool,
+    void_reprobe: float,
+    probe: bool,
+    schedule: str,
+    retry_attempts: int,
+    retry_jitter: str,
+    retry_budget: int | None,
+    tile_retries: int,
+    tile_retry_delay: float,
+    hedge: float | None,
+    metrics_port: int | None,
+    metrics_file: Path | None,
+    clients: int,
+    http1: bool,
+    lease_db: Path | None,
+    node: str,
+    lease_rows: int,
+    lease_seconds: float,
 ) -> None:
     """
     Manages/orchestrates the process of map tile fetching + mosaic building
@@ -61,6 +106,35 @@ async def async_main(
     :param redo: List of rows to re-fetch explicitly
     :param savedir: Directory where images will be saved
     :param workers: How many TileProcessor workers to launch
+    :param processor_backlog: Number of tiles waiting for the TileProcessors beyond which fetching pauses; 0 for no
+    limit
+    :param batch_size: Maximum number of tiles per message to the TileProcessors, and of results per message to the
+    TileRecorder
+    :param batch_wait: Maximum time (seconds) to wait for a batch of tiles to fill up
+    :param tilecache: Directory of the on-disk tile cache; None to disable caching
+    :param tilecache_size: Size cap of the tile cache, in MiB
+    :param rate_limit: Maximum requests per second; None for no limit
+    :param bandwidth_limit: Maximum KiB per second; None for no limit
+    :param discover: If True, skip void tiles found by a low-zoom discovery pass
+    :param voids: If True, use (and maintain) the registry of known voids
+    :param void_reprobe: Fraction of known voids to re-probe this run
+    :param probe: If True, don't skip completed rows, but only fetch tiles that a HEAD probe finds changed
+    :param schedule: Name of the scheduler deciding the order of fetching, one of SCHEDULES
+    :param retry_attempts: Maximum attempts per tile
+    :param retry_jitter: Jitter strategy of the backoff between attempts
+    :param retry_budget: Maximum number of retries for the whole run; None for no limit
+    :param tile_retries: Times a tile that failed to be fetched is put back in the queue during the run
+    :param tile_retry_delay: Initial delay before a failed tile is put back in the queue
+    :param hedge: Maximum hedged requests, as a fraction of all requests; None to disable hedging
+    :param metrics_port: Local port to serve Prometheus metrics on; None to not serve
+    :param metrics_file: File to dump metrics into at the end of the run; None to not dump
+    :param clients: Number of HTTP clients to spread requests over
+    :param http1: If True, use HTTP/1.1 instead of HTTP/2
+    :param lease_db: If given, fetch only rows leased from this database, and report the results there, instead of
+    fetching the whole range
+    :param node: Name of this worker in the lease database
+    :param lease_rows: Number of rows per lease
+    :param lease_seconds: Duration of leases
     :return: None
     """
     print(f"{platform.python_implementation()} {platform.python_version()}")
@@ -75,9 +149,19 @@ async def async_main(
     old_regs_count = len(progress.regions)
     old_comprows_count = len(progress.completed_rows)
     print(f"Progress so far: {old_regs_count} regions out of {old_comprows_count} complete rows")
+    scheduler = make_scheduler(schedule, progress)
+    print(f"Scheduling: {scheduler.name}")
+    if scheduler.revisits and not probe:
+        print(f"WARNING: Without --probe, completed rows are skipped, leaving '{scheduler.name}' little to reorder")
     # By adding failed_rows to redo_rows, failed_rows will take precedence (see docstring of async_fetch_area)
     redo_rows.update(progress.failed_rows)
     print(f"These rows will be force-fetched: {sorted(redo_rows)}")
+    # Explicitly-requested redo's are of whole rows
+    for row in redo or []:
+        progress.partial_rows.pop(row, None)
+    if progress.partial_rows:
+        missing = sum(xmax - xmin + 1 - len(bitmap) for bitmap in progress.partial_rows.values())
+        print(f"{len(progress.partial_rows)} rows are partially done, missing {missing:,} tiles")
     progress.failed_rows.clear()
 
     global_start = time.monotonic()
@@ -103,9 +187,11 @@ async def async_main(
         output_q=recorder_team.command_queue,
         coordfail_q=coordfail_q,
         err_q=err_q,
+        capacity=processor_backlog or None,
     )
     processor_team.start(verbose=True, start_num=1)
-    processor_input_q: MP.Queue[ProcessorJob] = processor_team.command_queue
+    # Keep the event loop out of MP.Queue.put(), which would hold up every fetch in flight
+    processor_feeder = processor_team.start_feeder(batch_size, batch_wait)
 
     processor_team.wait_ready()
     recorder_team.wait_ready()
@@ -116,11 +202,12 @@ async def async_main(
                 rownum = int(signal.removeprefix("ROW:"))
                 progress.completed_rows.add(rownum)
                 progress_proxy.completed_rows[rownum] = None
+                progress_proxy.row_stamps[rownum] = time.time()
                 return
             if signal == "SAVE":
                 recorder_team.command_queue.put("SAVE")
                 return
-        processor_input_q.put(signal)
+        processor_team.submit(signal)
 
     # noinspection PyUnusedLocal
     def drain_incoming_q(pteam: WorkTeam, quiet: bool):
@@ -136,34 +223,162 @@ async def async_main(
         """
         while not pteam.command_queue.empty():
             job: ProcessorJob = pteam.command_queue.get()
-            if not isinstance(job, tuple):
-                continue
-            co, _ = job
-            progress.failed_rows.add(co.y)
+            for item in job if isinstance(job, list) else [job]:
+                if not isinstance(item, tuple):
+                    continue
+                co, _ = item
+                progress.failed_rows.add(co.y)
+
+    cache = None
+    if tilecache is not None:
+        cache = TileCache(tilecache, max_bytes=tilecache_size * 1024 * 1024)
+        print(f"Using tile cache: {tilecache} ({len(cache):,} tiles, {cache.total_bytes / 1024**2:,.1f} MiB)")
+
+    void_registry = None
+    if voids:
+        void_registry = VoidRegistry(DEFAULT_VOIDS_FILE, reprobe_fraction=void_reprobe)
+        print(f"Using void registry: {DEFAULT_VOIDS_FILE} ({void_registry.stats.reprobes:,} voids to re-probe)")
+
+    fingerprints = None
+    if probe:
+        fingerprints = FingerprintStore(DEFAULT_FINGERPRINTS_FILE)
+        print(f"Using fingerprint store: {DEFAULT_FINGERPRINTS_FILE} ({len(fingerprints):,} tiles)")
+
+    rate_limiter = None
+    if rate_limit or bandwidth_limit:
+        bps = bandwidth_limit * 1024 if bandwidth_limit else None
+        rate_limiter = RateLimiter(requests_per_sec=rate_limit, bytes_per_sec=bps)
+
+    retry_policy = RetryPolicy(
+        max_attempts=retry_attempts,
+        jitter=retry_jitter,
+        budget=RetryBudget(retry_budget) if retry_budget is not None else None,
+    )
+
+    metrics = None
+    metrics_server = None
+    if metrics_port is not None or metrics_file is not None:
+        metrics = FetchMetrics()
+    if metrics is not None:
+        metrics.registry.gauge(
+            "processor_queue_depth", "Fetched tiles submitted to the TileProcessors but not processed yet"
+        ).set_function(lambda: processor_team.depth)
+        metrics.registry.gauge(
+            "processor_put_seconds", "Time spent putting fetched tiles into the TileProcessors' queue"
+        ).set_function(lambda: processor_feeder.put_seconds)
+    if metrics_port is not None:
+        metrics_server = await metrics.registry.serve(metrics_port)
+        print(f"Serving metrics on http://127.0.0.1:{metrics_port}/metrics")
+
+    reporter = ProgressReporter()
+    reporter.add_source("processed", lambda: processor_team.done_count)
+    reporter.add_source("process_failed", lambda: processor_team.failed_count)
+    reporter.add_source("backlog", lambda: processor_team.depth)
+    reporter.add_source("recorded", lambda: recorder_team.done_count)
+
+    lease_store = None
+    lease_renewer = None
+    leased_rows: Set[int] = set()
+    if lease_db is not None:
+        lease_store = LeaseStore(lease_db, lease_seconds=lease_seconds)
+        print(f"Using lease database: {lease_db} as {node} ({lease_store.counts()})")
+        # Keeps going until the results have been reported, as colour processing may well outlast fetching
+        lease_renewer = LeaseRenewer(lease_store, node, message=reporter.message).start()
 
     abort = False
-    print("\nDispatching jobs:", end="", flush=True)
+    print("\nDispatching jobs:", flush=True)
+    reporter.start()
     try:
-        skip_rows = progress.completed_rows - redo_rows
-        limits = httpx.Limits(max_connections=20, max_keepalive_connections=20)
-        async with httpx.AsyncClient(limits=limits, timeout=10.0, http2=True) as client:
-            fetch_progress, errs = await async_fetch_area(
-                client,
-                xmin,
-                xmax,
-                ymin,
-                ymax,
-                redo_rows=redo_rows,
-                skip_rows=skip_rows,
-                callback=callback,
-            )
+        async with ClientPool.create(clients, http2=not http1, max_connections=20, timeout=10.0) as pool:
+            # Shared by all fetches, so that with leases, what has been learnt about the CDN carries over to the next
+            limiter = AdaptiveLimiter(INITIAL_IN_FLIGHT, min_limit=MIN_IN_FLIGHT, max_limit=MAX_IN_FLIGHT)
+            breaker = CircuitBreaker(message=reporter.message)
+            flights = SingleFlight()
+            discovery = None
+            if discover and lease_store is not None:
+                # Once for the whole area, rather than again for every lease
+                discovery = await async_discover_area(
+                    pool,
+                    MapBounds(xmin, ymin, xmax, ymax),
+                    reporter,
+                    limiter=limiter,
+                    breaker=breaker,
+                    flights=flights,
+                    rate_limiter=rate_limiter,
+                    retry_policy=retry_policy,
+                    metrics=metrics,
+                )
+
+            def fetch_rows(y_min: int, y_max: int, redo: Set[int], skip: Set[int], abandon: Set[int] = None):
+                return async_fetch_area(
+                    pool,
+                    xmin,
+                    xmax,
+                    y_min,
+                    y_max,
+                    redo_rows=redo,
+                    skip_rows=skip,
+                    callback=callback,
+                    cache=cache,
+                    rate_limiter=rate_limiter,
+                    discover=discover,
+                    known_regions=progress.regions,
+                    voids=void_registry,
+                    retry_policy=retry_policy,
+                    hedge_budget=hedge,
+                    metrics=metrics,
+                    reporter=reporter,
+                    fingerprints=fingerprints,
+                    scheduler=scheduler,
+                    partial=progress.partial_rows,
+                    tile_retries=tile_retries,
+                    tile_retry_delay=tile_retry_delay,
+                    backpressure=lambda: processor_team.full,
+                    abandon_rows=abandon,
+                    limiter=limiter,
+                    breaker=breaker,
+                    flights=flights,
+                    discovery=discovery,
+                )
+
+            if lease_store is None:
+                # When probing, completed rows are exactly what we want to refresh
+                skip_rows = set() if probe else progress.completed_rows - redo_rows
+                fetch_progress, errs = await fetch_rows(ymin, ymax, redo_rows, skip_rows)
+            else:
+                fetch_progress, errs, leased_rows = await fetch_leases(
+                    lease_store,
+                    node,
+                    lambda lo, hi, rows: fetch_rows(lo, hi, rows, set(range(lo, hi + 1)) - rows, lease_renewer.lost),
+                    xmax - xmin + 1,
+                    lease_rows=lease_rows,
+                    message=reporter.message,
+                    renewer=lease_renewer,
+                )
+            if len(pool) > 1:
+                reporter.message(f"### Client pool: {pool}")
     except KeyboardInterrupt:
         print("User Aborted!", flush=True)
         abort = True
     finally:
+        reporter.stop()
+        if metrics_server is not None:
+            metrics_server.close()
+        if metrics_file is not None:
+            metrics.registry.dump(metrics_file)
+        if cache is not None:
+            cache.save()
+        if void_registry is not None:
+            void_registry.save()
+        if fingerprints is not None:
+            fingerprints.save()
         progress.completed_rows.update(fetch_progress.fetched_rows)
+        progress.row_stamps.update(fetch_progress.row_stamps)
         progress_proxy.completed_rows.update({k: None for k in progress.completed_rows})
+        progress_proxy.row_stamps.update(progress.row_stamps)
 
+        processor_team.stop_feeder()
+        print(f"Processor queue feeder: {processor_feeder}")
         backlog = processor_team.backlog_size, recorder_team.backlog_size
         print(f"Waiting for Workers to finish (queued jobs = {backlog})", flush=True)
         processor_team.wait_safed()
@@ -180,9 +395,19 @@ async def async_main(
             progress.failed_rows.add(coord.y)
         coordfail_q.close()
 
-        progress.regions.update(progress_proxy.regions)
+        # The recorder has written into the store directly, including the removal of vanished regions
+        progress.regions = progress_proxy.regions.to_dict()
+        progress_proxy.regions.close()
+        progress.partial_rows = {row: TileBitmap(raw) for row, raw in progress_proxy.partial_rows.items()}
+        progress.drop_finished_partials()
         progress.write_to_path(state_file_path)
 
+        if lease_store is not None:
+            completed, released = report_leases(lease_store, node, leased_rows, progress, lease_renewer)
+            lease_renewer.stop()
+            print(f"Leases: {completed:,} rows completed, {released:,} rows released; {lease_store.counts()}")
+            lease_store.close()
+
         while not err_q.empty():
             errs.append(err_q.get())
         err_q.close()
@@ -199,6 +424,10 @@ async def async_main(
     if abort:
         sys.exit(1)
 
+    if lease_db is not None:
+        print("Not building the maps of just the leased rows; merge results with 'python -m mosaic_v3.leases'")
+        return
+
     build_world_maps(
         progress.regions,
         progress.completed_rows,
@@ -220,7 +449,7 @@ async def async_main(
         print("  No Errors")
     if progress.failed_rows:
         print(f"Last run failed on rows {sorted(progress.failed_rows)}")
-        print("  Will be force-read the next run")
+        print("  Will be force-read the next run (only their missing tiles, where known)")
     else:
         print("  No Failed Rows")
 
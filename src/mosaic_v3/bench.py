@@ -0,0 +1,411 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Benchmarks for tuning the fetch layer.
+
+    python -m mosaic_v3.bench transport [--tiles N] [--clients 1,4] [--in-flight N]
+    python -m mosaic_v3.bench dispatch [--width N] [--rows N] [--latency SECS]
+    python -m mosaic_v3.bench ipc [--tiles N] [--batch-sizes 1,32] [--processors N]
+
+"transport" compares HTTP/1.1 (keep-alive) against HTTP/2, with various numbers of pooled clients, fetching the
+same kind of tiles as a mosaic run. Every configuration gets its own (disjoint) random sample of tiles, so that
+no configuration benefits from tiles warmed up in the CDN's edge caches by another.
+
+"dispatch" compares the worker-pool dispatcher of async_fetch_area against a replica of the batch-and-poll loop it
+replaced, against a simulated map CDN (no network involved), so that only the dispatching differs. It measures the
+CPU time spent, the number of live tasks, and how long a result waits between its response arriving and it being
+handed to the callback.
+
+"ipc" pushes tiles through a team of TileProcessors and a TileRecorder, with various sizes of batches. The tiles are
+all voids, so the processors have no colours to calculate, and what's measured is the cost of the messages: tiles
+per second, messages per second into the processors' queue, and the CPU time per tile of this process (including
+the feeder thread) and of the workers.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import multiprocessing as MP
+import random
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Set
+
+from mosaic_v3.dispatcher import INITIAL_IN_FLIGHT, MAX_IN_FLIGHT, MIN_IN_FLIGHT, async_fetch_area
+from mosaic_v3.progress import MosaicProgress
+from mosaic_v3.workers import DEFA_BATCH_WAIT, WorkTeam
+from mosaic_v3.workers.recorder import TileRecorder
+from mosaic_v3.workers.tile_processor import TileProcessor
+from sl_maptools import MapCoord
+from sl_maptools.fetcher import JPEG_EOI, JPEG_SOI, BoundedMapFetcher, MapFetcher, RawTile
+from sl_maptools.metrics import FetchMetrics
+from sl_maptools.pool import ClientPool
+from sl_maptools.reporter import ProgressReporter
+from sl_maptools.retry import RetryPolicy
+from sl_maptools.throttle import AdaptiveLimiter, LatencyTracker
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows; the workers' CPU time won't be measured there
+    resource = None
+
+
+@dataclass
+class TransportResult:
+    label: str
+    tiles: int
+    elapsed: float
+    p50: Optional[float]
+    p95: Optional[float]
+    statuses: Dict[str, int]
+    errors: int
+
+    HEADER = (
+        f"{'config':<16} {'tiles':>6} {'secs':>8} {'tiles/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>6}  statuses"
+    )
+
+    def __str__(self):
+        def ms(v: Optional[float]) -> str:
+            return f"{v * 1000:,.0f}" if v is not None else "-"
+
+        statuses = ", ".join(f"{k}:{v}" for k, v in sorted(self.statuses.items()))
+        return (
+            f"{self.label:<16} {self.tiles:>6} {self.elapsed:>8.2f} {self.tiles / self.elapsed:>8.1f}"
+            f" {ms(self.p50):>8} {ms(self.p95):>8} {self.errors:>6}  {statuses}"
+        )
+
+
+async def bench_transport(coords: Sequence[MapCoord], http2: bool, clients: int, in_flight: int) -> TransportResult:
+    """
+    Fetch coords once (no retries) using the given transport configuration.
+
+    :param coords: Tiles to fetch
+    :param http2: Use HTTP/2 if True, HTTP/1.1 otherwise
+    :param clients: Number of pooled clients
+    :param in_flight: Maximum in-flight requests
+    :return: The measurements
+    """
+    metrics = FetchMetrics()
+    async with ClientPool.create(clients, http2=http2) as pool:
+        fetcher = BoundedMapFetcher(in_flight, pool, metrics=metrics, retry_policy=RetryPolicy(max_attempts=1))
+        start = time.monotonic()
+        results = await asyncio.gather(*(fetcher.async_fetch(co) for co in coords), return_exceptions=True)
+        elapsed = time.monotonic() - start
+    return TransportResult(
+        label=f"{'HTTP/2' if http2 else 'HTTP/1.1'} x{clients}",
+        tiles=len(coords),
+        elapsed=elapsed,
+        p50=fetcher.latencies.percentile(50),
+        p95=fetcher.latencies.percentile(95),
+        statuses={k[0]: int(v) for k, v in metrics.responses.items().items()},
+        errors=sum(1 for r in results if isinstance(r, Exception)),
+    )
+
+
+async def run_transport(opts: argparse.Namespace) -> List[TransportResult]:
+    configs = [(http2, clients) for clients in opts.clients for http2 in (False, True)]
+    population = [
+        MapCoord(x, y) for y in range(opts.ymin, opts.ymax + 1) for x in range(opts.xmin, opts.xmax + 1)
+    ]
+    sample = random.Random(opts.seed).sample(population, opts.tiles * len(configs))
+    results = []
+    print(TransportResult.HEADER, flush=True)
+    for i, (http2, clients) in enumerate(configs):
+        coords = sample[i * opts.tiles : (i + 1) * opts.tiles]
+        result = await bench_transport(coords, http2, clients, opts.in_flight)
+        print(result, flush=True)
+        results.append(result)
+    return results
+
+
+class _SimulatedResponse:
+    def __init__(self, status_code: int, content: bytes):
+        self.status_code = status_code
+        self.headers = {"Content-Length": str(len(content))}
+        self.content = content
+
+
+class SimulatedCDN:
+    """Quacks like httpx.AsyncClient; answers after an exponentially-distributed latency, remembering when"""
+
+    PAYLOAD = JPEG_SOI + b"\x00" * 4096 + JPEG_EOI
+
+    def __init__(self, latency: float, void_ratio: float = 0.5, seed: int = None):
+        self.latency = latency
+        self.void_ratio = void_ratio
+        self.rng = random.Random(seed)
+        self.answered: Dict[str, float] = {}
+
+    async def get(self, url: str, headers: Dict[str, str] = None) -> _SimulatedResponse:
+        await asyncio.sleep(self.rng.expovariate(1 / self.latency))
+        self.answered[url] = time.monotonic()
+        if self.rng.random() < self.void_ratio:
+            return _SimulatedResponse(403, b"")
+        return _SimulatedResponse(200, self.PAYLOAD)
+
+
+async def legacy_fetch_area(
+    client: SimulatedCDN,
+    x_min: int,
+    x_max: int,
+    y_min: int,
+    y_max: int,
+    callback: Callable[[RawTile], None],
+    low_water: int = MAX_IN_FLIGHT * 2,
+    batch_size: int = 2000,
+    batch_wait: float = 2.5,
+) -> None:
+    """The dispatching loop of async_fetch_area before it became a worker pool, minus the bookkeeping"""
+    coords_g = (MapCoord(x, y) for y in range(y_max, y_min - 1, -1) for x in range(x_min, x_max + 1))
+    coords_g_done = False
+    pending_tasks: Set[asyncio.Task] = set()
+    limiter = AdaptiveLimiter(INITIAL_IN_FLIGHT, min_limit=MIN_IN_FLIGHT, max_limit=MAX_IN_FLIGHT)
+    bfetcher = BoundedMapFetcher(MAX_IN_FLIGHT, client, limiter=limiter, reporter=ProgressReporter(io.StringIO()))
+    while True:
+        if not coords_g_done and len(pending_tasks) < low_water:
+            for _ in range(batch_size):
+                if (coord := next(coords_g, None)) is None:
+                    coords_g_done = True
+                    break
+                pending_tasks.add(asyncio.create_task(bfetcher.async_fetch(coord)))
+        if not pending_tasks:
+            break
+        done, pending_tasks = await asyncio.wait(pending_tasks, timeout=batch_wait)
+        for fut in done:
+            if fut.exception() is None and (result := fut.result()) is not None:
+                callback(result)
+
+
+@dataclass
+class DispatchResult:
+    label: str
+    tiles: int
+    elapsed: float
+    cpu: float
+    peak_tasks: int
+    p50: Optional[float]
+    p95: Optional[float]
+    max_wait: float
+
+    HEADER = (
+        f"{'dispatcher':<12} {'tiles':>6} {'secs':>8} {'CPU ms/1k':>10} {'peak tasks':>10}"
+        f" {'wait p50 ms':>12} {'wait p95 ms':>12} {'wait max ms':>12}"
+    )
+
+    def __str__(self):
+        def ms(v: Optional[float]) -> str:
+            return f"{v * 1000:,.1f}" if v is not None else "-"
+
+        return (
+            f"{self.label:<12} {self.tiles:>6} {self.elapsed:>8.2f} {self.cpu * 1e6 / self.tiles:>10,.1f}"
+            f" {self.peak_tasks:>10,} {ms(self.p50):>12} {ms(self.p95):>12} {ms(self.max_wait):>12}"
+        )
+
+
+async def bench_dispatch(legacy: bool, width: int, rows: int, latency: float, seed: Optional[int]) -> DispatchResult:
+    """
+    Fetch a width x rows area from a SimulatedCDN, using either the legacy or the current dispatcher.
+
+    :param legacy: If True, use legacy_fetch_area(); async_fetch_area() otherwise
+    :param width: Width of the area
+    :param rows: Height of the area
+    :param latency: Mean latency of the simulated CDN
+    :param seed: Seed of the simulated CDN's randomness
+    :return: The measurements
+    """
+    cdn = SimulatedCDN(latency, seed=seed)
+    waits = LatencyTracker(maxlen=width * rows)
+    peak_tasks = 0
+
+    def callback(result) -> None:
+        if isinstance(result, str):
+            return
+        coord = result[0]
+        url = MapFetcher.URL_TEMPLATE.format(zoom=1, map_x=coord.x, map_y=coord.y)
+        waits.add(time.monotonic() - cdn.answered[url])
+
+    async def sample_tasks() -> None:
+        nonlocal peak_tasks
+        while True:
+            peak_tasks = max(peak_tasks, len(asyncio.all_tasks()))
+            await asyncio.sleep(0.01)
+
+    sampler = asyncio.create_task(sample_tasks())
+    start, cpu_start = time.monotonic(), time.process_time()
+    if legacy:
+        await legacy_fetch_area(cdn, 0, width - 1, 0, rows - 1, callback)
+    else:
+        reporter = ProgressReporter(io.StringIO())
+        await async_fetch_area(cdn, 0, width - 1, 0, rows - 1, callback, redo_rows=[], reporter=reporter)
+    elapsed, cpu = time.monotonic() - start, time.process_time() - cpu_start
+    sampler.cancel()
+    return DispatchResult(
+        label="polling" if legacy else "worker pool",
+        tiles=width * rows,
+        elapsed=elapsed,
+        cpu=cpu,
+        peak_tasks=peak_tasks,
+        p50=waits.percentile(50),
+        p95=waits.percentile(95),
+        max_wait=waits.percentile(100) or 0.0,
+    )
+
+
+async def run_dispatch(opts: argparse.Namespace) -> List[DispatchResult]:
+    results = []
+    print(DispatchResult.HEADER, flush=True)
+    for legacy in (True, False):
+        result = await bench_dispatch(legacy, opts.width, opts.rows, opts.latency, opts.seed)
+        print(result, flush=True)
+        results.append(result)
+    return results
+
+
+@dataclass
+class IPCResult:
+    batch_size: int
+    tiles: int
+    elapsed: float
+    messages: int
+    cpu: float
+    workers_cpu: Optional[float]
+
+    HEADER = (
+        f"{'batch':>6} {'tiles':>7} {'secs':>7} {'tiles/s':>9} {'msgs/s':>9}"
+        f" {'CPU us/tile':>12} {'workers us/tile':>16}"
+    )
+
+    def __str__(self):
+        workers = f"{self.workers_cpu * 1e6 / self.tiles:,.1f}" if self.workers_cpu is not None else "-"
+        return (
+            f"{self.batch_size:>6} {self.tiles:>7} {self.elapsed:>7.2f} {self.tiles / self.elapsed:>9,.0f}"
+            f" {self.messages / self.elapsed:>9,.0f} {self.cpu * 1e6 / self.tiles:>12,.1f} {workers:>16}"
+        )
+
+
+def _workers_cpu() -> Optional[float]:
+    """CPU time of all child processes that have ended (and been waited for)"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def bench_ipc(batch_size: int, batch_wait: float, tiles: int, processors: int, width: int = 2001) -> IPCResult:
+    """
+    Push void tiles through TileProcessors into a TileRecorder.
+
+    :param batch_size: Maximum tiles per message
+    :param batch_wait: Maximum time (seconds) to wait for a batch to fill up
+    :param tiles: Number of tiles
+    :param processors: Number of TileProcessors
+    :param width: Width of the rows the tiles are in
+    :return: The measurements; the workers' CPU time includes their startup and shutdown
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        mgr = MP.Manager()
+        progress_proxy = MosaicProgress().get_proxies(mgr)
+        coordfail_q = MP.Queue()
+        err_q = MP.Queue()
+        workers_cpu_start = _workers_cpu()
+        recorder_team = WorkTeam(
+            num_workers=1,
+            worker_class=TileRecorder,
+            progress_proxy=progress_proxy,
+            progress_file=Path(tmpdir) / "state.msgp",
+            coordfail_q=coordfail_q,
+        )
+        recorder_team.start()
+        processor_team = WorkTeam(
+            num_workers=processors,
+            worker_class=TileProcessor,
+            output_q=recorder_team.command_queue,
+            coordfail_q=coordfail_q,
+            err_q=err_q,
+        )
+        processor_team.start()
+        processor_team.wait_ready()
+        recorder_team.wait_ready()
+        feeder = processor_team.start_feeder(batch_size, batch_wait)
+
+        start, cpu_start = time.monotonic(), time.process_time()
+        for i in range(tiles):
+            y, x = divmod(i, width)
+            processor_team.submit((MapCoord(x, y), b""))
+        while recorder_team.done_count < tiles:
+            time.sleep(0.001)
+        elapsed, cpu = time.monotonic() - start, time.process_time() - cpu_start
+        messages = feeder.messages
+
+        processor_team.wait_safed(quiet=True)
+        processor_team.disband()
+        recorder_team.wait_safed(quiet=True)
+        recorder_team.disband()
+        workers_cpu = None if workers_cpu_start is None else _workers_cpu() - workers_cpu_start
+        progress_proxy.regions.close()
+        mgr.shutdown()
+    return IPCResult(batch_size, tiles, elapsed, messages, cpu, workers_cpu)
+
+
+def run_ipc(opts: argparse.Namespace) -> List[IPCResult]:
+    results = []
+    print(IPCResult.HEADER, flush=True)
+    for batch_size in opts.batch_sizes:
+        result = bench_ipc(batch_size, opts.batch_wait, opts.tiles, opts.processors)
+        print(result, flush=True)
+        results.append(result)
+    return results
+
+
+def options() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "python -m mosaic_v3.bench", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="bench", required=True)
+
+    transport = subparsers.add_parser("transport", help="Compare HTTP/1.1 and HTTP/2, with pools of clients")
+    transport.add_argument("--tiles", type=int, default=1000, help="Tiles to fetch per configuration")
+    transport.add_argument(
+        "--clients", type=lambda s: [int(c) for c in s.split(",")], default=[1, 4], help="Comma-separated pool sizes"
+    )
+    transport.add_argument("--in-flight", type=int, default=100, help="Maximum in-flight requests")
+    transport.add_argument("--xmin", type=int, default=900)
+    transport.add_argument("--xmax", type=int, default=1100)
+    transport.add_argument("--ymin", type=int, default=900)
+    transport.add_argument("--ymax", type=int, default=1100)
+    transport.add_argument("--seed", type=int, default=None, help="Seed for sampling tiles")
+    transport.set_defaults(runner=run_transport)
+
+    dispatch = subparsers.add_parser("dispatch", help="Compare the worker-pool dispatcher against the polling loop")
+    dispatch.add_argument("--width", type=int, default=2001, help="Width of the (simulated) area to fetch")
+    dispatch.add_argument("--rows", type=int, default=10, help="Number of rows to fetch")
+    dispatch.add_argument("--latency", type=float, default=0.05, help="Mean latency (seconds) of the simulated CDN")
+    dispatch.add_argument("--seed", type=int, default=None, help="Seed of the simulated CDN")
+    dispatch.set_defaults(runner=run_dispatch)
+
+    ipc = subparsers.add_parser("ipc", help="Compare sizes of batches of tiles sent to the TileProcessors")
+    ipc.add_argument("--tiles", type=int, default=20000, help="Tiles to push through per batch size")
+    ipc.add_argument(
+        "--batch-sizes",
+        type=lambda s: [int(b) for b in s.split(",")],
+        default=[1, 8, 32, 128],
+        help="Comma-separated batch sizes",
+    )
+    ipc.add_argument("--batch-wait", type=float, default=DEFA_BATCH_WAIT, help="Seconds to wait for a batch to fill")
+    ipc.add_argument("--processors", type=int, default=4, help="Number of TileProcessors")
+    ipc.set_defaults(runner=run_ipc)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    _opts = options()
+    if asyncio.iscoroutinefunction(_opts.runner):
+        asyncio.run(_opts.runner(_opts))
+    else:
+        _opts.runner(_opts)
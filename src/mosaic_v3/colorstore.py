@@ -0,0 +1,170 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+A store of DominantColors per region living in shared memory, so that all processes can read and write it directly,
+instead of going through a SyncManager process for every access.
+
+The store is a fixed array covering the whole grid, in two planes:
+
+- flags: one byte per cell, nonzero if the cell holds a region's colours
+- colours: 14 RGB triples (42 bytes) per cell, in the order of KEYS
+
+Cells are indexed by y * width + x. With the world being 2001x2001, that's ~4 MiB of flags and ~160 MiB of colours;
+pages that are never written (i.e., most of the ocean) are never actually allocated by the OS, though.
+"""
+from __future__ import annotations
+
+import re
+from multiprocessing import shared_memory
+from typing import Dict, Iterator, Mapping, Optional, Tuple
+
+from mosaic_v3.color_processing import DominantColors
+from sl_maptools import MapCoord
+
+# Same as config.WORLD_WIDTH and config.WORLD_HEIGHT
+DEFA_WIDTH = 2001
+DEFA_HEIGHT = 2001
+
+KEYS: Tuple[str, ...] = tuple(DominantColors.CropBox.keys())
+COLORS_SIZE = 3 * len(KEYS)
+
+FLAG_REGION = 0x01
+
+_ANY_FLAG = re.compile(rb"[^\x00]")
+
+
+class ColorStore:
+    """
+    A mapping of MapCoord to DominantColors backed by shared memory.
+
+    The process that create()s the store owns it, and must close() it when done, which frees the shared memory. Other
+    processes get it attached when the store is passed to them (pickled, or inherited by forking). There's no locking:
+    there must be only one writer at a time, e.g., the TileRecorder.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, width: int, height: int, owner: bool):
+        """
+        Use create() or attach() instead.
+        """
+        self._shm = shm
+        self.width = width
+        self.height = height
+        self.owner = owner
+        cells = width * height
+        self._flags = shm.buf[:cells]
+        self._colors = shm.buf[cells : cells * (1 + COLORS_SIZE)]
+
+    @classmethod
+    def create(cls, width: int = DEFA_WIDTH, height: int = DEFA_HEIGHT) -> ColorStore:
+        """
+        Create a new, empty store.
+
+        :param width: Width of the grid
+        :param height: Height of the grid
+        :return: The new store, owned by the calling process
+        """
+        # New shared memory comes zero-filled, i.e., without any region
+        shm = shared_memory.SharedMemory(create=True, size=width * height * (1 + COLORS_SIZE))
+        return cls(shm, width, height, owner=True)
+
+    @classmethod
+    def attach(cls, name: str, width: int, height: int) -> ColorStore:
+        """Attach to an existing store by the name of its shared memory"""
+        return cls(shared_memory.SharedMemory(name=name), width, height, owner=False)
+
+    @classmethod
+    def from_regions(
+        cls, regions: Mapping[MapCoord, DominantColors], width: int = DEFA_WIDTH, height: int = DEFA_HEIGHT
+    ) -> ColorStore:
+        """Create a new store holding regions"""
+        store = cls.create(width, height)
+        store.update(regions)
+        return store
+
+    def __reduce__(self):
+        return self.attach, (self.name, self.width, self.height)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def close(self) -> None:
+        """Detach from the shared memory; if we own it, also free it"""
+        self._flags.release()
+        self._colors.release()
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+    def __enter__(self) -> ColorStore:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _index(self, coord: MapCoord) -> Optional[int]:
+        if not (0 <= coord.x < self.width and 0 <= coord.y < self.height):
+            return None
+        return coord.y * self.width + coord.x
+
+    def __setitem__(self, coord: MapCoord, domc: DominantColors) -> None:
+        if (idx := self._index(coord)) is None:
+            raise IndexError(f"{coord} is outside of the {self.width}x{self.height} grid")
+        off = idx * COLORS_SIZE
+        self._colors[off : off + COLORS_SIZE] = bytes(c for key in KEYS for c in domc[key])
+        # Flag last, so a new region is never seen with half-written colours
+        self._flags[idx] = FLAG_REGION
+
+    def __getitem__(self, coord: MapCoord) -> DominantColors:
+        if (idx := self._index(coord)) is None or not self._flags[idx]:
+            raise KeyError(coord)
+        off = idx * COLORS_SIZE
+        raw = self._colors[off : off + COLORS_SIZE].tobytes()
+        domc = DominantColors()
+        for i, key in enumerate(KEYS):
+            domc[key] = tuple(raw[i * 3 : i * 3 + 3])
+        return domc
+
+    def __delitem__(self, coord: MapCoord) -> None:
+        if (idx := self._index(coord)) is None or not self._flags[idx]:
+            raise KeyError(coord)
+        self._flags[idx] = 0
+
+    def __contains__(self, coord: MapCoord) -> bool:
+        idx = self._index(coord)
+        return idx is not None and bool(self._flags[idx])
+
+    def get(self, coord: MapCoord, default: DominantColors = None) -> Optional[DominantColors]:
+        return self[coord] if coord in self else default
+
+    def pop(self, coord: MapCoord, default: DominantColors = None) -> Optional[DominantColors]:
+        """Remove coord, returning its colours, or default if it's not in the store"""
+        domc = self.get(coord, default)
+        if coord in self:
+            del self[coord]
+        return domc
+
+    def update(self, regions: Mapping[MapCoord, DominantColors]) -> None:
+        for coord, domc in regions.items():
+            self[coord] = domc
+
+    def keys(self) -> Iterator[MapCoord]:
+        """The coordinates of all regions, as of when iteration starts"""
+        # Scan a snapshot of the flags, as a regex does so at C speed
+        for m in _ANY_FLAG.finditer(self._flags.tobytes()):
+            y, x = divmod(m.start(), self.width)
+            yield MapCoord(x, y)
+
+    __iter__ = keys
+
+    def items(self) -> Iterator[Tuple[MapCoord, DominantColors]]:
+        for coord in self.keys():
+            yield coord, self[coord]
+
+    def __len__(self) -> int:
+        return len(self._flags) - self._flags.tobytes().count(0)
+
+    def to_dict(self) -> Dict[MapCoord, DominantColors]:
+        """A copy of the store as a plain dict, e.g., for saving"""
+        return dict(self.items())
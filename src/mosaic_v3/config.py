@@ -3,16 +3,26 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import argparse
+import os
+import socket
 from pathlib import Path
 
 import appdirs
 
+from mosaic_v3.dispatcher import DEFA_TILE_RETRIES, DEFA_TILE_RETRY_DELAY
+from mosaic_v3.leases import DEFA_LEASE_ROWS, DEFA_LEASE_SECONDS
+from mosaic_v3.scheduler import SCHEDULES
+from mosaic_v3.workers import DEFA_BATCH_SIZE, DEFA_BATCH_WAIT
+from sl_maptools.cache import DEFAULT_CACHE_DIR
+
 __all__ = ["STATE_DIR", "NIGHTLIGHTS_NAME", "MOSAIC_NAME", "WORLD_WIDTH", "WORLD_HEIGHT", "options"]
 
 STATE_DIR = Path(appdirs.site_data_dir("sl-cartography"))
 STATE_FILE_NAME = "mosaic-state-v3-2.msgp"
 
 WORKERS = 10
+# Fetched tiles allowed to wait for the TileProcessors before fetching pauses; ~30 KiB each
+PROCESSOR_BACKLOG = 2000
 
 SAVE_DIR = Path(r"~\Pictures\SLMap").expanduser().absolute()
 NIGHTLIGHTS_NAME = "world-nightlights-3.png"
@@ -41,9 +51,133 @@ def options():
     parser.add_argument("--savedir", type=Path, default=SAVE_DIR, help="Directory to save the PNG files")
 
     parser.add_argument("--workers", type=int, default=WORKERS, help="Number of TileProcessor workers")
+    parser.add_argument(
+        "--processor-backlog",
+        type=int,
+        default=PROCESSOR_BACKLOG,
+        help="Tiles waiting for the TileProcessors beyond which fetching pauses; 0 for no limit",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFA_BATCH_SIZE,
+        help="Maximum tiles per message to the TileProcessors (and of results to the TileRecorder); 1 to not batch",
+    )
+    parser.add_argument(
+        "--batch-wait",
+        type=float,
+        default=DEFA_BATCH_WAIT,
+        help="Maximum seconds to wait for a batch of tiles to fill up",
+    )
+
+    parser.add_argument(
+        "--tilecache",
+        type=Path,
+        nargs="?",
+        const=DEFAULT_CACHE_DIR,
+        default=None,
+        help=f"Use an on-disk tile cache; if no directory given, uses {DEFAULT_CACHE_DIR}",
+    )
+    parser.add_argument("--tilecache-size", type=int, default=2048, help="Size cap of the tile cache, in MiB")
+
+    parser.add_argument(
+        "--discover",
+        action="store_true",
+        help="Use low-zoom tiles to avoid requesting void tiles at full resolution. Only blocks the CDN reports as void"
+        " are skipped; areas merely looking empty at low zoom (maybe open water) are still fetched, unless known voids",
+    )
+
+    parser.add_argument("--no-voids", dest="voids", action="store_false", help="Don't use the void registry")
+    parser.add_argument(
+        "--void-reprobe", type=float, default=0.05, help="Fraction of known voids (oldest first) to re-probe this run"
+    )
+
+    parser.add_argument(
+        "--schedule",
+        choices=SCHEDULES,
+        default="topdown",
+        help="Order of fetching: rows top-down; densest rows, rows failed last run, or least recently completed rows"
+        " first; or bands of rows along a Hilbert curve (for CDN cache locality). 'density' and 'stale' order rows"
+        " completed before, so they need --probe",
+    )
+
+    parser.add_argument(
+        "--probe",
+        action="store_true",
+        help="Revisit completed rows too, but HEAD-probe tiles first and only fetch those that changed",
+    )
+
+    parser.add_argument("--rate-limit", type=float, default=None, help="Maximum requests per second to the map CDN")
+    parser.add_argument("--bandwidth-limit", type=float, default=None, help="Maximum KiB per second from the map CDN")
+
+    parser.add_argument("--retry-attempts", type=int, default=6, help="Maximum attempts per tile")
+    parser.add_argument(
+        "--retry-jitter",
+        choices=["none", "full", "equal", "decorrelated"],
+        default="full",
+        help="Jitter strategy of the exponential backoff between attempts",
+    )
+    parser.add_argument(
+        "--retry-budget", type=int, default=None, help="Maximum number of retries for the whole run (default: no limit)"
+    )
+
+    parser.add_argument(
+        "--tile-retries",
+        type=int,
+        default=DEFA_TILE_RETRIES,
+        help="Times a tile that failed to be fetched is put back in the queue, before leaving it to the next run",
+    )
+    parser.add_argument(
+        "--tile-retry-delay",
+        type=float,
+        default=DEFA_TILE_RETRY_DELAY,
+        help="Seconds before a failed tile is put back in the queue; doubles every time",
+    )
+
+    parser.add_argument(
+        "--hedge",
+        type=float,
+        nargs="?",
+        const=0.05,
+        default=None,
+        metavar="BUDGET",
+        help="Hedge requests slower than the p95 latency, up to BUDGET (default 0.05) extra requests",
+    )
+
+    parser.add_argument(
+        "--clients", type=int, default=1, help="Number of HTTP clients (hence connections) to spread requests over"
+    )
+    parser.add_argument("--http1", action="store_true", help="Use HTTP/1.1 (with keep-alive) instead of HTTP/2")
+
+    parser.add_argument(
+        "--metrics-port", type=int, default=None, help="Serve Prometheus metrics of the fetch layer on this local port"
+    )
+    parser.add_argument(
+        "--metrics-file", type=Path, default=None, help="Dump metrics to this file at the end of the run"
+    )
+
+    parser.add_argument(
+        "--lease-db",
+        type=Path,
+        default=None,
+        help="Work as one of several workers, fetching rows leased from this database (see mosaic_v3.leases)",
+    )
+    parser.add_argument(
+        "--node",
+        default=f"{socket.gethostname()}-{os.getpid()}",
+        help="Name of this worker in the lease database; also distinguishes its state file",
+    )
+    parser.add_argument("--lease-rows", type=int, default=DEFA_LEASE_ROWS, help="Rows to lease at a time")
+    parser.add_argument(
+        "--lease-seconds", type=float, default=DEFA_LEASE_SECONDS, help="Seconds before an unrenewed lease expires"
+    )
 
     opts = parser.parse_args()
 
+    if opts.lease_db is not None and opts.statefile == STATE_FILE_NAME:
+        # Several workers may run on the same machine
+        opts.statefile = f"{Path(STATE_FILE_NAME).stem}-{opts.node}{Path(STATE_FILE_NAME).suffix}"
+
     if opts.redo is not None:
         _redo: str = str(opts.redo)
         opts.redo = list(map(int, _redo.split(",")))
@@ -5,20 +5,37 @@ from __future__ import annotations
 
 import asyncio
 import time
-from asyncio import Task
 from collections import defaultdict
-from typing import Callable, Dict, Generator, Iterable, List, Optional, Set, Tuple
+from typing import AsyncGenerator, Callable, Container, Dict, Iterable, List, Optional, Set, Tuple
 
 import httpx
 
-from sl_maptools import MapCoord
-from sl_maptools.fetcher import BoundedMapFetcher, RawTile
+from mosaic_v3.progress import TileBitmap
+from mosaic_v3.scheduler import Scheduler
+from sl_maptools import MapBounds, MapCoord
+from sl_maptools.cache import FingerprintStore, TileCache, VoidRegistry
+from sl_maptools.fetcher import BoundedMapFetcher, DiscoveryMap, RawTile
+from sl_maptools.knowns import VERIFIED_VOIDS
+from sl_maptools.metrics import FetchMetrics
+from sl_maptools.pool import ClientPool
+from sl_maptools.reporter import ProgressReporter
+from sl_maptools.singleflight import SingleFlight
+from sl_maptools.retry import CircuitBreaker, RetryPolicy
+from sl_maptools.throttle import AdaptiveLimiter, RateLimiter
 
-BATCH_SIZE = 2000
-BATCH_WAIT = 2.5
+SAVE_EVERY = 2000
 ABORT_WAIT = 5.0
+MIN_IN_FLIGHT = 20
+INITIAL_IN_FLIGHT = 100
 MAX_IN_FLIGHT = 500
-DEFA_LOW_WATER = MAX_IN_FLIGHT * 2
+# Enough workers to saturate the in-flight limiter at its maximum; the limiter is what actually bounds concurrency
+DEFA_WORKERS = MAX_IN_FLIGHT
+# Tiles whose fetch failed (i.e., after exhausting the RetryPolicy) are retried that many more times in the same run
+DEFA_TILE_RETRIES = 3
+DEFA_TILE_RETRY_DELAY = 10.0
+MAX_TILE_RETRY_DELAY = 120.0
+# How often to check whether backpressure has eased
+BACKPRESSURE_POLL = 0.05
 
 
 class FetchProgress:
@@ -35,13 +52,18 @@ class FetchProgress:
         self.regions_per_row: Dict[int, int] = defaultdict(int)
         self.row_starts: Dict[int, float] = {}
         self.fetched_rows: Set[int] = set()
+        self.row_stamps: Dict[int, float] = {}
 
     def inc_region(self, row: int) -> None:
         self.regions_per_row[row] += 1
 
-    def init(self, row: int) -> None:
+    def init(self, row: int, count: int = None) -> None:
+        """
+        :param row: Row to start tracking
+        :param count: Number of tiles that will be fetched for the row (default: the whole row)
+        """
         if row not in self.pending_per_row:
-            self.pending_per_row[row] = self.row_width
+            self.pending_per_row[row] = self.row_width if count is None else count
 
     def start(self, row: int) -> None:
         if row not in self.row_starts:
@@ -63,6 +85,15 @@ class FetchProgress:
         del self.pending_per_row[row]
         del self.row_starts[row]
         self.fetched_rows.add(row)
+        self.row_stamps[row] = time.time()
+
+    def merge(self, other: FetchProgress) -> None:
+        """Merge the progress of another fetch (of other rows) into this one"""
+        self.pending_per_row.update(other.pending_per_row)
+        self.regions_per_row.update(other.regions_per_row)
+        self.row_starts.update(other.row_starts)
+        self.fetched_rows |= other.fetched_rows
+        self.row_stamps.update(other.row_stamps)
 
     @property
     def pending_rows(self) -> Set[int]:
@@ -72,8 +103,40 @@ class FetchProgress:
         return item in self.fetched_rows or item in self.pending_per_row
 
 
+async def _discover(bfetcher: BoundedMapFetcher, bounds: MapBounds, reporter: ProgressReporter) -> DiscoveryMap:
+    start = time.monotonic()
+    reporter.message("### Discovering non-void tiles using low-zoom tiles ...")
+    dmap = await bfetcher.async_discover(bounds)
+    reporter.message(f"### Discovery: {dmap}, {time.monotonic() - start:,.2f} seconds")
+    return dmap
+
+
+async def async_discover_area(
+    client: httpx.AsyncClient | ClientPool,
+    bounds: MapBounds,
+    reporter: ProgressReporter,
+    limiter: AdaptiveLimiter = None,
+    **kwargs,
+) -> DiscoveryMap:
+    """
+    Perform a low-zoom discovery pass of an area, e.g., once for several calls of async_fetch_area() (see its
+    discovery param) rather than once per call.
+
+    :param client: The asynchronous HTTP client session (or pool of them) to use
+    :param bounds: The area
+    :param reporter: ProgressReporter to report progress into
+    :param limiter: The AdaptiveLimiter of in-flight requests, to be shared with the fetches that follow
+    :param kwargs: Passed on to BoundedMapFetcher, e.g., rate_limiter, retry_policy, breaker, metrics
+    :return: The DiscoveryMap of the area
+    """
+    if limiter is None:
+        limiter = AdaptiveLimiter(INITIAL_IN_FLIGHT, min_limit=MIN_IN_FLIGHT, max_limit=MAX_IN_FLIGHT)
+    bfetcher = BoundedMapFetcher(MAX_IN_FLIGHT, client, limiter=limiter, reporter=reporter, **kwargs)
+    return await _discover(bfetcher, bounds, reporter)
+
+
 async def async_fetch_area(
-    client: httpx.AsyncClient,
+    client: httpx.AsyncClient | ClientPool,
     x_min: int,
     x_max: int,
     y_min: int,
@@ -81,15 +144,33 @@ async def async_fetch_area(
     callback: Callable[[str | RawTile], None] = None,
     redo_rows: Iterable[int] = None,
     skip_rows: Set[int] = None,
-    low_water: int = DEFA_LOW_WATER,
-    batch_size: int = BATCH_SIZE,
-    save_every: int = BATCH_SIZE,
-    batch_wait: float = BATCH_WAIT,
+    workers: int = DEFA_WORKERS,
+    save_every: int = SAVE_EVERY,
+    cache: TileCache = None,
+    rate_limiter: RateLimiter = None,
+    discover: bool = False,
+    known_regions: Container[MapCoord] = None,
+    voids: VoidRegistry = None,
+    retry_policy: RetryPolicy = None,
+    hedge_budget: float = None,
+    metrics: FetchMetrics = None,
+    reporter: ProgressReporter = None,
+    fingerprints: FingerprintStore = None,
+    scheduler: Scheduler = None,
+    partial: Dict[int, TileBitmap] = None,
+    tile_retries: int = DEFA_TILE_RETRIES,
+    tile_retry_delay: float = DEFA_TILE_RETRY_DELAY,
+    backpressure: Callable[[], bool] = None,
+    abandon_rows: Container[int] = None,
+    limiter: AdaptiveLimiter = None,
+    breaker: CircuitBreaker = None,
+    flights: SingleFlight = None,
+    discovery: DiscoveryMap = None,
 ) -> Tuple[FetchProgress, List[str]]:
     """
     Asynchronously fetch a given area.
 
-    :param client: The asynchronous HTTP client session to use
+    :param client: The asynchronous HTTP client session (or pool of them) to use
     :param x_min: Leftmost coordinate
     :param x_max: Rightmost coordinate
     :param y_min: Bottommost coordinate
@@ -98,17 +179,51 @@ async def async_fetch_area(
     a tuple of (coord, bytes) for successful fetch, or a str ("SAVE" or "ROW:n" [where n is row number])
     :param redo_rows: Rows to force redo of fetching. This takes precedence over skip_rows
     :param skip_rows: Rows to skip fetching
-    :param low_water: If outstanding jobs are below this level, inject a new batch of jobs
-    :param batch_size: How many jobs to inject per injection
+    :param workers: Number of fetching coroutines, each pulling coordinates from a queue and handling the result as
+    soon as it arrives
     :param save_every: Inject "SAVE" after this many jobs
-    :param batch_wait: Time (seconds) to wait for async jobs before determining which ones are completed
+    :param cache: Optional on-disk tile cache to revalidate tiles against
+    :param rate_limiter: Optional requests/s & bytes/s limiter
+    :param discover: If True, perform a low-zoom discovery pass first, and don't fetch tiles it finds to be voids
+    (i.e., those in low-zoom tiles the CDN reports as void; see DiscoveryMap). Those tiles will be reported to
+    callback as voids without being fetched.
+    :param known_regions: Coordinates of regions known from previous runs; these are always fetched even if
+    discovery deems them void, so that a misclassification will never erase a known region
+    :param voids: Optional registry of known voids, which will be skipped (save for those due for re-probing)
+    :param retry_policy: Decides whether and when failed fetches are retried (default: RetryPolicy())
+    :param hedge_budget: If given, hedge slow requests, up to this fraction of extra requests
+    :param metrics: Optional FetchMetrics to record requests into
+    :param reporter: ProgressReporter to report progress into; if not given, one will be created (and started) just
+    for the duration of this function
+    :param fingerprints: If given, probe every tile with a HEAD request first, and only fetch those whose fingerprint
+    changed (or whose region appeared or vanished); the fingerprint of every tile fetched is recorded here
+    :param scheduler: Decides the order in which rows and tiles are fetched (default: rows top-down)
+    :param partial: Tiles already done of (some) rows; those tiles won't be fetched again when fetching those rows
+    :param tile_retries: How many times a tile whose fetch failed is put back in the queue, so its row can still
+    complete in this run
+    :param tile_retry_delay: Delay (seconds) before a failed tile is put back in the queue; doubles every time
+    :param backpressure: If given, a function returning True while whatever consumes the results of callback can't
+    keep up; no new fetch will be started until it returns False. Together with the number of workers, this caps the
+    number of fetched tiles being held in memory.
+    :param abandon_rows: If given, rows that may get added to it while fetching (e.g., rows whose lease got lost);
+    their tiles not fetched yet are dropped, leaving the rows incomplete
+    :param limiter: The AdaptiveLimiter of in-flight requests; if not given, one starting from INITIAL_IN_FLIGHT is
+    created. Pass the same one to successive calls (e.g., one per lease) so the limit carries over from one to the next
+    :param breaker: The CircuitBreaker; as with limiter, pass the same one to successive calls to keep its history
+    :param flights: The SingleFlight coalescing concurrent requests; may likewise be shared by successive calls
+    :param discovery: If discover, the result of a discovery pass covering (at least) the area, e.g., one done by
+    async_discover_area() once for several calls; if not given, a discovery pass of just the area is done
     :return: A tuple of final progress result (contains info such as which rows are still pending completion), and
     a list of error messages encountered during fetching.
     """
     callback = callback or (lambda x: None)
     skip_rows = skip_rows or set()
+    scheduler = scheduler or Scheduler()
+    partial = partial or {}
     tasks_done_count: int = 0
-    pending_tasks: Set[Task] = set()
+    busy_workers: int = 0
+    paused_workers: int = 0
+    paused_seconds: float = 0.0
     row_progress = FetchProgress(x_max - x_min + 1)
     exc_count: int = 0
     redo_rows: Set[int] = set(redo_rows)
@@ -116,13 +231,58 @@ async def async_fetch_area(
     _glob_rows_done: int = 0
     _glob_rows_uptonow = y_max - y_min + 1
 
-    def gen_coords() -> Generator[MapCoord, None, None]:
+    def finish_row(row: int) -> None:
+        nonlocal _glob_rows_done, _run_rows_success
+        row_elapsed = row_progress.elapsed(row)
+        row_regs = row_progress.regions_per_row[row]
+        row_progress.complete(row)
+        _glob_rows_done += 1
+        _run_rows_success += 1
+        global_elapsed = time.monotonic() - global_start
+        row_avg_time = global_elapsed / _run_rows_success
+        reporter.message(
+            f"Row {row} ({row_regs} regions) is done in {row_elapsed:,.2f} seconds,"
+            f" {row_avg_time:,.2f}s avg time per row"
+        )
+        callback(f"ROW:{row}")
+
+    def row_coords(y: int) -> List[MapCoord]:
+        """The coordinates of a row, minus those already done according to partial"""
+        done = partial.get(y)
+        return [MapCoord(x, y) for x in range(x_min, x_max + 1) if done is None or x not in done]
+
+    async def probe_row(row: List[MapCoord]) -> List[MapCoord]:
+        """Probe (the coordinates of) a row, returning only the coordinates that need fetching"""
+        to_fetch = []
+        to_probe = []
+        for co in row:
+            # These will be resolved without a request anyway
+            if co in bfetcher.skip_tiles or co in VERIFIED_VOIDS or (voids is not None and co in voids):
+                to_fetch.append(co)
+            else:
+                to_probe.append(co)
+        results = await asyncio.gather(*(bfetcher.async_probe(co) for co in to_probe), return_exceptions=True)
+        for co, result in zip(to_probe, results):
+            if isinstance(result, Exception):
+                # Can't tell, so play safe
+                to_fetch.append(co)
+                continue
+            _, fp = result
+            if fingerprints.has_changed(co, fp, known_region=known_regions is not None and co in known_regions):
+                to_fetch.append(co)
+            else:
+                reporter.count("unchanged")
+        return to_fetch
+
+    async def gen_coords() -> AsyncGenerator[MapCoord, None]:
         """
         Generate coordinates to fetch.
 
         The logic also considers:
         - Rows to be force-fetched
         - Rows to be skipped
+        - Tiles found unchanged by probing, if probing
+        - The order decided by the scheduler
 
         Note that force-fetch takes precedence over skip. So if a rownum is a member of both the
         force-fetched set and the skipped set, the rownum will be force-fetched.
@@ -130,116 +290,228 @@ async def async_fetch_area(
         :return: A generator that will emit a MapCoord every iteration
         """
         nonlocal _glob_rows_done
-        skipping = False
+        skipping_from: Optional[int] = None
         rowset: Set[int] = set(y for y in range(y_max, y_min - 1, -1)) | redo_rows
         # Reason why we don't just remove the skips from rowset, is so that we can put in a nice
         # "Skipping rows nnn ... nnn" notification there.
         _skips = skip_rows - redo_rows
+        rows_to_fetch: List[int] = []
         for y in sorted(rowset, reverse=True):
             if y in row_progress or y in _skips:
                 _glob_rows_done += 1
-                if not skipping:
-                    skipping = True
-                    print(f"\nSkipping rows {y}..", end="", flush=True)
+                if skipping_from is None:
+                    skipping_from = y
                 continue
-            if skipping:
-                skipping = False
-                print((y + 1), end="")
-            print(f"\nRow {y} begins", end="", flush=True)
-            row_progress.init(y)
-            for x in range(x_min, x_max + 1):
-                _coord = MapCoord(x, y)
+            if skipping_from is not None:
+                reporter.message(f"Skipping rows {skipping_from}..{y + 1}")
+                skipping_from = None
+            rows_to_fetch.append(y)
+        if skipping_from is not None:
+            reporter.message(f"Skipping rows {skipping_from}..{y_min}")
+
+        for band in scheduler.bands(rows_to_fetch):
+            band_coords: List[MapCoord] = []
+            for y in band:
+                if abandon_rows is not None and y in abandon_rows:
+                    reporter.message(f"Row {y} abandoned")
+                    continue
+                to_fetch = row_coords(y)
+                if y in partial:
+                    reporter.message(f"Row {y} begins ({len(to_fetch)} tiles missing)")
+                else:
+                    reporter.message(f"Row {y} begins")
+                if fingerprints is not None:
+                    to_fetch = await probe_row(to_fetch)
+                row_progress.init(y, len(to_fetch))
+                if not to_fetch:
+                    row_progress.start(y)
+                    finish_row(y)
+                band_coords.extend(to_fetch)
+            for _coord in scheduler.order_tiles(band_coords):
                 yield _coord
-        if skipping:
-            print(y_min, end="", flush=True)
-
-    coords_g = gen_coords()
-    coords_g_done = False
-    done: Set[asyncio.Task] = set()
-    abort = False
-    bfetcher = BoundedMapFetcher(MAX_IN_FLIGHT, client)
+
+    own_reporter = reporter is None
+    if own_reporter:
+        reporter = ProgressReporter().start()
+
+    coords_q: asyncio.Queue[Optional[MapCoord]] = asyncio.Queue(maxsize=workers)
+    if limiter is None:
+        limiter = AdaptiveLimiter(INITIAL_IN_FLIGHT, min_limit=MIN_IN_FLIGHT, max_limit=MAX_IN_FLIGHT)
+    if breaker is None:
+        breaker = CircuitBreaker(message=reporter.message)
+    bfetcher = BoundedMapFetcher(
+        MAX_IN_FLIGHT,
+        client,
+        cache=cache,
+        limiter=limiter,
+        rate_limiter=rate_limiter,
+        voids=voids,
+        retry_policy=retry_policy,
+        breaker=breaker,
+        metrics=metrics,
+        reporter=reporter,
+        hedge_budget=hedge_budget,
+        fingerprints=fingerprints,
+        flights=flights,
+    )
     global_start = time.monotonic()
     count = 0
     errs = []
-    while True:
-        if not coords_g_done and len(pending_tasks) < low_water:
-            print(f"\n### Adding (up to) {batch_size} jobs!", end="", flush=True)
-            for i in range(0, batch_size):
-                if (coord := next(coords_g, None)) is None:
-                    print(f"\n### {i} jobs submitted, no more jobs available", end="", flush=True)
-                    coords_g_done = True
-                    break
-                row_progress.start(coord.y)
-                new_task = asyncio.create_task(bfetcher.async_fetch(coord), name=f"fetch-{coord}")
-                pending_tasks.add(new_task)
+    reporter.add_source("done", lambda: tasks_done_count)
+    reporter.add_source("queued", lambda: coords_q.qsize())
+    reporter.add_source("busy", lambda: busy_workers)
+    if backpressure is not None:
+        reporter.add_source("paused", lambda: paused_workers)
+    reporter.add_source("exceptions", lambda: exc_count)
+    reporter.add_source("rows", lambda: f"{_glob_rows_done:,}/{_glob_rows_uptonow:,}")
+    reporter.add_source("in_flight", lambda: f"{limiter.in_flight}/{limiter.limit}")
+
+    if discover:
+        rows_to_fetch = (set(range(y_min, y_max + 1)) - skip_rows) | redo_rows
+        if rows_to_fetch:
+            if discovery is None:
+                disc_bounds = MapBounds(x_min, min(rows_to_fetch), x_max, max(rows_to_fetch))
+                discovery = await _discover(bfetcher, disc_bounds, reporter)
+            if known_regions:
+                discovery.candidates.update(co for co in known_regions if co in discovery.bounds)
+            bfetcher.skip_tiles = discovery.voids
+
+    # Coordinates put in the queue (or due to be put back in it) whose fate is not settled yet
+    unsettled: int = 0
+    settled = asyncio.Event()
+    tile_failures: Dict[MapCoord, int] = defaultdict(int)
+    retry_tasks: Set[asyncio.Task] = set()
+
+    def settle() -> None:
+        nonlocal unsettled
+        unsettled -= 1
+        if unsettled == 0:
+            settled.set()
+
+    async def produce() -> None:
+        nonlocal unsettled
+        async for coord in gen_coords():
+            row_progress.start(coord.y)
+            unsettled += 1
+            await coords_q.put(coord)
+            reporter.count("submitted")
+        reporter.message("### No more jobs available")
+        # Failed tiles may still be put back in the queue
+        while unsettled:
+            settled.clear()
+            await settled.wait()
+        for _ in range(workers):
+            await coords_q.put(None)
+
+    async def requeue(coord: MapCoord, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await coords_q.put(coord)
+
+    def fetch_failed(coord: MapCoord, exc: Exception) -> None:
+        nonlocal unsettled, exc_count
+        errmess = f"{type(exc)}: {exc}"
+        tile_failures[coord] += 1
+        if (failures := tile_failures[coord]) <= tile_retries:
+            delay = min(tile_retry_delay * 2 ** (failures - 1), MAX_TILE_RETRY_DELAY)
+            reporter.message(f"!!! fetch-{coord} Exception {errmess}; requeued, retrying in {delay:,.0f}s")
+            reporter.count("requeued")
+            unsettled += 1
+            task = asyncio.create_task(requeue(coord, delay), name=f"requeue-{coord}")
+            retry_tasks.add(task)
+            task.add_done_callback(retry_tasks.discard)
+            return
+        reporter.message(f"!!! fetch-{coord} Exception {errmess}; giving up after {failures} failures")
+        errs.append(errmess)
+        exc_count += 1
+
+    def handle(result: Optional[RawTile]) -> None:
+        nonlocal count
+        if result is None:
+            return
 
+        res_y = result[0].y
+        if result[1] is not None:
+            row_progress.inc_region(res_y)
+
+        if row_progress.dec(res_y) == 0:
+            finish_row(res_y)
+
+        callback(result)
+        count += 1
+        if count >= save_every:
+            callback("SAVE")
+            count = 0
+
+    async def wait_backpressure() -> None:
+        nonlocal paused_workers, paused_seconds
+        if not backpressure():
+            return
+        paused_workers += 1
+        start = time.monotonic()
         try:
-            done, pending_tasks = await asyncio.wait(pending_tasks, timeout=batch_wait)
-        except ValueError as ve:
-            if str(ve) == "Set of Tasks/Futures is empty.":
-                break
-        except asyncio.CancelledError:
-            print(f"\n\nUser aborted!", flush=True)
-            abort = True
-            break
-
-        tasks_done_count += len(done)
-        for fut in done:
-            exc = fut.exception()
-            if isinstance(exc, Exception):
-                errmess = f"{type(exc)}: {exc}"
-                print(f"\n!!! {fut.get_name()} Exception {errmess}", flush=True)
-                errs.append(errmess)
-                exc_count += 1
-                continue
+            while backpressure():
+                await asyncio.sleep(BACKPRESSURE_POLL)
+        finally:
+            paused_workers -= 1
+            paused_seconds += time.monotonic() - start
 
-            result: Optional[RawTile] = fut.result()
-            if result is None:
+    async def work() -> None:
+        nonlocal tasks_done_count, busy_workers
+        this_task = asyncio.current_task()
+        # async_fetch() swallows cancellation (returning None), so check whether we've been asked to stop
+        while not this_task.cancelling() and (coord := await coords_q.get()) is not None:
+            if abandon_rows is not None and coord.y in abandon_rows:
+                reporter.count("abandoned")
+                settle()
                 continue
+            if backpressure is not None:
+                await wait_backpressure()
+            busy_workers += 1
+            try:
+                result = await bfetcher.async_fetch(coord)
+            except Exception as exc:
+                fetch_failed(coord, exc)
+            else:
+                # Handled right away, rather than whenever a polling loop gets around to it
+                handle(result)
+            finally:
+                busy_workers -= 1
+                tasks_done_count += 1
+                settle()
 
-            res_y = result[0].y
-            if result[1] is not None:
-                row_progress.inc_region(res_y)
-
-            if row_progress.dec(res_y) == 0:
-                row_elapsed = row_progress.elapsed(res_y)
-                row_regs = row_progress.regions_per_row[res_y]
-                row_progress.complete(res_y)
-                _glob_rows_done += 1
-                _run_rows_success += 1
-                global_elapsed = time.monotonic() - global_start
-                row_avg_time = global_elapsed / _run_rows_success
-                print(
-                    f"\nRow {res_y} ({row_regs} regions) is done in {row_elapsed:,.2f} seconds,"
-                    f" {row_avg_time:,.2f}s avg time per row",
-                    end="",
-                    flush=True,
-                )
-                callback(f"ROW:{res_y}")
-
-            callback(result)
-            count += 1
-            if count >= save_every:
-                callback("SAVE")
-                count = 0
-
-        print(
-            f"\n"
-            f" Run: {tasks_done_count:,} done, {len(pending_tasks)} pending, {exc_count} exceptions."
-            f" Global: {_glob_rows_done:,}/{_glob_rows_uptonow:,} rows.",
-            end="",
-            flush=True,
-        )
-        if coords_g_done and not pending_tasks:
-            break
-    if abort or pending_tasks:
-        for t in pending_tasks:
+    tasks = [asyncio.create_task(produce(), name="produce")]
+    tasks.extend(asyncio.create_task(work(), name=f"work-{i}") for i in range(workers))
+    try:
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        reporter.message("User aborted!")
+    finally:
+        tasks.extend(retry_tasks)
+        for t in tasks:
             t.cancel()
-        _, _ = await asyncio.wait(pending_tasks, timeout=ABORT_WAIT)
+        _, _ = await asyncio.wait(tasks, timeout=ABORT_WAIT)
     global_elapsed = time.monotonic() - global_start
-    print(
-        f"\n### Fetching is complete, {global_elapsed:,.2f} seconds."
-        f" {sum(row_progress.regions_per_row.values())} regions fetched.",
-        flush=True,
+    reporter.flush()
+    reporter.message(
+        f"### Fetching is complete, {global_elapsed:,.2f} seconds."
+        f" {sum(row_progress.regions_per_row.values())} regions fetched."
+    )
+    reporter.message(f"### In-flight limit history: {limiter.history_summary()}")
+    reporter.message(
+        f"### Retries: {bfetcher.retry_policy.retries:,}, circuit breaker: {breaker};"
+        f" {sum(tile_failures.values()):,} failed fetches of {len(tile_failures):,} tiles, {exc_count:,} given up"
     )
+    reporter.message(f"### Coalescing: {bfetcher.flights}")
+    if backpressure is not None:
+        reporter.message(f"### Backpressure: workers spent {paused_seconds:,.1f} seconds paused in total")
+    if hedge_budget is not None:
+        reporter.message(f"### Hedging: {bfetcher.hedge_stats}")
+    if cache is not None:
+        reporter.message(f"### Tile cache: {cache.stats}")
+    if voids is not None:
+        reporter.message(f"### Void registry: {voids.stats}")
+    if fingerprints is not None:
+        reporter.message(f"### Freshness probes: {fingerprints.stats}")
+    if own_reporter:
+        reporter.stop()
     return row_progress, errs
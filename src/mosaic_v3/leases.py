@@ -0,0 +1,400 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Lease-based assignment of rows, so several mosaic_v3 processes (on one or more machines) can share one crawl.
+
+A coordinator seeds a SQLite database with the rows to fetch; every worker process (python -m mosaic_v3 --lease-db)
+then repeatedly claims a few rows for a limited time, fetches and colour-processes them, and reports the regions
+found back into the database. Leases are renewed while being worked on; a lease that expires (its worker died or
+got stuck) is handed out again to whoever claims next. Finally, the coordinator merges the results into a
+MosaicProgress.
+
+    python -m mosaic_v3.leases --db crawl.sqlite init --state STATEFILE [--ymin N] [--ymax N]
+    python -m mosaic_v3.leases --db crawl.sqlite status
+    python -m mosaic_v3.leases --db crawl.sqlite merge --state STATEFILE
+
+SQLite's locking is reliable on local filesystems only; with workers on several machines, make sure the database
+lives on a filesystem known to get locking right.
+"""
+from __future__ import annotations
+
+import argparse
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import msgpack
+
+from mosaic_v3.color_processing import DominantColors
+from mosaic_v3.dispatcher import FetchProgress
+from mosaic_v3.progress import MosaicProgress
+from sl_maptools import MapCoord
+from sl_maptools.utils import make_backup
+
+DEFA_LEASE_SECONDS = 600.0
+DEFA_LEASE_ROWS = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    row INTEGER PRIMARY KEY,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    completed REAL,
+    regions BLOB
+)
+"""
+
+
+@dataclass(frozen=True)
+class Lease:
+    owner: str
+    rows: Tuple[int, ...]
+    expires: float
+
+    def __str__(self):
+        return f"rows {min(self.rows)}..{max(self.rows)} ({len(self.rows)}) for {self.owner}"
+
+
+class LeaseStore:
+    """
+    The database of rows and their leases. Each row is in one of these states:
+
+    - "pending": waiting to be claimed
+    - "leased": claimed by an owner, until it expires (after which it can be claimed again)
+    - "done": fetched, with the regions found in it recorded
+    """
+
+    def __init__(self, path: Path, lease_seconds: float = DEFA_LEASE_SECONDS):
+        """
+        :param path: The SQLite database file; created if it does not exist
+        :param lease_seconds: How long a lease lasts before having to be renewed
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        # Autocommit mode, so that transactions are exactly where we put them
+        self._db = sqlite3.connect(path, timeout=60.0, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(_SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # IMMEDIATE takes the write lock upfront, so two claimers can't both read the same rows as claimable
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def __enter__(self) -> LeaseStore:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add_rows(self, rows: Iterable[int]) -> int:
+        """
+        Add rows to be fetched; rows already known keep their state.
+
+        :param rows: The rows
+        :return: Number of rows actually added
+        """
+        with self._transaction():
+            cur = self._db.executemany("INSERT OR IGNORE INTO rows (row) VALUES (?)", ((r,) for r in rows))
+        return cur.rowcount
+
+    def claim(self, owner: str, count: int = DEFA_LEASE_ROWS, now: float = None) -> Optional[Lease]:
+        """
+        Lease up to count rows, topmost first; expired leases are up for grabs just like pending rows.
+
+        :param owner: Who is claiming
+        :param count: Maximum number of rows to lease
+        :param now: Current time (default: time.time())
+        :return: The lease, or None if there's nothing left to lease
+        """
+        now = time.time() if now is None else now
+        expires = now + self.lease_seconds
+        with self._transaction():
+            rows = [
+                r
+                for (r,) in self._db.execute(
+                    "SELECT row FROM rows WHERE state = 'pending' OR (state = 'leased' AND expires < ?)"
+                    " ORDER BY row DESC LIMIT ?",
+                    (now, count),
+                )
+            ]
+            self._db.executemany(
+                "UPDATE rows SET state = 'leased', owner = ?, expires = ?, attempts = attempts + 1 WHERE row = ?",
+                ((owner, expires, r) for r in rows),
+            )
+        if not rows:
+            return None
+        return Lease(owner, tuple(rows), expires)
+
+    def renew(self, owner: str, now: float = None) -> Set[int]:
+        """
+        Extend all leases held by owner.
+
+        :param owner: Whose leases to renew
+        :param now: Current time (default: time.time())
+        :return: Rows still held by owner (leases that had expired and got claimed by someone else are lost)
+        """
+        now = time.time() if now is None else now
+        with self._transaction():
+            self._db.execute(
+                "UPDATE rows SET expires = ? WHERE owner = ? AND state = 'leased'", (now + self.lease_seconds, owner)
+            )
+        held = self._db.execute("SELECT row FROM rows WHERE owner = ? AND state = 'leased'", (owner,))
+        return set(r for (r,) in held)
+
+    def complete(self, owner: str, row: int, regions: Dict[MapCoord, DominantColors], now: float = None) -> bool:
+        """
+        Report the regions found in a row. Results are accepted even if the lease was lost in the meantime (they are
+        just as good), unless someone else has completed the row already.
+
+        :param owner: Who fetched the row
+        :param row: The row
+        :param regions: The regions found in the row
+        :param now: Current time (default: time.time())
+        :return: True if the results were accepted
+        """
+        now = time.time() if now is None else now
+        payload = msgpack.packb([(coord.encode(), domc.encode()) for coord, domc in regions.items()])
+        with self._transaction():
+            cur = self._db.execute(
+                "UPDATE rows SET state = 'done', owner = ?, expires = NULL, completed = ?, regions = ?"
+                " WHERE row = ? AND state != 'done'",
+                (owner, now, payload, row),
+            )
+        return cur.rowcount == 1
+
+    def release(self, owner: str, rows: Iterable[int]) -> None:
+        """Give back rows (e.g., failed ones) so they can be claimed again right away."""
+        with self._transaction():
+            self._db.executemany(
+                "UPDATE rows SET state = 'pending', owner = NULL, expires = NULL"
+                " WHERE row = ? AND owner = ? AND state = 'leased'",
+                ((r, owner) for r in rows),
+            )
+
+    def counts(self, now: float = None) -> Dict[str, int]:
+        """Number of rows per state, with expired leases counted separately"""
+        now = time.time() if now is None else now
+        result = {"pending": 0, "leased": 0, "expired": 0, "done": 0}
+        for state, expired, n in self._db.execute(
+            "SELECT state, state = 'leased' AND expires < ?, COUNT(*) FROM rows GROUP BY 1, 2", (now,)
+        ):
+            result["expired" if expired else state] += n
+        return result
+
+    def merge_into(self, progress: MosaicProgress) -> int:
+        """
+        Merge the results of all completed rows into progress.
+
+        :param progress: The MosaicProgress to merge into
+        :return: Number of rows merged
+        """
+        done = self._db.execute("SELECT row, completed, regions FROM rows WHERE state = 'done'").fetchall()
+        # The results replace whatever progress had for those rows, including regions that have since vanished
+        done_rows = set(row for row, _, _ in done)
+        for coord in [co for co in progress.regions if co.y in done_rows]:
+            del progress.regions[coord]
+        for row, completed, payload in done:
+            for coord, domc_raw in msgpack.unpackb(payload):
+                progress.regions[MapCoord(*coord)] = DominantColors.from_serialized(domc_raw)
+            progress.completed_rows.add(row)
+            progress.failed_rows.discard(row)
+            progress.partial_rows.pop(row, None)
+            progress.row_stamps[row] = completed
+        return len(done)
+
+
+class LeaseRenewer:
+    """
+    Renews the leases of an owner every lease_seconds / 3 from a background thread, so that renewal neither blocks
+    the event loop nor stops while it's blocked (e.g., while waiting for colour processing to finish). Rows that got
+    claimed by someone else in the meantime (because a renewal came too late) are collected in `lost`.
+
+    The thread uses its own connection to the database, as SQLite connections can't be shared between threads.
+    """
+
+    def __init__(self, store: LeaseStore, owner: str, message: Callable[[str], None] = print):
+        """
+        :param store: The lease store
+        :param owner: Whose leases to renew
+        :param message: Function to report problems with
+        """
+        self.path = store.path
+        self.lease_seconds = store.lease_seconds
+        self.owner = owner
+        self.message = message
+        self.lost: Set[int] = set()
+        self._held: Set[int] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"renew-{owner}", daemon=True)
+
+    def __enter__(self) -> LeaseRenewer:
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self) -> LeaseRenewer:
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop renewing; to be called only once the results of the leases have been reported"""
+        self._stop.set()
+        self._thread.join()
+
+    def track(self, rows: Iterable[int]) -> None:
+        """Start keeping an eye on newly-leased rows, so their loss is noticed"""
+        with self._lock:
+            self._held.update(rows)
+
+    def untrack(self, rows: Iterable[int]) -> None:
+        """Stop keeping an eye on rows, e.g., before giving them up, so that doesn't get mistaken for their loss"""
+        with self._lock:
+            self._held.difference_update(rows)
+
+    def _run(self) -> None:
+        with LeaseStore(self.path, lease_seconds=self.lease_seconds) as store:
+            while not self._stop.wait(self.lease_seconds / 3):
+                try:
+                    held = store.renew(self.owner)
+                except sqlite3.Error as e:
+                    self.message(f"!!! Renewing leases failed: {e}")
+                    continue
+                with self._lock:
+                    if lost := self._held - held:
+                        self._held -= lost
+                        self.lost.update(lost)
+                        self.message(f"!!! Leases lost: rows {sorted(lost)}")
+
+
+async def fetch_leases(
+    store: LeaseStore,
+    owner: str,
+    fetch: Callable[[int, int, Set[int]], Awaitable[Tuple[FetchProgress, List[str]]]],
+    row_width: int,
+    lease_rows: int = DEFA_LEASE_ROWS,
+    message: Callable[[str], None] = print,
+    renewer: LeaseRenewer = None,
+) -> Tuple[FetchProgress, List[str], Set[int]]:
+    """
+    Claim and fetch leases until there are none left, renewing them in the background.
+
+    Completing the rows is left to the caller, as the results are only known after colour processing has finished;
+    so should the leases be renewed until then, by passing a renewer that is only stopped after report_leases().
+
+    :param store: The lease store
+    :param owner: Name of this worker
+    :param fetch: Function fetching rows, given (y_min, y_max, rows), returning the same as async_fetch_area(); as
+    it gets called once per lease, it should share its limiter, circuit breaker, and discovery between calls
+    :param row_width: Width of the rows
+    :param lease_rows: Rows per lease
+    :param message: Function to report progress messages with
+    :param renewer: A started LeaseRenewer for owner; if not given, leases are only renewed while fetching
+    :return: A tuple of the combined progress of all fetches, the combined errors, and all rows that got leased
+    """
+    total = FetchProgress(row_width)
+    errs: List[str] = []
+    leased: Set[int] = set()
+
+    own_renewer = renewer is None
+    if own_renewer:
+        renewer = LeaseRenewer(store, owner, message=message).start()
+    try:
+        while (lease := store.claim(owner, lease_rows)) is not None:
+            message(f"### Leased {lease}")
+            leased.update(lease.rows)
+            renewer.track(lease.rows)
+            progress, lease_errs = await fetch(min(lease.rows), max(lease.rows), set(lease.rows))
+            total.merge(progress)
+            errs.extend(lease_errs)
+    finally:
+        if own_renewer:
+            renewer.stop()
+    return total, errs, leased
+
+
+def report_leases(
+    store: LeaseStore, owner: str, leased: Set[int], progress: MosaicProgress, renewer: LeaseRenewer = None
+) -> Tuple[int, int]:
+    """
+    Report the results of leased rows: completed rows' regions are recorded, other rows are released.
+
+    :param store: The lease store
+    :param owner: Name of this worker
+    :param leased: Rows that were leased by this worker
+    :param progress: The final progress of this worker
+    :param renewer: The LeaseRenewer still renewing the leases, if any
+    :return: A tuple of (rows completed, rows released)
+    """
+    if renewer is not None:
+        renewer.untrack(leased)
+    per_row: Dict[int, Dict[MapCoord, DominantColors]] = {row: {} for row in leased}
+    for coord, domc in progress.regions.items():
+        if coord.y in per_row:
+            per_row[coord.y][coord] = domc
+    done = {row for row in leased if row in progress.completed_rows and row not in progress.failed_rows}
+    for row in done:
+        store.complete(owner, row, per_row[row])
+    store.release(owner, leased - done)
+    return len(done), len(leased - done)
+
+
+def options() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "python -m mosaic_v3.leases", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--db", type=Path, required=True, help="The lease database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    init = subparsers.add_parser("init", help="Add rows to be fetched, minus those already complete in the state file")
+    init.add_argument("--state", type=Path, default=None, help="Path of the state file (MosaicProgress)")
+    init.add_argument("--ymin", type=int, default=0, help="Bottommost row (inclusive)")
+    init.add_argument("--ymax", type=int, default=2000, help="Topmost row (inclusive)")
+
+    subparsers.add_parser("status", help="Show the number of rows in every state")
+
+    merge = subparsers.add_parser("merge", help="Merge the results of completed rows into the state file")
+    merge.add_argument("--state", type=Path, required=True, help="Path of the state file (MosaicProgress)")
+
+    return parser.parse_args()
+
+
+def main(opts: argparse.Namespace) -> None:
+    with LeaseStore(opts.db) as store:
+        match opts.command:
+            case "init":
+                done = set()
+                if opts.state is not None:
+                    progress = MosaicProgress.new_from_path(opts.state)
+                    done = progress.completed_rows - progress.failed_rows
+                added = store.add_rows(y for y in range(opts.ymin, opts.ymax + 1) if y not in done)
+                print(f"{added:,} rows added")
+            case "merge":
+                make_backup(opts.state, levels=3)
+                progress = MosaicProgress.new_from_path(opts.state, missing_ok=True)
+                merged = store.merge_into(progress)
+                progress.write_to_path(opts.state)
+                print(f"{merged:,} rows merged into {opts.state}")
+        print(", ".join(f"{state}: {n:,}" for state, n in store.counts().items()))
+
+
+if __name__ == "__main__":
+    main(options())
@@ -12,13 +12,42 @@ from typing import BinaryIO, Dict, Iterable, Self, Set, Tuple, TypedDict
 import msgpack
 
 from mosaic_v3.color_processing import DominantColors
+from mosaic_v3.colorstore import ColorStore
 from sl_maptools import MapCoord
 
 
+class TileBitmap:
+    """The set of tiles of a row that are done, as one bit per tile (indexed by x); 251 bytes for a full row."""
+
+    def __init__(self, raw: bytes = b""):
+        self._bits = bytearray(raw)
+
+    def add(self, x: int) -> None:
+        idx = x >> 3
+        if idx >= len(self._bits):
+            self._bits.extend(bytes(idx + 1 - len(self._bits)))
+        self._bits[idx] |= 1 << (x & 7)
+
+    def __contains__(self, x: int) -> bool:
+        idx = x >> 3
+        return idx < len(self._bits) and bool(self._bits[idx] & (1 << (x & 7)))
+
+    def __len__(self) -> int:
+        return sum(b.bit_count() for b in self._bits)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, TileBitmap) and self._bits.rstrip(b"\x00") == other._bits.rstrip(b"\x00")
+
+    def encode(self) -> bytes:
+        return bytes(self._bits)
+
+
 class MosaicProgressSerialized(TypedDict):
     __regions: Iterable[Tuple[Tuple[int, int], Dict[str, Tuple[int, int, int]]]]
     __completed: Iterable[int]
     __fails: Iterable[int]
+    __stamps: Iterable[Tuple[int, float]]
+    __partial: Iterable[Tuple[int, bytes]]
 
 
 @dataclass
@@ -34,11 +63,17 @@ class MosaicProgress:
     class, "MosaicProgress".
 
     IMPORTANT: If a rownum exists in both completed_rows and failed_rows, the latter must take precedence!
+
+    Rows that are not (or not successfully) complete may have a TileBitmap in partial_rows, of the tiles that have
+    been recorded nonetheless; only the other tiles of those rows need to be fetched again.
     """
 
     regions: Dict[MapCoord, DominantColors] = field(default_factory=dict)
     completed_rows: Set[int] = field(default_factory=set)
     failed_rows: Set[int] = field(default_factory=set)
+    # When (time.time()) each row was last completed
+    row_stamps: Dict[int, float] = field(default_factory=dict)
+    partial_rows: Dict[int, TileBitmap] = field(default_factory=dict)
 
     def write_to_stream(self, stream: BinaryIO) -> None:
         """Serializes the class into an already-open binary 'file' (or file-like stream.)"""
@@ -46,6 +81,8 @@ class MosaicProgress:
             "__regions": [(coord.encode(), domc.encode()) for coord, domc in self.regions.items()],
             "__completed": list(self.completed_rows),
             "__fails": list(self.failed_rows),
+            "__stamps": list(self.row_stamps.items()),
+            "__partial": [(row, bitmap.encode()) for row, bitmap in self.partial_rows.items()],
         }
         msgpack.pack(encoded, stream)
 
@@ -70,7 +107,16 @@ class MosaicProgress:
         }
         completed = set(encoded["__completed"])
         failed_rows = set(encoded["__fails"])
-        return cls(regions=regions, completed_rows=completed, failed_rows=failed_rows)
+        # Older state files have neither row stamps nor partial rows
+        row_stamps = dict(encoded.get("__stamps", []))
+        partial_rows = {row: TileBitmap(raw) for row, raw in encoded.get("__partial", [])}
+        return cls(
+            regions=regions,
+            completed_rows=completed,
+            failed_rows=failed_rows,
+            row_stamps=row_stamps,
+            partial_rows=partial_rows,
+        )
 
     @classmethod
     def new_from_path(cls, path: Path, missing_ok: bool = False) -> Self:
@@ -87,34 +133,48 @@ class MosaicProgress:
         regs = copy.deepcopy(self.regions)
         seen = copy.deepcopy(self.completed_rows)
         fail = copy.deepcopy(self.failed_rows)
-        return MosaicProgress(regions=regs, completed_rows=seen, failed_rows=fail)
+        partial = {row: TileBitmap(bitmap.encode()) for row, bitmap in self.partial_rows.items()}
+        return MosaicProgress(
+            regions=regs, completed_rows=seen, failed_rows=fail, row_stamps=dict(self.row_stamps), partial_rows=partial
+        )
+
+    def drop_finished_partials(self) -> None:
+        """Forget the partial bitmaps of rows that are complete (and not failed)"""
+        for row in self.completed_rows - self.failed_rows:
+            self.partial_rows.pop(row, None)
 
     def get_proxies(self, mgr: MP.managers.SyncManager) -> MosaicProgressProxy:
-        """Get a 'proxified' version of MosaicProgress, i.e., something synced by a SyncManager."""
-        return MosaicProgressProxy(
-            mgr.dict(self.regions),
-            mgr.dict({k: None for k in self.completed_rows}),
-            mgr.dict({k: None for k in self.failed_rows}),
-        )
+        """
+        Get a 'proxified' version of MosaicProgress, i.e., something synced by a SyncManager, except for the regions,
+        which live in a ColorStore (that the caller must close() when done).
+        """
+        return MosaicProgressProxy.proxify(self, mgr)
 
 
 @dataclass(frozen=True)
 class MosaicProgressProxy:
-    regions: Dict[MapCoord, DominantColors]
+    regions: ColorStore
     completed_rows: Dict[int, None]
     failed_rows: Dict[int, None]
+    # Raw (encoded) TileBitmap's
+    partial_rows: Dict[int, bytes]
+    row_stamps: Dict[int, float]
 
     def unproxy(self) -> MosaicProgress:
         return MosaicProgress(
-            regions=self.regions.copy(),
+            regions=self.regions.to_dict(),
             completed_rows=set(self.completed_rows.keys()),
             failed_rows=set(self.failed_rows.keys()),
+            partial_rows={row: TileBitmap(raw) for row, raw in self.partial_rows.items()},
+            row_stamps=dict(self.row_stamps),
         )
 
     @classmethod
     def proxify(cls, prog: MosaicProgress, mgr: MP.managers.SyncManager) -> Self:
         return cls(
-            mgr.dict(prog.regions),
+            ColorStore.from_regions(prog.regions),
             mgr.dict({k: None for k in prog.completed_rows}),
             mgr.dict({k: None for k in prog.failed_rows}),
+            mgr.dict({row: bitmap.encode() for row, bitmap in prog.partial_rows.items()}),
+            mgr.dict(prog.row_stamps),
         )
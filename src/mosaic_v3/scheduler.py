@@ -0,0 +1,141 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Orderings of the work done by async_fetch_area.
+
+Work is scheduled a band of rows at a time: the rows to fetch are put in order by order_rows(), cut into bands of
+`band` rows, and the tiles of each band are put in order by order_tiles(). Putting the most valuable rows first means
+an interrupted (or time-boxed) run will have captured most of the useful data by the time it stops.
+"""
+from __future__ import annotations
+
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+from mosaic_v3.progress import MosaicProgress
+from sl_maptools import MapCoord
+
+# The grid is 2001x2001, so a 2048x2048 Hilbert curve covers it
+HILBERT_ORDER = 11
+HILBERT_BAND = 16
+
+
+def hilbert_index(order: int, x: int, y: int) -> int:
+    """
+    Calculate the distance of (x, y) along a Hilbert curve covering a 2**order by 2**order grid.
+
+    :param order: Order of the curve
+    :param x: X coordinate, 0 <= x < 2**order
+    :param y: Y coordinate, 0 <= y < 2**order
+    :return: Distance along the curve
+    """
+    d = 0
+    s = 1 << (order - 1)
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the sub-curve is in its canonical orientation
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - (x & (s - 1))
+                y = s - 1 - (y & (s - 1))
+            x, y = y, x
+        s >>= 1
+    return d
+
+
+class Scheduler:
+    """Rows top-down, tiles left-to-right, i.e., the good old order."""
+
+    name = "topdown"
+    band = 1
+    # Whether the ordering is by what previous runs found, hence only meaningful when completed rows are revisited
+    revisits = False
+
+    def order_rows(self, rows: Iterable[int]) -> List[int]:
+        return sorted(rows, reverse=True)
+
+    def order_tiles(self, coords: List[MapCoord]) -> List[MapCoord]:
+        return coords
+
+    def bands(self, rows: Iterable[int]) -> List[List[int]]:
+        ordered = self.order_rows(rows)
+        return [ordered[i : i + self.band] for i in range(0, len(ordered), self.band)]
+
+
+class DensityScheduler(Scheduler):
+    """Rows having the most regions (as of the previous runs) first; only useful with probing."""
+
+    name = "density"
+    revisits = True
+
+    def __init__(self, regions: Iterable[MapCoord]):
+        self.density: Counter[int] = Counter(co.y for co in regions)
+
+    def order_rows(self, rows: Iterable[int]) -> List[int]:
+        return sorted(rows, key=lambda y: (-self.density[y], -y))
+
+
+class FailedFirstScheduler(Scheduler):
+    """Rows that failed in the previous run first."""
+
+    name = "failed"
+
+    def __init__(self, failed_rows: Iterable[int]):
+        self.failed_rows = set(failed_rows)
+
+    def order_rows(self, rows: Iterable[int]) -> List[int]:
+        return sorted(rows, key=lambda y: (y not in self.failed_rows, -y))
+
+
+class StaleFirstScheduler(Scheduler):
+    """Rows completed longest ago first; rows never completed before all others. Only useful with probing."""
+
+    name = "stale"
+    revisits = True
+
+    def __init__(self, row_stamps: Dict[int, float]):
+        self.row_stamps = row_stamps
+
+    def order_rows(self, rows: Iterable[int]) -> List[int]:
+        return sorted(rows, key=lambda y: (self.row_stamps.get(y, 0.0), -y))
+
+
+class HilbertScheduler(Scheduler):
+    """
+    Bands of rows top-down, tiles of each band along a Hilbert curve, so that tiles requested close together in time
+    are close together on the map, and more likely to be served from the same CDN cache.
+    """
+
+    name = "hilbert"
+    band = HILBERT_BAND
+
+    def order_tiles(self, coords: List[MapCoord]) -> List[MapCoord]:
+        return sorted(coords, key=lambda co: hilbert_index(HILBERT_ORDER, co.x, co.y))
+
+
+SCHEDULES: Tuple[str, ...] = ("topdown", "density", "failed", "stale", "hilbert")
+
+
+def make_scheduler(name: str, progress: MosaicProgress) -> Scheduler:
+    """
+    Create a scheduler by name.
+
+    :param name: One of SCHEDULES
+    :param progress: The progress of previous runs (must be taken before failed_rows gets cleared!)
+    :return: The scheduler
+    """
+    match name:
+        case "topdown":
+            return Scheduler()
+        case "density":
+            return DensityScheduler(progress.regions.keys())
+        case "failed":
+            return FailedFirstScheduler(progress.failed_rows)
+        case "stale":
+            return StaleFirstScheduler(progress.row_stamps)
+        case "hilbert":
+            return HilbertScheduler()
+    raise ValueError(f"Unknown schedule {name!r}")
@@ -4,12 +4,17 @@
 from __future__ import annotations
 
 import multiprocessing as MP
+import queue
+import threading
 import time
 import warnings
 from enum import IntEnum
 from multiprocessing import Process
 from typing import Any, ContextManager, Iterable, List, Protocol, Set, Tuple, Callable, Self
 
+DEFA_BATCH_SIZE = 32
+DEFA_BATCH_WAIT = 0.02
+
 
 class MPValueProtocol(Protocol):
     """Protocol implemented by multiprocessing.Value"""
@@ -43,6 +48,7 @@ class Worker(Process):
     *) Built-in/enforced CommandQueue
     *) Built-in shared variable for tracking worker state
     *) Built-in shared variable to change worker's 'quietness'
+    *) Built-in shared counter of jobs done, for progress reporting
 
     Please note that Worker.CommandQueue class attribute *must* be set prior to instantating!
     """
@@ -56,6 +62,9 @@ class Worker(Process):
         self.command_queue = self.CommandQueue
         self._state: MPValueProtocol = MP.Value("l", 0)
         self._quiet: MPValueProtocol = MP.Value("l", 1)
+        # Only ever written by the worker itself, so no lock needed
+        self._done: MPValueProtocol = MP.Value("l", 0, lock=False)
+        self._failed: MPValueProtocol = MP.Value("l", 0, lock=False)
 
     @property
     def state(self):
@@ -73,6 +82,122 @@ class Worker(Process):
     def quiet(self, value: bool):
         self._quiet.value = value
 
+    @property
+    def done_count(self) -> int:
+        return self._done.value
+
+    def tally(self, n: int = 1) -> None:
+        """Count jobs done; to be called only from within the worker process"""
+        self._done.value += n
+
+    @property
+    def failed_count(self) -> int:
+        return self._failed.value
+
+    def tally_failed(self, n: int = 1) -> None:
+        """Count jobs that failed; to be called only from within the worker process"""
+        self._failed.value += n
+
+
+class QueueFeeder:
+    """
+    Hands items over to a (multiprocessing) queue from a dedicated thread, so the submitter (e.g., an event loop)
+    never waits for the target queue's put(), which takes locks, may start the queue's own feeder thread, and may
+    block once the pipe underneath is full.
+
+    Items are put into the target queue in the order they were submitted. With a batch_size above 1, items are put as
+    lists of up to batch_size items, each list collected for no more than batch_wait seconds, so the costs of a
+    message (pickling, locking, writing into the pipe, waking up the receiver) are shared by a whole batch. Strings
+    (commands, e.g., "SAVE") are never batched, but put as they are, right after the batch before them.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self, target: MP.Queue, name: str = "QueueFeeder", batch_size: int = 1, batch_wait: float = DEFA_BATCH_WAIT
+    ):
+        """
+        :param target: The queue to feed
+        :param name: Name of the feeder thread
+        :param batch_size: Maximum items per message; 1 to not batch at all
+        :param batch_wait: Maximum time (seconds) to wait for a batch to fill up
+        """
+        self.target = target
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        # A SimpleQueue never blocks on put(), and (unlike asyncio.Queue) is safe to get() from another thread
+        self._buffer: queue.SimpleQueue = queue.SimpleQueue()
+        self.submitted = 0
+        self.fed = 0
+        self.messages = 0
+        # Time spent in the target's put(), i.e., what the submitter would have spent there
+        self.put_seconds = 0.0
+        self.max_put_seconds = 0.0
+        # Time the submitter spent handing items to us
+        self.submit_seconds = 0.0
+        self._thread = threading.Thread(target=self._feed, name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, item: Any) -> None:
+        start = time.perf_counter()
+        self._buffer.put(item)
+        self.submitted += 1
+        self.submit_seconds += time.perf_counter() - start
+
+    def _put(self, message: Any, items: int) -> None:
+        start = time.perf_counter()
+        self.target.put(message)
+        elapsed = time.perf_counter() - start
+        self.put_seconds += elapsed
+        self.max_put_seconds = max(self.max_put_seconds, elapsed)
+        self.fed += items
+        self.messages += 1
+
+    def _collect(self, batch: List[Any]) -> Any:
+        """Add items to batch until it's full or batch_wait is up; return the item that ended it early, if any"""
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            if (timeout := deadline - time.monotonic()) <= 0:
+                break
+            try:
+                item = self._buffer.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is self._STOP or isinstance(item, str):
+                return item
+            batch.append(item)
+        return None
+
+    def _feed(self) -> None:
+        item = self._buffer.get()
+        while item is not self._STOP:
+            if self.batch_size <= 1 or isinstance(item, str):
+                self._put(item, 1)
+                item = self._buffer.get()
+                continue
+            batch = [item]
+            ender = self._collect(batch)
+            self._put(batch, len(batch))
+            item = self._buffer.get() if ender is None else ender
+
+    @property
+    def pending(self) -> int:
+        """Number of items not put into the target queue yet"""
+        return self.submitted - self.fed
+
+    def close(self) -> None:
+        """Put all pending items into the target queue, then stop the thread"""
+        if self._thread.is_alive():
+            self._buffer.put(self._STOP)
+            self._thread.join()
+
+    def __str__(self):
+        return (
+            f"{self.fed:,} items fed in {self.messages:,} messages, {self.put_seconds:,.3f} s in put()"
+            f" (max {self.max_put_seconds * 1000:,.1f} ms)"
+            f" vs. {self.submit_seconds:,.3f} s spent by the submitter"
+        )
+
 
 class WorkTeam:
     """
@@ -86,20 +211,26 @@ class WorkTeam:
         WorkerState.DEAD,
     }
 
-    def __init__(self, num_workers: int, worker_class: type[Worker], *args, **kwargs):
+    def __init__(self, num_workers: int, worker_class: type[Worker], *args, capacity: int = None, **kwargs):
         """
         :param num_workers: Number of workers to instantiate
         :param worker_class: The class to instantiate (must be subclass of Worker)
         :param args: Non-keyword arguments to pass to the workers' class
+        :param capacity: Number of jobs submitted but not done yet beyond which the team is deemed full (see
+        submit()); None for no limit
         :param kwargs: Keyword arguments to pass to the workers' class
         """
         self.num_workers = num_workers
         self.worker_class = worker_class
         self.args = args
         self.kwargs = kwargs
+        self.capacity = capacity
         self.command_queue = MP.Queue()
         self._workers: List[Worker] = []
         self.__safed = False
+        # Only ever touched by the submitting process
+        self._submitted = 0
+        self.feeder: QueueFeeder | None = None
 
     @property
     def quiet(self) -> list[bool]:
@@ -126,6 +257,16 @@ class WorkTeam:
             if verbose:
                 print((i + start_num), end=" ", flush=True)
 
+    @property
+    def done_count(self) -> int:
+        """Total number of jobs done by all workers"""
+        return sum(w.done_count for w in self._workers)
+
+    @property
+    def failed_count(self) -> int:
+        """Total number of jobs that failed in all workers"""
+        return sum(w.failed_count for w in self._workers)
+
     @property
     def ready_count(self) -> int:
         """Number of workers that have entered the READY state"""
@@ -136,6 +277,29 @@ class WorkTeam:
         """Number of workers that have entered a 'safe' state (READY or DEAD)"""
         return sum(1 for w in self._workers if w.state in self.SAFED_STATES)
 
+    def start_feeder(self, batch_size: int = 1, batch_wait: float = DEFA_BATCH_WAIT) -> QueueFeeder:
+        """
+        Have submit() hand jobs over to the command queue through a QueueFeeder.
+
+        :param batch_size: Maximum jobs per message; the workers must accept lists of jobs if above 1
+        :param batch_wait: Maximum time (seconds) to wait for a batch to fill up
+        :return: The QueueFeeder, e.g., for its statistics
+        """
+        if self.feeder is None:
+            self.feeder = QueueFeeder(
+                self.command_queue,
+                name=f"{self.worker_class.__name__}Feeder",
+                batch_size=batch_size,
+                batch_wait=batch_wait,
+            )
+        return self.feeder
+
+    def stop_feeder(self) -> None:
+        """Flush and stop the QueueFeeder, if any; submit() then puts jobs into the command queue directly"""
+        if self.feeder is not None:
+            self.feeder.close()
+            self.feeder = None
+
     def wait_ready(self) -> None:
         """
         Waits until all workers are in READY state
@@ -164,6 +328,8 @@ class WorkTeam:
         :param quiet: If true, suppresses the workers' output
         :return: None
         """
+        # Jobs still in the feeder are incoming jobs, too
+        self.stop_feeder()
         qs = [self.command_queue]
         if check_queues is not None:
             qs.extend(check_queues)
@@ -228,6 +394,39 @@ class WorkTeam:
         post = post_disband(self, quiet) if post_disband else None
         return pre, post
 
+    def submit(self, job: Any) -> None:
+        """
+        Put a job into the command queue (through the feeder, if started), counting it if it's an actual job (as
+        opposed to a command string).
+
+        The queue itself is unbounded, as a blocking put() would stall the submitter (e.g., an event loop); it's up
+        to the submitter to hold back while the team is full.
+        """
+        if self.feeder is not None:
+            self.feeder.put(job)
+        else:
+            self.command_queue.put(job)
+        if not isinstance(job, str):
+            self._submitted += 1
+
+    @property
+    def depth(self) -> int:
+        """Number of jobs submitted through submit() but not done yet (including those being worked on)"""
+        return self._submitted - self.done_count
+
+    @property
+    def alive_count(self) -> int:
+        """Number of workers whose process is still running"""
+        return sum(1 for w in self._workers if w.is_alive())
+
+    @property
+    def full(self) -> bool:
+        """
+        Whether depth has reached capacity, i.e., the submitter should hold back. Never true once all workers are dead,
+        as nothing would ever make room, and holding back would then wait forever.
+        """
+        return self.capacity is not None and self.depth >= self.capacity and self.alive_count > 0
+
     @property
     def backlog_size(self) -> int:
         """Approximate number of outstanding jobs in the command_queue"""
@@ -3,19 +3,18 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 from __future__ import annotations
 
-import copy
 import multiprocessing as MP
 import time
 from pathlib import Path
-from typing import Dict, Literal, Optional, Tuple, Union
+from typing import Dict, List, Literal, Optional, Set, Tuple, Union
 
 from mosaic_v3.color_processing import DominantColors
-from mosaic_v3.progress import MosaicProgressProxy
+from mosaic_v3.progress import MosaicProgressProxy, TileBitmap
 from mosaic_v3.workers import Worker, WorkerState
 from sl_maptools import MapCoord
 
 RecorderSignals = Union[Literal["DIE"], Literal["FLUSH"], Literal["SAVE"]]
-RecorderJob = Union[RecorderSignals, Tuple[MapCoord, DominantColors]]
+RecorderJob = Union[RecorderSignals, Tuple[MapCoord, DominantColors], List[Tuple[MapCoord, DominantColors]]]
 
 
 class TileRecorder(Worker):
@@ -26,11 +25,16 @@ class TileRecorder(Worker):
 
     IN ADDITION, this worker will also gather the failed tiles and record them also into the proxied Progress object.
 
+    It also keeps track, per row, of which tiles have been recorded (including voids), so that a row that does not
+    complete needs only its missing tiles fetched again.
+
     This class recognizes the following 'jobs' in the input/command queue:
     - "DIE" instruction to wrap up and end
-    - "FLUSH" will sync the in-memory data with the SyncManager-managed MapProgressProxy object
+    - "FLUSH" will sync the in-memory data with the SyncManager-managed MapProgressProxy object (regions are written
+      into its ColorStore right away, though)
     - "SAVE" instruction to save progress so far; will also trigger flush
     - (MapCoord, DominantColors) -- actual data to be accumulated (not yet written to disk until "SAVE" is received)
+    - a list of (MapCoord, DominantColors) -- a batch of them
     """
 
     MIN_SAVE_DISTANCE = 200
@@ -55,28 +59,32 @@ class TileRecorder(Worker):
         self.progress_proxy = progress_proxy
         self.progress_file = progress_file
         self.coordfail_q: MP.Queue[Tuple[MapCoord, Exception]] = coordfail_q
+        self.recorded: Dict[int, TileBitmap] = {}
+        self.dirty_rows: Set[int] = set()
 
-    def _flush(self, regions: dict[MapCoord, DominantColors]) -> None:
-        """Updates the syncmanaged dict with values we gained. Including also fails."""
+    def _flush(self) -> None:
+        """Updates the syncmanaged dicts with the fails and the recorded tiles."""
         failrows: Dict[int, None] = {}
         while not self.coordfail_q.empty():
             coord, ee = self.coordfail_q.get()
             failrows[coord.y] = None
         self.progress_proxy.failed_rows.update(failrows)
-        self.progress_proxy.regions.update(regions)
+        self.progress_proxy.partial_rows.update({row: self.recorded[row].encode() for row in self.dirty_rows})
+        self.dirty_rows.clear()
 
-    def _save(self, regions: dict[MapCoord, DominantColors]) -> None:
+    def _save(self) -> None:
         """Flush then save the progress."""
         if not self.quiet:
             print("V", end="", flush=True)
-        self._flush(regions)
+        self._flush()
         p = self.progress_proxy.unproxy()
         p.write_to_path(self.progress_file)
 
     def run(self) -> None:
         """Do multiprocessing jobs"""
         self.state = WorkerState.SETUP
-        regions = copy.deepcopy(self.progress_proxy.regions)
+        regions = self.progress_proxy.regions
+        self.recorded = {row: TileBitmap(raw) for row, raw in self.progress_proxy.partial_rows.items()}
         coord: Optional[MapCoord] = None
         ctrlc = False
         try:
@@ -99,30 +107,32 @@ class TileRecorder(Worker):
                 self.state = WorkerState.BUSY
 
                 if job == "FLUSH":
-                    self._flush(regions)
+                    self._flush()
                     continue
                 if job == "SAVE":
-                    self._save(regions)
+                    self._save()
                     continue
                 if isinstance(job, str):
                     print(f"\nUnrecognized command: {job}")
                     continue
 
-                try:
-                    assert isinstance(job, tuple)
-                    assert len(job) == 2
-                except AssertionError:
-                    print(f"job is <{type(job)}> == {job}")
-                    raise
-                coord: MapCoord = job[0]
-                domc: Optional[DominantColors] = job[1]
-
-                if domc is None:
-                    if coord in regions:
-                        del regions[coord]
-                    continue
-                else:
-                    regions[coord] = domc
+                for item in job if isinstance(job, list) else [job]:
+                    try:
+                        assert isinstance(item, tuple)
+                        assert len(item) == 2
+                    except AssertionError:
+                        print(f"job is <{type(item)}> == {item}")
+                        raise
+                    coord: MapCoord = item[0]
+                    domc: Optional[DominantColors] = item[1]
+                    self.tally()
+                    self.recorded.setdefault(coord.y, TileBitmap()).add(coord.x)
+                    self.dirty_rows.add(coord.y)
+
+                    if domc is None:
+                        regions.pop(coord)
+                    else:
+                        regions[coord] = domc
 
                 coord = None
 
@@ -132,7 +142,7 @@ class TileRecorder(Worker):
             if not isinstance(ee, KeyboardInterrupt):
                 raise
         finally:
-            self._save(regions)
+            self._save()
             self.incoming.close()
             self.coordfail_q.close()
             self.state = WorkerState.DEAD
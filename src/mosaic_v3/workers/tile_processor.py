@@ -6,7 +6,7 @@ from __future__ import annotations
 import io
 import multiprocessing as MP
 import time
-from typing import Literal, Optional, Tuple, Union
+from typing import List, Literal, Optional, Tuple, Union
 
 from PIL import Image
 
@@ -17,7 +17,7 @@ from sl_maptools import MapCoord, MapTile
 from sl_maptools.fetcher import RawTile
 
 ProcessorSignals = Union[Literal["DIE"], Literal["SAVE"]]
-ProcessorJob = Union[ProcessorSignals, RawTile]
+ProcessorJob = Union[ProcessorSignals, RawTile, List[RawTile]]
 
 
 class TileProcessor(Worker):
@@ -32,6 +32,7 @@ class TileProcessor(Worker):
     This class recognizes the following 'jobs' in the input/command queue:
     - "DIE" instruction to wrap up and end
     - MapTile -- actual fetched tile, will start the DominantColors processing
+    - a list of MapTile's -- a batch of them; the results are sent to the output queue as one batch, too
     """
 
     def __init__(
@@ -48,6 +49,24 @@ class TileProcessor(Worker):
         self.err_q = err_q
         self.coordfail_q = coordfail_q
 
+    def _process(self, coord: MapCoord, rawdata: bytes) -> Optional[Tuple[MapCoord, Optional[DominantColors]]]:
+        """Calculate the DominantColors of a tile (None for a void); return None if that failed"""
+        try:
+            if rawdata:
+                with io.BytesIO(rawdata) as bio:
+                    img = Image.open(bio)
+                    img.load()
+                domc = DominantColors.from_tile(MapTile(coord, img))
+            else:
+                domc = None
+            return coord, domc
+        except Exception as ew:
+            errmess = f"ERR[{type(ew)}:{ew}]({coord.x},{coord.y})"
+            self.tally_failed()
+            self.err_q.put(errmess)
+            self.coordfail_q.put_nowait((coord, ew))
+            return None
+
     def run(self) -> None:
         self.state = WorkerState.SETUP
         count = 0
@@ -75,27 +94,23 @@ class TileProcessor(Worker):
                 if isinstance(job, str):
                     print(f"Unknown command: {job}")
                     continue
-                if not isinstance(job, tuple):
+                if not isinstance(job, (tuple, list)):
                     print(f"Unknown job <{type(job)}>: {job}")
                     continue
 
-                coord, rawdata = job
-                try:
-                    if rawdata:
-                        with io.BytesIO(rawdata) as bio:
-                            img = Image.open(bio)
-                            img.load()
-                        domc = DominantColors.from_tile(MapTile(coord, img))
-                    else:
-                        domc = None
-                    self.output_q.put((coord, domc))
-                except Exception as ew:
-                    errmess = f"ERR[{type(ew)}:{ew}]({coord.x},{coord.y})"
-                    print(errmess, end="", flush=True)
-                    self.err_q.put(errmess)
-                    self.coordfail_q.put_nowait((coord, ew))
+                results: List[Tuple[MapCoord, Optional[DominantColors]]] = []
+                for coord, rawdata in job if isinstance(job, list) else [job]:
+                    if (result := self._process(coord, rawdata)) is not None:
+                        results.append(result)
+                    self.tally()
+                    count += 1
+                coord = None
+                if isinstance(job, tuple):
+                    if results:
+                        self.output_q.put(results[0])
+                elif results:
+                    self.output_q.put(results)
 
-                count += 1
                 if count >= 100:
                     if not self.quiet:
                         print("*", end="", flush=True)
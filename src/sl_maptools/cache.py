@@ -0,0 +1,527 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+from __future__ import annotations
+
+import hashlib
+import math
+import time
+import zlib
+from array import array
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Self, Set, Tuple
+
+import appdirs
+import msgpack
+
+from sl_maptools import MapCoord
+from sl_maptools.knowns import VERIFIED_VOIDS
+
+DEFAULT_CACHE_DIR = Path(appdirs.user_cache_dir("sl-cartography")) / "tiles"
+DEFAULT_MAX_BYTES = 2 * 1024**3
+DEFAULT_VOIDS_FILE = Path(appdirs.site_data_dir("sl-cartography")) / "voids.msgp"
+DEFAULT_FINGERPRINTS_FILE = Path(appdirs.site_data_dir("sl-cartography")) / "fingerprints.msgp"
+
+
+@dataclass
+class CacheEntry:
+    """Metadata of one cached tile. The bytes themselves live in a content-addressed blob."""
+
+    digest: str
+    size: int
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    def encode(self) -> Tuple[str, int, Optional[str], Optional[str]]:
+        return self.digest, self.size, self.etag, self.last_modified
+
+    @classmethod
+    def decode(cls, raw) -> Self:
+        return cls(*raw)
+
+
+@dataclass
+class CacheStats:
+    """Counters of cache effectiveness for a single run"""
+
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    evictions: int = 0
+
+    @property
+    def lookups(self) -> int:
+        return self.hits + self.misses
+
+    @property
+    def hit_rate(self) -> float:
+        return (self.hits / self.lookups) if self.lookups else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.hits:,} hits / {self.lookups:,} lookups ({self.hit_rate:.1%} hit rate),"
+            f" {self.stores:,} stored, {self.evictions:,} evicted"
+        )
+
+
+class TileCache:
+    """
+    A persistent, content-addressed on-disk cache of raw map tiles.
+
+    Tile bytes are stored as blobs named after their SHA-256 digest, so identical tiles (e.g., all-water regions)
+    occupy disk space only once. An index maps every MapCoord to its blob plus the ETag/Last-Modified validators
+    the CDN sent along, allowing the fetcher to do a conditional GET; a "304 Not Modified" then becomes a cache hit
+    without transferring the body again.
+
+    Total size of the blobs is capped at max_bytes; when exceeded, the least-recently-used coordinates are evicted.
+
+    The index is only written to disk upon save() (or upon leaving the context manager.)
+    """
+
+    INDEX_NAME = "index.msgp"
+
+    def __init__(self, cache_dir: Path = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        :param cache_dir: Directory holding the index and the blobs. Will be created if not exist.
+        :param max_bytes: Maximum total size of the blobs, in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self._entries: OrderedDict[MapCoord, CacheEntry] = OrderedDict()
+        self._refs: Dict[str, int] = {}
+        self._blob_sizes: Dict[str, int] = {}
+        self._total_bytes: int = 0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.save()
+
+    def __contains__(self, item: MapCoord) -> bool:
+        return item in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.cache_dir / digest[:2] / f"{digest}.jpg"
+
+    def _load(self) -> None:
+        index = self.cache_dir / self.INDEX_NAME
+        if not index.exists():
+            return
+        with index.open("rb") as fin:
+            raw_entries = msgpack.unpack(fin)
+        # The index is stored least-recently-used first, so re-inserting in order recreates the LRU ordering
+        for (x, y), raw in raw_entries:
+            self._link(MapCoord(x, y), CacheEntry.decode(raw))
+
+    def save(self) -> None:
+        """Persist the index to disk."""
+        index = self.cache_dir / self.INDEX_NAME
+        temp = index.with_suffix(".temp" + index.suffix)
+        with temp.open("wb") as fout:
+            msgpack.pack([(coord.encode(), entry.encode()) for coord, entry in self._entries.items()], fout)
+        temp.replace(index)
+
+    def _link(self, coord: MapCoord, entry: CacheEntry) -> None:
+        self._entries[coord] = entry
+        if entry.digest not in self._refs:
+            self._refs[entry.digest] = 0
+            self._blob_sizes[entry.digest] = entry.size
+            self._total_bytes += entry.size
+        self._refs[entry.digest] += 1
+
+    def _unlink(self, coord: MapCoord) -> None:
+        entry = self._entries.pop(coord, None)
+        if entry is None:
+            return
+        self._refs[entry.digest] -= 1
+        if self._refs[entry.digest] > 0:
+            return
+        del self._refs[entry.digest]
+        self._total_bytes -= self._blob_sizes.pop(entry.digest)
+        self._blob_path(entry.digest).unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        while self._total_bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._unlink(oldest)
+            self.stats.evictions += 1
+
+    def conditional_headers(self, coord: MapCoord) -> Dict[str, str]:
+        """
+        Returns headers for a conditional GET of coord; empty if coord is not cached.
+
+        :param coord: Coordinate of tile about to be fetched
+        :return: A dict of headers to pass to the HTTP client
+        """
+        entry = self._entries.get(coord)
+        if entry is None:
+            return {}
+        headers = {}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def read(self, coord: MapCoord) -> Optional[bytes]:
+        """
+        Read the cached bytes of coord, marking it as most-recently-used.
+
+        :param coord: Coordinate of the tile
+        :return: The raw bytes, or None if not cached (or the blob has gone missing from disk)
+        """
+        entry = self._entries.get(coord)
+        if entry is None:
+            return None
+        try:
+            data = self._blob_path(entry.digest).read_bytes()
+        except FileNotFoundError:
+            self._unlink(coord)
+            return None
+        self._entries.move_to_end(coord)
+        return data
+
+    def revalidated(self, coord: MapCoord) -> Optional[bytes]:
+        """
+        To be called when the server answered "304 Not Modified" for coord.
+
+        :param coord: Coordinate of the tile
+        :return: The cached bytes, or None if they are no longer available (caller must refetch unconditionally)
+        """
+        data = self.read(coord)
+        if data is not None:
+            self.stats.hits += 1
+        return data
+
+    def store(
+        self,
+        coord: MapCoord,
+        data: bytes,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        """
+        Store freshly-downloaded tile bytes along with their validators.
+
+        :param coord: Coordinate of the tile
+        :param data: Raw bytes as returned by the server
+        :param etag: Value of the ETag response header, if any
+        :param last_modified: Value of the Last-Modified response header, if any
+        """
+        self.stats.misses += 1
+        self.stats.stores += 1
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self._blob_path(digest)
+        old = self._entries.get(coord)
+        if old is not None and old.digest == digest and blob.exists():
+            old.etag, old.last_modified = etag, last_modified
+            self._entries.move_to_end(coord)
+            return
+        self._unlink(coord)
+        if digest not in self._refs or not blob.exists():
+            blob.parent.mkdir(exist_ok=True)
+            temp = blob.with_suffix(".temp")
+            temp.write_bytes(data)
+            temp.replace(blob)
+        self._link(coord, CacheEntry(digest, len(data), etag, last_modified))
+        self._evict()
+
+    def invalidate(self, coord: MapCoord) -> None:
+        """Forget coord, e.g., because it has become a void."""
+        self._unlink(coord)
+
+
+@dataclass
+class VoidStats:
+    """Counters of the void registry's activity for a single run"""
+
+    skipped: int = 0
+    reprobes: int = 0
+    recorded: int = 0
+    revived: int = 0
+
+    def __str__(self):
+        return (
+            f"{self.skipped:,} voids skipped, {self.reprobes:,} scheduled for re-probe,"
+            f" {self.recorded:,} recorded, {self.revived:,} turned into regions"
+        )
+
+
+class VoidRegistry:
+    """
+    An automatically-maintained negative cache of void tiles.
+
+    Every void seen (a "403" from the CDN) gets recorded along with a timestamp. Tiles in the registry are skipped,
+    except for a fraction of them that gets re-probed every run, oldest first (plus all those older than max_age),
+    so that new regions appearing in formerly-void locations will eventually be picked up.
+
+    Manually-verified voids (VERIFIED_VOIDS) are pinned: always skipped and never re-probed.
+
+    Because voids dominate the world grid, timestamps are kept in a flat array covering the whole world rather than
+    in a dict. Use "coord in registry" to check whether a tile should be skipped.
+    """
+
+    DAY = 86400
+
+    def __init__(
+        self,
+        path: Path = None,
+        reprobe_fraction: float = 0.05,
+        max_age_days: float = 90.0,
+        width: int = 2001,
+        height: int = 2001,
+        pinned: Iterable[MapCoord] = VERIFIED_VOIDS,
+    ):
+        """
+        :param path: File to load from and save to; None for an in-memory-only registry
+        :param reprobe_fraction: Fraction of known voids to re-probe this run
+        :param max_age_days: Voids last seen longer than this ago are always re-probed
+        :param width: Width of the world, in tiles
+        :param height: Height of the world, in tiles
+        :param pinned: Coordinates that are always deemed void
+        """
+        self.path = path
+        self.reprobe_fraction = reprobe_fraction
+        self.max_age_days = max_age_days
+        self.width = width
+        self.height = height
+        self.pinned: Set[MapCoord] = set(pinned)
+        self.stats = VoidStats()
+        # Unix timestamp (seconds) when the tile was last seen as void; 0 means "not known to be void"
+        self._stamps = array("I", bytes(array("I").itemsize * width * height))
+        self._reprobe: Set[int] = set()
+        if path is not None and path.exists():
+            self._load()
+        self.plan_reprobes()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.save()
+
+    def _index(self, coord: MapCoord) -> Optional[int]:
+        x, y = coord
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        return y * self.width + x
+
+    def __contains__(self, item: MapCoord) -> bool:
+        if item in self.pinned:
+            return True
+        idx = self._index(item)
+        return idx is not None and self._stamps[idx] != 0 and idx not in self._reprobe
+
+    def __len__(self) -> int:
+        return sum(1 for st in self._stamps if st)
+
+    def _load(self) -> None:
+        with self.path.open("rb") as fin:
+            raw = msgpack.unpack(fin)
+        if (raw["width"], raw["height"]) != (self.width, self.height):
+            raise ValueError(f"{self.path} is for a world of {raw['width']}x{raw['height']}")
+        stamps = array("I")
+        stamps.frombytes(zlib.decompress(raw["stamps"]))
+        self._stamps = stamps
+
+    def save(self) -> None:
+        """Persist the registry to disk (does nothing for an in-memory-only registry)."""
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.path.with_suffix(".temp" + self.path.suffix)
+        encoded = {
+            "width": self.width,
+            "height": self.height,
+            "stamps": zlib.compress(self._stamps.tobytes()),
+        }
+        with temp.open("wb") as fout:
+            msgpack.pack(encoded, fout)
+        temp.replace(self.path)
+
+    def plan_reprobes(self) -> None:
+        """
+        Choose which known voids will be re-probed (i.e., not skipped) this run.
+
+        Invoked upon instantiation; invoke again only if you want a new plan.
+        """
+        nao = int(time.time())
+        stale_before = nao - int(self.max_age_days * self.DAY)
+        days = Counter(st // self.DAY for st in self._stamps if st)
+        quota = math.ceil(sum(days.values()) * self.reprobe_fraction)
+        # Find the most recent day whose voids are still within quota (oldest days go first)
+        cutoff_day = None
+        partial = 0
+        for day in sorted(days):
+            if quota <= 0:
+                break
+            cutoff_day = day
+            partial = min(quota, days[day])
+            quota -= days[day]
+        reprobe: Set[int] = set()
+        for idx, st in enumerate(self._stamps):
+            if not st:
+                continue
+            day = st // self.DAY
+            if st < stale_before or (cutoff_day is not None and day < cutoff_day):
+                reprobe.add(idx)
+            elif day == cutoff_day and partial > 0:
+                reprobe.add(idx)
+                partial -= 1
+        self._reprobe = reprobe
+        self.stats.reprobes = len(reprobe)
+
+    def should_skip(self, coord: MapCoord) -> bool:
+        """Same as "coord in self", but also counts the skip"""
+        if coord in self:
+            self.stats.skipped += 1
+            return True
+        return False
+
+    def record_void(self, coord: MapCoord, when: float = None) -> None:
+        """Record coord as being a void as of when (default: now)"""
+        if (idx := self._index(coord)) is None:
+            return
+        if not self._stamps[idx]:
+            self.stats.recorded += 1
+        self._stamps[idx] = int(time.time() if when is None else when)
+        self._reprobe.discard(idx)
+
+    def record_region(self, coord: MapCoord) -> None:
+        """Record coord as (no longer) being a void"""
+        if (idx := self._index(coord)) is None or not self._stamps[idx]:
+            return
+        self._stamps[idx] = 0
+        self._reprobe.discard(idx)
+        self.stats.revived += 1
+
+
+@dataclass(frozen=True)
+class TileFingerprint:
+    """What a HEAD request tells about a tile, enough to notice whether it has changed"""
+
+    content_length: Optional[int] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @classmethod
+    def from_headers(cls, headers) -> Self:
+        """Take the fingerprint from response headers; a malformed Content-Length is taken as missing"""
+        try:
+            length = int(headers.get("Content-Length"))
+        except (TypeError, ValueError):
+            length = None
+        return cls(
+            content_length=length,
+            etag=headers.get("ETag"),
+            last_modified=headers.get("Last-Modified"),
+        )
+
+    def encode(self) -> Tuple[Optional[int], Optional[str], Optional[str]]:
+        return self.content_length, self.etag, self.last_modified
+
+    @classmethod
+    def decode(cls, raw) -> Self:
+        return cls(*raw)
+
+
+@dataclass
+class FingerprintStats:
+    """Counters of freshness probing for a single run"""
+
+    probed: int = 0
+    changed: int = 0
+    unchanged: int = 0
+
+    def __str__(self):
+        return f"{self.probed:,} probed, {self.changed:,} changed or new, {self.unchanged:,} unchanged"
+
+
+class FingerprintStore:
+    """
+    Remembers the fingerprint of every tile as of its last successful fetch, so that a HEAD request can tell whether
+    a full GET is needed. Voids are remembered too (as a None fingerprint), so "region appeared" and "region vanished"
+    are both detected as changes.
+
+    The store is only written to disk upon save() (or upon leaving the context manager.)
+    """
+
+    def __init__(self, path: Optional[Path] = DEFAULT_FINGERPRINTS_FILE):
+        """
+        :param path: File to load from and save to; None for an in-memory-only store
+        """
+        self.path = path
+        self.stats = FingerprintStats()
+        self._prints: Dict[MapCoord, Optional[TileFingerprint]] = {}
+        if path is not None and path.exists():
+            with path.open("rb") as fin:
+                raw = msgpack.unpack(fin)
+            self._prints = {
+                MapCoord(x, y): (TileFingerprint.decode(fp) if fp is not None else None) for (x, y), fp in raw
+            }
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.save()
+
+    def __contains__(self, item: MapCoord) -> bool:
+        return item in self._prints
+
+    def __len__(self) -> int:
+        return len(self._prints)
+
+    def get(self, coord: MapCoord) -> Optional[TileFingerprint]:
+        return self._prints.get(coord)
+
+    def has_changed(self, coord: MapCoord, fingerprint: Optional[TileFingerprint], known_region: bool = False) -> bool:
+        """
+        Determine whether a tile needs a full fetch, given what a probe just found.
+
+        :param coord: Coordinate of the tile
+        :param fingerprint: Fingerprint found by the probe; None if the tile is (now) a void
+        :param known_region: Whether coord is known (from elsewhere) to be a region; this matters for coordinates
+        never recorded here, as a void there would then be a vanished region
+        :return: True if the tile must be fetched
+        """
+        self.stats.probed += 1
+        if coord not in self._prints:
+            changed = fingerprint is not None or known_region
+        else:
+            changed = self._prints[coord] != fingerprint
+        if changed:
+            self.stats.changed += 1
+        else:
+            self.stats.unchanged += 1
+        return changed
+
+    def record(self, coord: MapCoord, fingerprint: Optional[TileFingerprint]) -> None:
+        """Record the fingerprint of a tile that has been successfully fetched (None if it's a void)"""
+        self._prints[coord] = fingerprint
+
+    def save(self) -> None:
+        """Persist the store to disk (does nothing for an in-memory-only store)."""
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.path.with_suffix(".temp" + self.path.suffix)
+        with temp.open("wb") as fout:
+            msgpack.pack(
+                [(coord.encode(), fp.encode() if fp is not None else None) for coord, fp in self._prints.items()],
+                fout,
+            )
+        temp.replace(self.path)
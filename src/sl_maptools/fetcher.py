@@ -4,17 +4,44 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
 import io
-import random
+import os
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Callable, Dict, FrozenSet, List, Optional, Protocol, Set, Tuple, Union
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Container,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Protocol,
+    Set,
+    Tuple,
+    Union,
+)
 
 import httpx
-from PIL import Image
+from PIL import Image, ImageStat
 
-from sl_maptools import MapCoord, MapTile
+from sl_maptools import MapBounds, MapCoord, MapTile
+from sl_maptools.cache import FingerprintStore, TileCache, TileFingerprint, VoidRegistry
 from sl_maptools.knowns import VERIFIED_VOIDS
+from sl_maptools.metrics import FetchMetrics
+from sl_maptools.pool import ClientPool
+from sl_maptools.reporter import LOUD_EVENTS, PROGRESS_CHARS, ProgressReporter
+from sl_maptools.retry import CircuitBreaker, RetryPolicy
+from sl_maptools.singleflight import SingleFlight
+from sl_maptools.throttle import AdaptiveLimiter, LatencyTracker, RateLimiter
 from sl_maptools.utils import QuietablePrint
 
 
@@ -39,239 +66,885 @@ class MapProgressProtocol(Protocol):
     last_fail_rows: Set[int] = set()
 
 
+@dataclass
+class AreaProgress:
+    """Minimal implementation of MapProgressProtocol"""
+
+    regions: Dict[MapCoord, Any] = field(default_factory=dict)
+    seen: Set[MapCoord] = field(default_factory=set)
+    last_fail_rows: Set[int] = field(default_factory=set)
+
+
+@dataclass(frozen=True)
+class RowComplete:
+    """All tiles of a row have been fetched successfully"""
+
+    row: int
+    regions: int
+    elapsed: float
+
+
+@dataclass(frozen=True)
+class RowFailed:
+    """Fetching of a row has been aborted due to an error"""
+
+    row: int
+    error: Exception
+
+
+@dataclass(frozen=True)
+class Checkpoint:
+    """A good time to save progress"""
+
+    pass
+
+
+AreaEvent = Union[MapTile, RowComplete, RowFailed, Checkpoint]
+
+
 _RETRYABLE_EX = (httpx.ConnectTimeout, httpx.ReadTimeout, httpx.ReadError)
 
+# Statuses that indicate a healthy exchange with the CDN (403 is how the CDN says "void")
+HEALTHY_STATUSES = frozenset({200, 304, 403})
+
+# Color with which the CDN fills voids in low-zoom tiles. A region of flat open water looks much the same at low zoom,
+# so an area of this color is only ever deemed "unsure", never void; see DiscoveryMap.
+VOID_COLOR = (29, 71, 95)
+VOID_COLOR_TOLERANCE = 12
+# Voids are rendered as a flat fill; anything with more variance than this (in any channel) is not a void
+VOID_MAX_STDDEV = 6.0
+
+DISCOVERY_TOP_LEVEL = 6
+DISCOVERY_LEAF_LEVEL = 3
+
+DEFA_DECODE_WORKERS = min(4, os.cpu_count() or 1)
+DEFA_LOOKAHEAD = 100
+
+# Don't hedge until this many latency samples have been observed
+HEDGE_MIN_SAMPLES = 100
+
+JPEG_SOI = b"\xff\xd8"
+JPEG_EOI = b"\xff\xd9"
+
+
+@dataclass
+class DecodeStats:
+    """Accumulated statistics of JPEG decoding"""
+
+    count: int = 0
+    seconds: float = 0.0
+
+    @property
+    def average(self) -> float:
+        return (self.seconds / self.count) if self.count else 0.0
+
+    def __str__(self):
+        return f"{self.count:,} tiles decoded in {self.seconds:,.2f}s ({self.average * 1000:,.2f}ms avg) off the loop"
+
+
+@dataclass
+class HedgeStats:
+    """Accumulated statistics of request hedging"""
+
+    requests: int = 0
+    hedged: int = 0
+    hedge_won: int = 0
+
+    def __str__(self):
+        ratio = (self.hedged / self.requests) if self.requests else 0.0
+        return f"{self.hedged:,} hedges for {self.requests:,} requests ({ratio:.1%}), {self.hedge_won:,} won"
+
+
+class TileDecoder:
+    """
+    Decodes raw tiles into images using a bounded pool of threads.
+
+    Pillow releases the GIL while decoding, so decoding in threads lets the event loop continue servicing other
+    in-flight requests instead of stalling on every tile. The pool is created lazily and may be shared by several
+    fetchers (even across different event loops.)
+    """
+
+    def __init__(self, max_workers: int = DEFA_DECODE_WORKERS):
+        """
+        :param max_workers: Size of the thread pool
+        """
+        self.max_workers = max_workers
+        self.stats = DecodeStats()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _decode(self, raw: bytes) -> Image.Image:
+        start = time.perf_counter()
+        with io.BytesIO(raw) as bio:
+            img = Image.open(bio)
+            # Need to call .load() because .open() is lazy
+            img.load()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.stats.count += 1
+            self.stats.seconds += elapsed
+        return img
+
+    async def decode(self, raw: bytes) -> Image.Image:
+        """Decode raw bytes into an Image without blocking the event loop"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="TileDecoder")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._decode, raw)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+# Used by fetchers not given a decoder of their own; its threads are only started on first use, and are joined when
+# the interpreter exits
+DEFAULT_DECODER = TileDecoder()
+
+
+class DiscoveryMap:
+    """
+    Result of a low-zoom discovery pass: which map-1 tiles within the surveyed bounds may contain a region.
+
+    Tiles are sorted into three kinds:
+
+    - candidates: some content shows at low zoom
+    - voids: within a low-zoom tile the CDN answered "403" for, so known to be voids; they need not be fetched
+    - the others are unsure: their area shows as flat void fill, which a region of open water may look like, too;
+      they still have to be fetched (unless known to be voids from elsewhere, e.g., a VoidRegistry)
+    """
+
+    def __init__(self, bounds: MapBounds):
+        self.bounds = bounds
+        self.candidates: Set[MapCoord] = set()
+        self.known_voids: Set[MapCoord] = set()
+        self.requests: int = 0
+
+    def is_void(self, coord: MapCoord) -> bool:
+        return coord in self.known_voids and coord not in self.candidates
+
+    @property
+    def unsure_count(self) -> int:
+        return self.bounds.width * self.bounds.height - len(self.candidates) - len(self.known_voids)
+
+    @property
+    def voids(self) -> Container[MapCoord]:
+        """A container view of known voids, suitable for use as MapFetcher.skip_tiles"""
+        return _DiscoveredVoids(self)
+
+    def __str__(self):
+        total = self.bounds.width * self.bounds.height
+        return (
+            f"{len(self.candidates):,} candidate tiles out of {total:,} ({len(self.candidates) / total:.1%}),"
+            f" {len(self.known_voids):,} voids, {self.unsure_count:,} unsure; using {self.requests:,} low-zoom requests"
+        )
+
+
+class _DiscoveredVoids:
+    def __init__(self, dmap: DiscoveryMap):
+        self.dmap = dmap
+
+    def __contains__(self, item: MapCoord) -> bool:
+        return self.dmap.is_void(item)
+
+
+def _box_has_content(img: Image.Image, box: Tuple[int, int, int, int]) -> bool:
+    """Conservatively determine whether an area of a low-zoom tile contains anything other than void fill"""
+    stat = ImageStat.Stat(img.crop(box))
+    if max(stat.stddev) > VOID_MAX_STDDEV:
+        return True
+    return any(abs(m - v) > VOID_COLOR_TOLERANCE for m, v in zip(stat.mean, VOID_COLOR))
+
+
+def jpeg_defect(content: bytes, headers) -> Optional[str]:
+    """
+    Cheaply check that a payload is a complete JPEG, without decoding it: it must start with an SOI marker, end with
+    an EOI marker (some encoders pad with NULs after it), and be as long as the server said it would be.
+
+    :param content: The payload
+    :param headers: The response headers
+    :return: None if the payload looks intact, otherwise a description of what's wrong with it
+    """
+    declared = headers.get("Content-Length")
+    # If the payload was content-encoded, Content-Length is the length of the encoded payload
+    if declared is not None and headers.get("Content-Encoding") is None:
+        try:
+            expected = int(declared)
+        except ValueError:
+            return f"malformed Content-Length {declared!r}"
+        if expected != len(content):
+            return f"payload is {len(content):,} bytes, expected {expected:,}"
+    if not content.startswith(JPEG_SOI):
+        return "no JPEG SOI marker"
+    if not content.rstrip(b"\x00").endswith(JPEG_EOI):
+        return "no JPEG EOI marker (truncated?)"
+    return None
+
 
 class MapFetcher(object):
     URL_TEMPLATE = (
-        "https://secondlife-maps-cdn.akamaized.net/map-1-{map_x}-{map_y}-objects.jpg"
+        "https://secondlife-maps-cdn.akamaized.net/map-{zoom}-{map_x}-{map_y}-objects.jpg"
     )
 
     def __init__(
         self,
-        skip_tiles: Set[MapCoord] = None,
-        a_session: httpx.AsyncClient = None,
+        skip_tiles: Container[MapCoord] = None,
+        a_session: httpx.AsyncClient | ClientPool = None,
+        cache: TileCache = None,
+        rate_limiter: RateLimiter = None,
+        voids: VoidRegistry = None,
+        decoder: TileDecoder = None,
+        retry_policy: RetryPolicy = None,
+        breaker: CircuitBreaker = None,
+        metrics: FetchMetrics = None,
+        reporter: ProgressReporter = None,
+        flights: SingleFlight = None,
+        fingerprints: FingerprintStore = None,
     ):
         """
         Creates a Map Tile Getter with logic to retrieve map tiles
 
-        :param skip_tiles: A Set of coordinates to skip from being fetched
-        :param a_session: An Async client session
+        :param skip_tiles: A Set (or any Container) of coordinates to skip from being fetched
+        :param a_session: An Async client session, or a ClientPool
+        :param cache: Optional on-disk tile cache; if given, tiles will be revalidated using conditional GETs
+        :param rate_limiter: Optional rate limiter (possibly shared with other clients)
+        :param voids: Optional registry of known voids; every void seen will be recorded there, and known voids
+        (except those due for re-probing) will not be fetched
+        :param decoder: Optional TileDecoder (possibly shared with other fetchers) to decode JPEGs off the event loop;
+        if not given, DEFAULT_DECODER will be used
+        :param retry_policy: Decides whether and when failed fetches are retried (default: RetryPolicy())
+        :param breaker: Optional CircuitBreaker (possibly shared with other fetchers) to pause all fetches when the
+        error rate spikes, or when the CDN asks for it through Retry-After
+        :param metrics: Optional FetchMetrics to record requests into
+        :param reporter: Optional ProgressReporter to count progress events into; if not given, progress will be
+        indicated by printing a character per event
+        :param flights: Optional SingleFlight (possibly shared with other fetchers) through which concurrent
+        requests for the same tile are coalesced; if not given, a private one will be created
+        :param fingerprints: Optional FingerprintStore to record the fingerprint of every tile fetched into (taken from
+        the headers of the GET response, or None for a void), for later freshness probes to compare against
+        """
+        self.skip_tiles: Container[MapCoord] = set() if skip_tiles is None else skip_tiles
+        self.a_session: httpx.AsyncClient | ClientPool = a_session
+        self.cache: Optional[TileCache] = cache
+        self.rate_limiter: Optional[RateLimiter] = rate_limiter
+        self.voids: Optional[VoidRegistry] = voids
+        self.decoder: TileDecoder = DEFAULT_DECODER if decoder is None else decoder
+        self.retry_policy: RetryPolicy = RetryPolicy() if retry_policy is None else retry_policy
+        self.breaker: Optional[CircuitBreaker] = breaker
+        self.metrics: Optional[FetchMetrics] = metrics
+        self.reporter: Optional[ProgressReporter] = reporter
+        self.flights: SingleFlight = SingleFlight() if flights is None else flights
+        self.fingerprints: Optional[FingerprintStore] = fingerprints
+
+    def _progress(self, event: str, quiet: bool, text: str = None) -> None:
+        """
+        Report a progress event.
+
+        :param event: Name of the event, one of PROGRESS_CHARS' keys
+        :param quiet: If True, don't print the event (unless it's a LOUD_EVENTS); counting into the reporter (if any)
+        is not affected
+        :param text: What to print instead of the event's usual character
+        """
+        if self.reporter is not None:
+            self.reporter.count(event)
+        elif not quiet or event in LOUD_EVENTS:
+            print(text or PROGRESS_CHARS[event], end="", flush=True)
+
+    async def _send(self, url: str, headers: Dict[str, str] = None, method: str = "GET") -> httpx.Response:
+        """
+        Performs the actual HTTP request, reporting its outcome to _observe()
+
+        :param url: URL to request
+        :param headers: Additional request headers, if any
+        :param method: "GET" or "HEAD"
+        :return: The response
+        """
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(url)
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.in_flight.inc()
+        start = time.monotonic()
+        try:
+            send = self.a_session.head if method == "HEAD" else self.a_session.get
+            response = await send(url, headers=headers)
+        except Exception as e:
+            self._observe(time.monotonic() - start, None)
+            if metrics is not None:
+                metrics.errors.inc(error=type(e).__name__)
+            raise
+        finally:
+            if metrics is not None:
+                metrics.in_flight.dec()
+        latency = time.monotonic() - start
+        self._observe(latency, response.status_code)
+        if metrics is not None:
+            metrics.request_latency.observe(latency)
+            metrics.responses.inc(status=response.status_code)
+            metrics.bytes.inc(len(response.content))
+        if self.rate_limiter is not None:
+            self.rate_limiter.consume_bytes(url, len(response.content))
+        return response
+
+    def _observe(self, latency: float, status_code: Optional[int]) -> None:
         """
-        self.skip_tiles: Set[MapCoord] = set() if skip_tiles is None else skip_tiles
-        self.a_session: httpx.AsyncClient = a_session
+        Invoked upon completion of every request. Feeds the circuit breaker (if any); subclasses override this to
+        gather further statistics.
+
+        :param latency: Time (seconds) from sending the request to receiving the response (or the exception)
+        :param status_code: HTTP status code, or None if the request raised an exception
+        """
+        if self.breaker is not None:
+            self.breaker.record(status_code in HEALTHY_STATUSES)
 
     async def async_get_tile_raw(
         self,
         coord: MapCoord,
         quiet: bool = False,
-        retries: int = 2,
+        retries: int = None,
         raise_err: bool = True,
+        zoom: int = 1,
     ) -> RawTile:
         """
         Asynchronously fetch a map tile from a given coordinate
 
         :param coord: Map's coordinates
         :param quiet: If False (default), will emit progress indicator
-        :param retries: How many times to retry if fetching attempt results in error (default = 3)
+        :param retries: Maximum number of attempts for this tile, overriding the retry policy's max_attempts
         :param raise_err: If True (default), will (re-)raise error
+        :param zoom: Zoom level; level n covers 2^(n-1) x 2^(n-1) regions, with coord being the lower-left region.
+        Skipping and caching only apply to level 1.
         :return: An instance of MapTile fetched from (X, Y)
         """
-        qprint = QuietablePrint(quiet)
-        qprint(".", end="", flush=True)
-        if coord in self.skip_tiles or coord in VERIFIED_VOIDS:
+        # Concurrent requests for the same tile share one fetch (performed with the parameters of the first one)
+        try:
+            return await self.flights.do(("tile", zoom, coord), lambda: self._get_tile_raw(coord, quiet, retries, zoom))
+        except MapConnectionError:
+            if raise_err:
+                raise
+            return None
+
+    async def _get_tile_raw(self, coord: MapCoord, quiet: bool, retries: Optional[int], zoom: int) -> RawTile:
+        """Actually fetch a tile; see async_get_tile_raw() for the parameters. Raises MapConnectionError on failure."""
+        self._progress("requested", quiet)
+        if zoom == 1 and (coord in self.skip_tiles or coord in VERIFIED_VOIDS):
             # return MapTile(coord, None)
             return coord, None
-        url = self.URL_TEMPLATE.format(map_x=coord.x, map_y=coord.y)
+        voids = self.voids if zoom == 1 else None
+        if voids is not None and voids.should_skip(coord):
+            return coord, None
+        cache = self.cache if zoom == 1 else None
+        url = self.URL_TEMPLATE.format(zoom=zoom, map_x=coord.x, map_y=coord.y)
+        policy = self.retry_policy
         internal_errors = []
-        multiplier = 0.25
-        for _ in range(0, retries):
-            multiplier *= 2.0
-            await asyncio.sleep(random.random() * multiplier)
-
-            for _ in range(0, 8):
-                mul2 = 0.5
-                try:
-                    response = await self.a_session.get(url)
-                    break
-                except _RETRYABLE_EX as e1:
-                    # Not quietable
-                    print(">", end="", flush=True)
-                    internal_errors.append(e1)
-                    await asyncio.sleep(random.random() * mul2)
-                    mul2 *= 2.0
-                    continue
-                except Exception as e:
-                    raise MapConnectionError(internal_errors=[e], coord=coord)
+        attempt = 0
+        delay = 0.0
+        while True:
+            attempt += 1
+            if self.breaker is not None:
+                await self.breaker.wait()
+            headers = cache.conditional_headers(coord) if cache is not None else None
+            retry_after = None
+            try:
+                response = await self._send(url, headers=headers)
+            except _RETRYABLE_EX as e1:
+                self._progress("timeout", quiet)
+                internal_errors.append(e1)
+            except Exception as e:
+                raise MapConnectionError(internal_errors=[e], coord=coord)
             else:
+                status_code = response.status_code
+
+                if status_code == 403:
+                    # "403 Forbidden" means the tile is a void
+                    self._progress("void", quiet)
+                    if cache is not None:
+                        cache.invalidate(coord)
+                    if voids is not None:
+                        voids.record_void(coord)
+                    if self.fingerprints is not None and zoom == 1:
+                        self.fingerprints.record(coord, None)
+                    # return MapTile(coord, None)
+                    return coord, None
+
+                if status_code == 304 and cache is not None:
+                    # "304 Not Modified" only happens on conditional GET, i.e., we have the tile cached
+                    if (cached := cache.revalidated(coord)) is not None:
+                        self._progress("revalidated", quiet)
+                        if voids is not None:
+                            voids.record_region(coord)
+                        return coord, cached
+                    # Cached blob went missing (and is now forgotten); immediately retry with an unconditional GET
+                    attempt -= 1
+                    continue
+
+                if status_code == 200 and (defect := jpeg_defect(response.content, response.headers)) is not None:
+                    # Catch it now, rather than having TileProcessor choke on it and the whole row be refetched
+                    self._progress("corrupt", quiet, f"#({coord})")
+                    if self.metrics is not None:
+                        self.metrics.corrupt.inc()
+                    internal_errors.append(f"Corrupt payload: {defect}")
+                    if not policy.should_retry(attempt, retries):
+                        break
+                    if self.metrics is not None:
+                        self.metrics.retries.inc()
+                    # Most likely a transfer gone wrong rather than an overloaded server, so no need to back off
+                    continue
+
+                if status_code == 200:
+                    self._progress("fetched", quiet)
+                    if voids is not None:
+                        voids.record_region(coord)
+                    if cache is not None:
+                        cache.store(
+                            coord,
+                            response.content,
+                            etag=response.headers.get("ETag"),
+                            last_modified=response.headers.get("Last-Modified"),
+                        )
+                    if self.fingerprints is not None and zoom == 1:
+                        self.fingerprints.record(coord, TileFingerprint.from_headers(response.headers))
+                    return coord, response.content
+
+                self._progress("bad_status", quiet, f"{status_code}?")
+                internal_errors.append(
+                    f"Unexpected HTTP status code {response.status_code}"
+                )
+                if status_code in policy.retry_after_statuses:
+                    retry_after = policy.parse_retry_after(response.headers.get("Retry-After"))
+                    if retry_after is not None and self.breaker is not None:
+                        # The server is telling everyone to back off, not just this request
+                        self.breaker.pause(retry_after)
+
+            if not policy.should_retry(attempt, retries):
                 break
+            if self.metrics is not None:
+                self.metrics.retries.inc()
+            delay = policy.delay(attempt, delay, retry_after)
+            await asyncio.sleep(delay)
+        self._progress("failed", quiet, f"ERR({coord})")
+        raise MapConnectionError(internal_errors=internal_errors, coord=coord)
 
-            status_code = response.status_code
-
-            if status_code == 403:
-                # "403 Forbidden" means the tile is a void
-                qprint("-", end="", flush=True)
-                # return MapTile(coord, None)
-                return coord, None
-
-            if status_code == 200:
-                qprint("+", end="", flush=True)
-                # with io.BytesIO(response.content) as bio:
-                #     grabbed = Image.open(bio)
-                #     # Need to call .load() because .open() is lazy
-                #     grabbed.load()
-                # return MapTile(coord, grabbed)
-                return coord, response.content
-
-            # Don't quiet this
-            print(f"{status_code}?", end="", flush=True)
-            internal_errors.append(
-                f"Unexpected HTTP status code {response.status_code}"
-            )
-            await asyncio.sleep(0.5)
-        print(f"ERR({coord})", end="", flush=True)
-        if raise_err:
-            raise MapConnectionError(internal_errors=internal_errors, coord=coord)
+    async def async_probe_tile(self, coord: MapCoord) -> Tuple[MapCoord, Optional[TileFingerprint]]:
+        """
+        Find out the fingerprint of a tile using a HEAD request, i.e., without downloading it.
+
+        Skip lists, void registry, and cache are not consulted; it's the caller's job to decide what to probe and what
+        to do with the result.
+
+        :param coord: Map's coordinates
+        :return: A tuple of (coord, fingerprint), fingerprint being None if the tile is a void
+        """
+        return await self.flights.do(("head", coord), lambda: self._probe_tile(coord))
+
+    async def _probe_tile(self, coord: MapCoord) -> Tuple[MapCoord, Optional[TileFingerprint]]:
+        url = self.URL_TEMPLATE.format(zoom=1, map_x=coord.x, map_y=coord.y)
+        policy = self.retry_policy
+        internal_errors = []
+        attempt = 0
+        delay = 0.0
+        while True:
+            attempt += 1
+            if self.breaker is not None:
+                await self.breaker.wait()
+            retry_after = None
+            try:
+                response = await self._send(url, method="HEAD")
+            except _RETRYABLE_EX as e1:
+                internal_errors.append(e1)
+            except Exception as e:
+                raise MapConnectionError(internal_errors=[e], coord=coord)
+            else:
+                if response.status_code == 403:
+                    return coord, None
+                if response.status_code == 200:
+                    return coord, TileFingerprint.from_headers(response.headers)
+                internal_errors.append(f"Unexpected HTTP status code {response.status_code}")
+                if response.status_code in policy.retry_after_statuses:
+                    retry_after = policy.parse_retry_after(response.headers.get("Retry-After"))
+            if not policy.should_retry(attempt):
+                raise MapConnectionError(internal_errors=internal_errors, coord=coord)
+            delay = policy.delay(attempt, delay, retry_after)
+            await asyncio.sleep(delay)
 
     async def async_get_tile(
         self,
         coord: MapCoord,
         quiet: bool = False,
-        retries: int = 2,
+        retries: int = None,
         raise_err: bool = True,
     ) -> MapTile:
         coord, raw = await self.async_get_tile_raw(coord, quiet, retries, raise_err)
         if raw is None:
             return MapTile(coord, None)
 
-        with io.BytesIO(raw) as bio:
-            grabbed = Image.open(bio)
-            # Need to call .load() because .open() is lazy
-            grabbed.load()
+        grabbed = await self.decoder.decode(raw)
         return MapTile(coord, grabbed)
 
+    async def _discover_block(
+        self, dmap: DiscoveryMap, level: int, corner: MapCoord, leaf_level: int
+    ) -> List[Tuple[int, MapCoord]]:
+        """
+        Fetch one low-zoom tile and classify its contents.
+
+        :param dmap: The DiscoveryMap to record candidates into
+        :param level: Zoom level of the tile
+        :param corner: Lower-left region of the tile
+        :param leaf_level: At this level, individual regions get classified
+        :return: A list of (level, corner) of finer tiles that need to be examined further
+        """
+        span = 2 ** (level - 1)
+        block = [co for i in range(span) for j in range(span) if (co := corner + (i, j)) in dmap.bounds]
+
+        def all_candidates() -> List[Tuple[int, MapCoord]]:
+            # Can't tell, so err on the side of caution and fetch every tile in the block
+            dmap.candidates.update(block)
+            return []
+
+        dmap.requests += 1
+        try:
+            _, raw = await self.async_get_tile_raw(corner, quiet=True, zoom=level)
+        except MapConnectionError:
+            return all_candidates()
+        if raw is None:
+            # The whole block is void
+            dmap.known_voids.update(block)
+            return []
+        try:
+            img = await self.decoder.decode(raw)
+        except Exception:
+            # A JPEG intact enough to pass jpeg_defect(), yet undecodable
+            return all_candidates()
+        if level <= leaf_level:
+            cell = img.width // span
+            for i in range(span):
+                for j in range(span):
+                    co = corner + (i, j)
+                    if co not in dmap.bounds:
+                        continue
+                    box = (i * cell, (span - 1 - j) * cell, (i + 1) * cell, (span - j) * cell)
+                    if _box_has_content(img, box):
+                        dmap.candidates.add(co)
+            return []
+        half = span // 2
+        quad = img.width // 2
+        children = []
+        for qi, qj in ((0, 0), (1, 0), (0, 1), (1, 1)):
+            child = corner + (qi * half, qj * half)
+            child_bounds = MapBounds(child.x, child.y, child.x + half - 1, child.y + half - 1)
+            if not _bounds_overlap(child_bounds, dmap.bounds):
+                continue
+            box = (qi * quad, (1 - qj) * quad, (qi + 1) * quad, (2 - qj) * quad)
+            if _box_has_content(img, box):
+                children.append((level - 1, child))
+        return children
+
+    async def async_discover(
+        self,
+        bounds: MapBounds,
+        top_level: int = DISCOVERY_TOP_LEVEL,
+        leaf_level: int = DISCOVERY_LEAF_LEVEL,
+    ) -> DiscoveryMap:
+        """
+        Use low-zoom tiles to find out which map-1 tiles within bounds may contain a region.
+
+        Starts by fetching tiles of top_level covering bounds. A "403" means the whole block is void.
+        Otherwise, every quadrant showing any content is examined further using tiles one level finer,
+        until leaf_level, where individual regions are classified.
+
+        Classification is conservative: only tiles within a "403" block are deemed void. Flat areas of the void fill
+        color are not examined further, but are only deemed unsure, as they might be regions of open water.
+
+        :param bounds: Area to survey
+        :param top_level: Coarsest zoom level to start from
+        :param leaf_level: Zoom level at which individual regions are classified (must be at least 2)
+        :return: A DiscoveryMap of candidate tiles
+        """
+        if not (2 <= leaf_level <= top_level):
+            raise ValueError("Must satisfy 2 <= leaf_level <= top_level")
+        dmap = DiscoveryMap(bounds)
+        span = 2 ** (top_level - 1)
+        x_start = bounds.x_leftmost // span * span
+        y_start = bounds.y_bottommost // span * span
+        blocks = [
+            (top_level, MapCoord(x, y))
+            for y in range(y_start, bounds.y_topmost + 1, span)
+            for x in range(x_start, bounds.x_rightmost + 1, span)
+        ]
+        while blocks:
+            results = await asyncio.gather(
+                *(self._discover_block(dmap, level, corner, leaf_level) for level, corner in blocks)
+            )
+            blocks = [child for children in results for child in children]
+        return dmap
+
+    async def iter_area(
+        self,
+        corner1: MapCoord,
+        corner2: MapCoord,
+        lookahead: int = DEFA_LOOKAHEAD,
+        save_every: int = 451,
+        force_rows: Optional[FrozenSet[int]] = None,
+        progress: MapProgressProtocol = None,
+        sliding: bool = False,
+    ) -> AsyncIterator[AreaEvent]:
+        """
+        Asynchronously iterate over an area from corner1 to corner2 inclusive, row by row starting from the top.
+
+        Yields fetched MapTile's interspersed with typed events:
+        - RowComplete after all tiles of a row have been yielded
+        - RowFailed if fetching any tile of a row failed (the row's remaining tiles will not be yielded)
+        - Checkpoint every save_every tiles
+
+        At most lookahead fetches are in flight, and no new fetch is launched while the consumer is busy processing
+        a yielded item; hence a slow consumer automatically caps memory usage.
+
+        By default, a row must be finished before the next one is started. In sliding mode, fetches of the next
+        rows are launched as soon as there is room in the window, so that a single slow tile no longer idles all
+        other connections. Row events are still yielded in row order, though possibly later than some tiles
+        of subsequent rows.
+
+        :param corner1: One corner of the area (inclusive)
+        :param corner2: The other diametrically opposite corner of the area (inclusive)
+        :param lookahead: Maximum number of fetches in flight
+        :param save_every: Yield a Checkpoint every this many tiles
+        :param force_rows: Set of rows to be retrieved even if already seen in progress.seen
+        :param progress: Map fetching progress state; its last_fail_rows will be updated
+        :param sliding: If True, keep lookahead fetches in flight across row boundaries
+        """
+        bounds = MapBounds.from_coords(corner1, corner2)
+        progress = AreaProgress() if progress is None else progress
+        force_rows = force_rows or frozenset()
+
+        def row_coords(y: int) -> List[MapCoord]:
+            return [
+                coord
+                for x in range(bounds.x_leftmost, bounds.x_rightmost + 1)
+                if (coord := MapCoord(x, y)) not in progress.seen or y in force_rows
+            ]
+
+        rows = range(bounds.y_topmost, bounds.y_bottommost - 1, -1)
+        if sliding:
+            events = self._iter_sliding(rows, row_coords, lookahead, save_every, progress)
+        else:
+            events = self._iter_rowwise(rows, row_coords, lookahead, save_every, progress)
+        async with contextlib.aclosing(events):
+            async for event in events:
+                yield event
+
+    async def _iter_rowwise(
+        self,
+        rows: Iterable[int],
+        row_coords: Callable[[int], List[MapCoord]],
+        lookahead: int,
+        save_every: int,
+        progress: MapProgressProtocol,
+    ) -> AsyncIterator[AreaEvent]:
+        """Implements iter_area, with a barrier at the end of every row"""
+        count = 0
+        for y in rows:
+            coords = iter(row_coords(y))
+            row_t = time.monotonic()
+            row_regions = 0
+            failure: Optional[Exception] = None
+            pending: Set[asyncio.Task] = set()
+
+            def refill():
+                while len(pending) < lookahead and (co := next(coords, None)) is not None:
+                    pending.add(asyncio.create_task(self.async_get_tile(co, quiet=True)))
+
+            refill()
+            if not pending:
+                continue
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if (exc := task.exception()) is not None:
+                            failure = failure or exc
+                        # Once a row fails, just drain the row's fetches without yielding their results
+                        if failure is not None:
+                            continue
+                        tile: MapTile = task.result()
+                        if not tile.is_void:
+                            row_regions += 1
+                        yield tile
+                        count += 1
+                        if count >= save_every:
+                            count = 0
+                            yield Checkpoint()
+                    if failure is None:
+                        refill()
+            finally:
+                for task in pending:
+                    task.cancel()
+                # Let the cancellations complete, lest the tasks be destroyed while still pending
+                await asyncio.gather(*pending, return_exceptions=True)
+
+            if failure is not None:
+                progress.last_fail_rows.add(y)
+                yield RowFailed(y, failure)
+                continue
+            progress.last_fail_rows.discard(y)
+            yield RowComplete(y, row_regions, time.monotonic() - row_t)
+
+    async def _iter_sliding(
+        self,
+        rows: Iterable[int],
+        row_coords: Callable[[int], List[MapCoord]],
+        lookahead: int,
+        save_every: int,
+        progress: MapProgressProtocol,
+    ) -> AsyncIterator[AreaEvent]:
+        """Implements iter_area, keeping the window full across row boundaries"""
+        remaining: Dict[int, int] = {}
+        regions: Dict[int, int] = {}
+        starts: Dict[int, float] = {}
+        failures: Dict[int, Exception] = {}
+        # Rows in the order they were started; row events must be emitted in this order
+        row_order: deque[int] = deque()
+
+        def gen_coords() -> Iterator[MapCoord]:
+            for y in rows:
+                if not (coords := row_coords(y)):
+                    continue
+                remaining[y] = len(coords)
+                regions[y] = 0
+                starts[y] = time.monotonic()
+                row_order.append(y)
+                yield from coords
+
+        coords_g = gen_coords()
+        pending: Set[asyncio.Task] = set()
+        task_rows: Dict[asyncio.Task, int] = {}
+
+        def refill():
+            while len(pending) < lookahead and (co := next(coords_g, None)) is not None:
+                if co.y in failures:
+                    # The row is lost already, no point in fetching the rest of it
+                    remaining[co.y] -= 1
+                    continue
+                task = asyncio.create_task(self.async_get_tile(co, quiet=True))
+                task_rows[task] = co.y
+                pending.add(task)
+
+        count = 0
+        refill()
+        try:
+            # Skipping the rest of a failed row may finish it with no fetch left pending, hence checking row_order
+            while pending or row_order:
+                done = set()
+                if pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    y = task_rows.pop(task)
+                    remaining[y] -= 1
+                    if (exc := task.exception()) is not None:
+                        failures.setdefault(y, exc)
+                    if y in failures:
+                        continue
+                    tile: MapTile = task.result()
+                    if not tile.is_void:
+                        regions[y] += 1
+                    yield tile
+                    count += 1
+                    if count >= save_every:
+                        count = 0
+                        yield Checkpoint()
+                while row_order and remaining[row_order[0]] == 0:
+                    y = row_order.popleft()
+                    if y in failures:
+                        progress.last_fail_rows.add(y)
+                        yield RowFailed(y, failures.pop(y))
+                    else:
+                        progress.last_fail_rows.discard(y)
+                        yield RowComplete(y, regions[y], time.monotonic() - starts[y])
+                    del remaining[y], regions[y], starts[y]
+                refill()
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
     async def async_get_area(
         self,
         corner1: MapCoord,
         corner2: MapCoord,
-        tile_callback: Callable[[Union[MapTile, str]], None],
+        tile_callback: Callable[[AreaEvent], None],
         save_every: int = 451,
         stats_every: int = 20,
         force_rows: Optional[FrozenSet[int]] = None,
         progress: MapProgressProtocol = None,
         err_callback: Callable[[str], None] = None,
         quiet: bool = False,
+        sliding_window: bool = False,
     ):
         """
         Asynchronously get an area from corner1 to corner2 inclusive.
 
         `tile_callback` will be called for every successful tile retrieval with the fetched tile.
-        Do note that on some checkpoints, `tile_callback` will be called with one of "SAVE", "ROW", or other strings;
+        Do note that on some checkpoints, `tile_callback` will be called with a Checkpoint or a RowComplete;
         therefore whatever implementation `tile_callback` is, it must NOT assume that the arg is MapTile
 
         :param corner1: One corner of the area (inclusive)
         :param corner2: The other diametrically opposite corner of the area (inclusive)
         :param tile_callback: Function to be called back on every successful tile fetch
-        :param save_every: Emit "SAVE" to tile_callback every this count
+        :param save_every: Emit Checkpoint to tile_callback every this count
         :param stats_every: Emit stats every this count
         :param force_rows: Set of rows to be retrieved even if already seen in progress.seen
         :param progress: Map fetching progress state
         :param err_callback: Function to be called back on tile fetch error
         :param quiet: If true, try to be less chatty
+        :param sliding_window: If true, don't wait for a row to finish before fetching tiles of the next rows
         :return:
         """
         qprint = QuietablePrint(quiet)
-        x1, y1 = corner1
-        x2, y2 = corner2
-        x_min, x_max = (x1, x2) if x1 < x2 else (x2, x1)
-        y_min, y_max = (y1, y2) if y1 < y2 else (y2, y1)
-        qprint(f"Fetching area ({x_min}, {y_max})..({x_max}, {y_min})...")
+        bounds = MapBounds.from_coords(corner1, corner2)
+        qprint(
+            f"Fetching area ({bounds.x_leftmost}, {bounds.y_topmost})..({bounds.x_rightmost}, {bounds.y_bottommost})..."
+        )
         if progress is None:
-            progress = MapProgressProtocol()
+            progress = AreaProgress()
         nonvoids_count = len(progress.regions)
         tiles_count = len(progress.seen)
-        if not quiet:
-            print("Generating jobs")
-        if force_rows is None:
-            force_rows = set()
-        count = 0
         rows_processed = 0
         aborted_count = 0
-        skipping = False
-        y = -1
+        y = bounds.y_topmost
         try:
-            for y in range(y_max, y_min - 1, -1):
-                row_t = time.monotonic()
-
-                tasks = []
-                for x in range(x_min, x_max + 1):
-                    coord = MapCoord(x, y)
-                    if coord in progress.seen and y not in force_rows:
-                        continue
-                    tasks.append(self.async_get_tile(coord, quiet=True))
-
-                if not tasks:
-                    if not skipping:
-                        skipping = True
-                        qprint(f"Skipping row {y} to ... ", end="", flush=True)
-                    continue
-                if skipping:
-                    skipping = False
-                    if not quiet:
-                        print(y + 1)
-
-                qprint(f"Waiting for row {y}...", end="", flush=True)
-                tile: Optional[MapTile] = None
-                row_nonvoids = 0
-
-                aborting_exception = None
-
-                for task in asyncio.as_completed(tasks):
-                    try:
-                        tile = await task
-                    except KeyboardInterrupt as e:
-                        progress.last_fail_rows.add(y)
-                        aborting_exception = e
-                    except Exception as e:
-                        if not isinstance(e, MapConnectionError):
-                            print(str(e), flush=True)
-                        if err_callback:
-                            err_callback(str(e))
-                        progress.last_fail_rows.add(y)
-                        if aborting_exception is None:
-                            qprint(f" aborting row {y}", flush=True)
-                            aborted_count += 1
-                            aborting_exception = e
-                    # Note: We can't raise ourselves out of the loop, because if we do that we might miss exceptions
-                    # happening in sunsequent completing tasks, causing another error about "Exception not handled"
-                    # However, we also don't want to waste effort processing this row, so we just 'shortcircuit'
-                    # the loop instead
-                    if aborting_exception is not None:
-                        continue
-
-                    tile_callback(tile)
-                    if not tile.is_void:
+            async for event in self.iter_area(
+                corner1,
+                corner2,
+                save_every=save_every,
+                force_rows=force_rows,
+                progress=progress,
+                sliding=sliding_window,
+            ):
+                if isinstance(event, MapTile):
+                    y = event.coord.y
+                    tile_callback(event)
+                    if not event.is_void:
                         nonvoids_count += 1
-                        row_nonvoids += 1
                     tiles_count += 1
-                    count += 1
-                    if count >= save_every:
-                        tile_callback("SAVE")
-                        count = 0
-
-                # Here, a different situation from the previous Note. We don't want to abort the whole processing,
-                # we just want to skip end-of-row processing because the row has been aborted.
-                if aborting_exception is not None:
+                    continue
+                if isinstance(event, Checkpoint):
+                    tile_callback(event)
+                    continue
+                if isinstance(event, RowFailed):
+                    if not isinstance(event.error, MapConnectionError):
+                        print(str(event.error), flush=True)
+                    if err_callback:
+                        err_callback(str(event.error))
+                    qprint(f"Aborting row {event.row}", flush=True)
+                    aborted_count += 1
                     continue
 
-                tile_callback("ROW")
+                tile_callback(event)
                 rows_processed += 1
-                progress.last_fail_rows.discard(y)
-
-                row_e = time.monotonic() - row_t
-                qprint(f" {row_nonvoids} regions, {row_e:,.2f}s", flush=True)
+                qprint(f"Row {event.row}: {event.regions} regions, {event.elapsed:,.2f}s", flush=True)
 
-                if y % stats_every == 0:
+                if event.row % stats_every == 0:
                     qprint(
                         f"# Total of {nonvoids_count:,} regions so far in {tiles_count:,} tiles",
                         end="",
@@ -280,9 +953,6 @@ class MapFetcher(object):
                         qprint(f", with {aborted_count} row aborts.")
                     else:
                         qprint()
-            else:
-                if skipping:
-                    qprint(y, flush=True)
             qprint(
                 f"All requested rows have been fetched, a total of {rows_processed} new rows."
             )
@@ -290,6 +960,15 @@ class MapFetcher(object):
             progress.last_fail_rows.add(y)
 
 
+def _bounds_overlap(b1: MapBounds, b2: MapBounds) -> bool:
+    return not (
+        b1.x_rightmost < b2.x_leftmost
+        or b2.x_rightmost < b1.x_leftmost
+        or b1.y_topmost < b2.y_bottommost
+        or b2.y_topmost < b1.y_bottommost
+    )
+
+
 class MapCanvas(object):
     def __init__(
         self,
@@ -337,29 +1016,147 @@ class BoundedMapFetcher(MapFetcher):
     """
     Wraps MapFetcher in a way to limit in-flight fetches.
 
-    It does this by implementing a semaphore of a certain size, and only launches an actual fetcher job when it can
-    acquire a semaphore.
+    It does this by implementing a limiter (a semaphore of adjustable size), and only launches an actual fetcher job
+    when it can acquire a slot from the limiter.
 
     This is done to limit the concurrent hit against the SL Maps CDN, because empirical experience seems to indicate
-    that if there are too many in-flight requests, we get throttled.
+    that if there are too many in-flight requests, we get throttled. If an AdaptiveLimiter with room to move is
+    provided, the limit will follow the CDN's actual capacity, as judged from latencies, timeouts, and HTTP statuses.
+
+    Optionally, requests can be hedged: if a request hasn't been answered within the observed hedge_percentile
+    latency, a duplicate is sent, and whichever answers first wins (the other is cancelled). Hedges don't count
+    against the limiter, but their number is capped to hedge_budget (a fraction) of the requests sent.
     """
 
-    def __init__(self, sema_size: int, async_session: httpx.AsyncClient, retries: int = 3):
+    def __init__(
+        self,
+        sema_size: int,
+        async_session: httpx.AsyncClient | ClientPool,
+        retries: int = None,
+        cache: TileCache = None,
+        limiter: AdaptiveLimiter = None,
+        rate_limiter: RateLimiter = None,
+        voids: VoidRegistry = None,
+        retry_policy: RetryPolicy = None,
+        breaker: CircuitBreaker = None,
+        metrics: FetchMetrics = None,
+        reporter: ProgressReporter = None,
+        hedge_budget: float = None,
+        hedge_percentile: float = 95.0,
+        fingerprints: FingerprintStore = None,
+        flights: SingleFlight = None,
+    ):
         """
 
-        :param sema_size: Size of semaphore, which limits the number of in-flight requests
-        :param async_session: The asynchronous httpx session to be used (connection pool, etc)
-        :param retries: How many times to retry if request completes but we get an unexpected HTTP Status Code
+        :param sema_size: Limits the number of in-flight requests; ignored if limiter is provided
+        :param async_session: The asynchronous httpx session to be used (connection pool, etc), or a ClientPool to
+        spread requests over several sessions
+        :param retries: Maximum number of attempts per tile; if not given, the retry policy decides
+        :param cache: Optional on-disk tile cache, shared with other fetchers
+        :param limiter: Optional AdaptiveLimiter; if not provided, a fixed limit of sema_size will be used
+        :param rate_limiter: Optional rate limiter, shared with other clients
+        :param voids: Optional registry of known voids
+        :param retry_policy: Decides whether and when failed fetches are retried
+        :param breaker: Optional CircuitBreaker; pauses all fetches when the error rate spikes
+        :param metrics: Optional FetchMetrics to record requests (and limiter waits) into
+        :param reporter: Optional ProgressReporter to count progress events into
+        :param hedge_budget: Maximum hedged requests, as a fraction of all requests; None (default) disables hedging
+        :param hedge_percentile: Latency percentile after which a request gets hedged
+        :param fingerprints: Optional FingerprintStore to record the fingerprint of every tile fetched into
+        :param flights: Optional SingleFlight, shared with other fetchers, to coalesce concurrent requests through
         """
-        super().__init__(a_session=async_session)
-        self.sema = asyncio.Semaphore(sema_size)
+        super().__init__(
+            a_session=async_session,
+            cache=cache,
+            rate_limiter=rate_limiter,
+            voids=voids,
+            retry_policy=retry_policy,
+            breaker=breaker,
+            metrics=metrics,
+            reporter=reporter,
+            flights=flights,
+            fingerprints=fingerprints,
+        )
+        if limiter is None:
+            limiter = AdaptiveLimiter(sema_size, min_limit=sema_size, max_limit=sema_size)
+        self.limiter = limiter
+        if metrics is not None:
+            metrics.limit.set_function(lambda: self.limiter.limit)
         self.retries = retries
+        self.hedge_budget = hedge_budget
+        self.hedge_percentile = hedge_percentile
+        self.hedge_stats = HedgeStats()
+        self.latencies = LatencyTracker()
+
+    def _observe(self, latency: float, status_code: Optional[int]) -> None:
+        super()._observe(latency, status_code)
+        ok = status_code in HEALTHY_STATUSES
+        self.limiter.record(latency, ok)
+        if ok:
+            self.latencies.add(latency)
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Returns how long to wait before hedging a request, or None if the request must not be hedged"""
+        if self.hedge_budget is None or len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        if self.hedge_stats.hedged >= self.hedge_budget * self.hedge_stats.requests:
+            return None
+        return self.latencies.percentile(self.hedge_percentile)
+
+    async def _send(self, url: str, headers: Dict[str, str] = None, method: str = "GET") -> httpx.Response:
+        self.hedge_stats.requests += 1
+        if (delay := self._hedge_delay()) is None:
+            return await super()._send(url, headers=headers, method=method)
+
+        tasks = {asyncio.create_task(super()._send(url, headers=headers, method=method))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            # Budget is re-checked because other requests may have hedged while we were waiting
+            if done or self._hedge_delay() is None:
+                return await next(iter(tasks))
+            self.hedge_stats.hedged += 1
+            if self.metrics is not None:
+                self.metrics.hedges.inc()
+            hedge = asyncio.create_task(super()._send(url, headers=headers, method=method))
+            tasks.add(hedge)
+            while True:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((t for t in done if t.exception() is None), None)
+                if winner is not None:
+                    if winner is hedge:
+                        self.hedge_stats.hedge_won += 1
+                    return winner.result()
+                if not tasks:
+                    # Both failed; propagate the exception
+                    return done.pop().result()
+        finally:
+            for t in tasks:
+                t.cancel()
+            # Don't leave the loser's request running (nor its task pending) after returning
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _discover_block(
+        self, dmap: DiscoveryMap, level: int, corner: MapCoord, leaf_level: int
+    ) -> List[Tuple[int, MapCoord]]:
+        async with self.limiter:
+            return await super()._discover_block(dmap, level, corner, leaf_level)
+
+    async def async_probe(self, coord: MapCoord) -> Tuple[MapCoord, Optional[TileFingerprint]]:
+        """Like async_probe_tile(), but won't actually start probing if the limiter is depleted."""
+        async with self.limiter:
+            return await self.async_probe_tile(coord)
 
     async def async_fetch(self, coord: MapCoord) -> Optional[RawTile]:
-        """Perform async fetch, but won't actually start fetching if semaphore is depleted."""
-        async with self.sema:
+        """Perform async fetch, but won't actually start fetching if the limiter is depleted."""
+        start = time.monotonic()
+        async with self.limiter:
+            if self.metrics is not None:
+                self.metrics.limiter_wait.observe(time.monotonic() - start)
             try:
                 return await self.async_get_tile_raw(coord, quiet=True, retries=self.retries)
             except asyncio.CancelledError:
-                print(f"{coord} cancelled")
+                if self.reporter is not None:
+                    self.reporter.count("cancelled")
+                else:
+                    print(f"{coord} cancelled")
                 return None
@@ -0,0 +1,250 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+from __future__ import annotations
+
+import asyncio
+import bisect
+import math
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Latency buckets (seconds) suitable for requests against the map CDN
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Buckets (seconds) for waiting on the in-flight limiter
+WAIT_BUCKETS = (0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+
+def _fmt_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    TYPE = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames: Tuple[str, ...] = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _labelstr(self, key: LabelValues, extra: Iterable[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """Returns a list of (suffixed name, label string, value)"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        lines.extend(f"{name}{labels} {_fmt_value(value)}" for name, labels, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A monotonically-increasing value"""
+
+    TYPE = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def items(self) -> Dict[LabelValues, float]:
+        """Values of every label set seen so far"""
+        return dict(self._values)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        return [(self.name, self._labelstr(k), v) for k, v in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, or be read from a function at collection time"""
+
+    TYPE = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._functions: Dict[LabelValues, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, func: Callable[[], float], **labels) -> None:
+        """Have the value be read from func whenever the metric is collected"""
+        self._functions[self._key(labels)] = func
+
+    def value(self, **labels) -> float:
+        key = self._key(labels)
+        if (func := self._functions.get(key)) is not None:
+            return func()
+        return self._values.get(key, 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        values = dict(self._values)
+        values.update((k, f()) for k, f in self._functions.items())
+        return [(self.name, self._labelstr(k), v) for k, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """Counts observations into cumulative buckets, along with their sum and count"""
+
+    TYPE = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        # Per label set: (per-bucket counts, with the last one being +Inf), sum
+        self._data: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        if (data := self._data.get(key)) is None:
+            data = self._data[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = data
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def count(self, **labels) -> int:
+        data = self._data.get(self._key(labels))
+        return sum(data[0]) if data else 0
+
+    def sum(self, **labels) -> float:
+        data = self._data.get(self._key(labels))
+        return data[1][0] if data else 0.0
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        result = []
+        for key, (counts, total) in sorted(self._data.items()):
+            cumulative = 0
+            for bound, cnt in zip(self.buckets + (math.inf,), counts):
+                cumulative += cnt
+                result.append((f"{self.name}_bucket", self._labelstr(key, [("le", _fmt_value(bound))]), cumulative))
+            result.append((f"{self.name}_sum", self._labelstr(key), total[0]))
+            result.append((f"{self.name}_count", self._labelstr(key), cumulative))
+        return result
+
+
+class MetricsRegistry:
+    """
+    A collection of metrics, which can be rendered in the Prometheus text exposition format, served over HTTP,
+    or dumped to a file.
+    """
+
+    def __init__(self, prefix: str = ""):
+        """
+        :param prefix: Prepended to the names of all metrics created through this registry
+        """
+        self.prefix = prefix
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        name = self.prefix + name
+        if (existing := self._metrics.get(name)) is not None:
+            if not isinstance(existing, cls):
+                raise ValueError(f"Metric {name} already registered as {existing.TYPE}")
+            return existing
+        metric = self._metrics[name] = cls(name, *args, **kwargs)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+    def dump(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(self.render(), encoding="utf-8")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            # We serve the same thing regardless of the request, so just consume the headers
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            body = self.render().encode("utf-8")
+            writer.write(
+                b"HTTP/1.0 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, port: int, host: str = "127.0.0.1") -> asyncio.AbstractServer:
+        """
+        Start serving the metrics over HTTP on the running event loop.
+
+        :param port: TCP port to listen on
+        :param host: Address to bind to (default: localhost only)
+        :return: The server; close() it when done
+        """
+        return await asyncio.start_server(self._handle, host, port)
+
+
+class FetchMetrics:
+    """The metrics of the fetch layer"""
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        """
+        :param registry: Registry to create the metrics in (default: a new one with a "slmap_" prefix)
+        """
+        self.registry = MetricsRegistry(prefix="slmap_") if registry is None else registry
+        reg = self.registry
+        self.request_latency = reg.histogram("request_latency_seconds", "Latency of requests to the map CDN")
+        self.responses = reg.counter("responses_total", "Responses from the map CDN, by status", ["status"])
+        self.errors = reg.counter("request_errors_total", "Requests that raised an exception, by type", ["error"])
+        self.retries = reg.counter("retries_total", "Retries performed according to the retry policy")
+        self.hedges = reg.counter("hedges_total", "Hedged (duplicate) requests sent")
+        self.corrupt = reg.counter("corrupt_payloads_total", "Responses whose JPEG payload was truncated or corrupt")
+        self.bytes = reg.counter("received_bytes_total", "Bytes of response bodies received")
+        self.in_flight = reg.gauge("requests_in_flight", "Requests currently awaiting a response")
+        self.limit = reg.gauge("in_flight_limit", "Current limit of concurrent fetches")
+        self.limiter_wait = reg.histogram(
+            "limiter_wait_seconds", "Time spent waiting for a slot from the in-flight limiter", buckets=WAIT_BUCKETS
+        )
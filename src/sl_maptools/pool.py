@@ -0,0 +1,104 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+from __future__ import annotations
+
+import math
+from typing import Dict, List, Sequence
+
+import httpx
+
+DEFA_POOL_CONNECTIONS = 20
+
+
+class ClientPool:
+    """
+    A set of independent HTTP clients, with every request going to the client having the fewest outstanding requests.
+
+    With HTTP/2, a client multiplexes all its requests over (usually) a single connection per host, so one stalled
+    connection holds up every stream on it (head-of-line blocking at the TCP level). Spreading requests over several
+    clients spreads them over several connections, limiting the damage of any one stall.
+
+    Quacks enough like httpx.AsyncClient (request(), get(), head(), aclose(), async context manager) to be used as
+    MapFetcher's session.
+    """
+
+    def __init__(self, clients: Sequence[httpx.AsyncClient]):
+        """
+        :param clients: The clients to spread requests over
+        """
+        if not clients:
+            raise ValueError("ClientPool needs at least one client")
+        self.clients: List[httpx.AsyncClient] = list(clients)
+        self.outstanding: List[int] = [0] * len(self.clients)
+        self.requests: List[int] = [0] * len(self.clients)
+        self._next: int = 0
+
+    @classmethod
+    def create(
+        cls,
+        size: int,
+        http2: bool = True,
+        max_connections: int = DEFA_POOL_CONNECTIONS,
+        timeout: float = 10.0,
+    ) -> ClientPool:
+        """
+        Create a pool of identically-configured clients.
+
+        :param size: Number of clients
+        :param http2: Whether to use HTTP/2 (if False, HTTP/1.1 with keep-alive is used)
+        :param max_connections: Total connections, divided among the clients
+        :param timeout: Timeout (seconds) of each request
+        :return: The new ClientPool
+        """
+        per_client = max(1, math.ceil(max_connections / size))
+        limits = httpx.Limits(max_connections=per_client, max_keepalive_connections=per_client)
+        return cls([httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2) for _ in range(size)])
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def _pick(self) -> int:
+        # Start scanning from a rotating position so ties are broken round-robin
+        n = len(self.clients)
+        start = self._next
+        self._next = (start + 1) % n
+        return min((((start + i) % n) for i in range(n)), key=lambda i: self.outstanding[i])
+
+    async def _call(self, name: str, *args, **kwargs) -> httpx.Response:
+        idx = self._pick()
+        self.outstanding[idx] += 1
+        self.requests[idx] += 1
+        try:
+            return await getattr(self.clients[idx], name)(*args, **kwargs)
+        finally:
+            self.outstanding[idx] -= 1
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        return await self._call("request", method, url, **kwargs)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self._call("get", url, **kwargs)
+
+    async def head(self, url: str, **kwargs) -> httpx.Response:
+        return await self._call("head", url, **kwargs)
+
+    async def aclose(self) -> None:
+        for client in self.clients:
+            await client.aclose()
+
+    async def __aenter__(self) -> ClientPool:
+        for client in self.clients:
+            await client.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        for client in self.clients:
+            await client.__aexit__(exc_type, exc_val, exc_tb)
+
+    def stats(self) -> Dict[int, int]:
+        """Number of requests sent through each client"""
+        return dict(enumerate(self.requests))
+
+    def __str__(self):
+        return f"{len(self.clients)} clients, requests per client: {', '.join(f'{r:,}' for r in self.requests)}"
@@ -0,0 +1,161 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+from __future__ import annotations
+
+import json
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, TextIO
+
+# The single-character progress indicators that used to be printed per tile, and the counters they became
+PROGRESS_CHARS: Dict[str, str] = {
+    "requested": ".",
+    "fetched": "+",
+    "void": "-",
+    "revalidated": "=",
+    "timeout": ">",
+    "bad_status": "?",
+    "corrupt": "#",
+    "failed": "ERR",
+}
+
+# Events that used to be printed even when quiet
+LOUD_EVENTS = frozenset({"timeout", "bad_status", "corrupt", "failed"})
+
+
+class ProgressReporter:
+    """
+    Aggregates progress counters in memory, and renders them at a fixed rate from a background thread.
+
+    On a TTY, a single status line is refreshed in place; otherwise (e.g., when redirected to a log file), one JSON
+    object per interval is emitted, and only if something changed.
+
+    Counting is just a dict update, so it's cheap enough to be done per tile. Values living elsewhere (e.g., in
+    another process, through a multiprocessing.Value) can be pulled at render time by registering a source.
+    Occasional events (a row completing, an exception) are reported through message(), which prints them on their
+    own line without disturbing the status line.
+    """
+
+    def __init__(self, stream: TextIO = None, interval: float = 1.0, json_lines: bool = None):
+        """
+        :param stream: Where to render (default: sys.stdout)
+        :param interval: Seconds between renders
+        :param json_lines: Emit JSON lines instead of a status line; default is to do so if stream is not a TTY
+        """
+        self.stream: TextIO = sys.stdout if stream is None else stream
+        self.interval = interval
+        if json_lines is None:
+            isatty = getattr(self.stream, "isatty", None)
+            json_lines = not (isatty and isatty())
+        self.json_lines = json_lines
+        self.counters: Dict[str, int] = {}
+        self.values: Dict[str, Any] = {}
+        self._sources: Dict[str, Callable[[], Any]] = {}
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_width: int = 0
+        self._last_snapshot: Optional[Dict[str, Any]] = None
+
+    def count(self, key: str, n: int = 1) -> None:
+        """Increase a counter"""
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def set(self, key: str, value: Any) -> None:
+        """Set a value to be shown as-is"""
+        self.values[key] = value
+
+    def add_source(self, key: str, func: Callable[[], Any]) -> None:
+        """Have a value be pulled from func at render time"""
+        self._sources[key] = func
+
+    def snapshot(self) -> Dict[str, Any]:
+        snap: Dict[str, Any] = dict(self.counters)
+        snap.update(self.values)
+        for key, func in list(self._sources.items()):
+            try:
+                snap[key] = func()
+            except Exception:
+                # A source might become unavailable (e.g., its process has ended); just don't show it
+                pass
+        return snap
+
+    @staticmethod
+    def _fmt(value: Any) -> str:
+        if isinstance(value, int):
+            return f"{value:,}"
+        if isinstance(value, float):
+            return f"{value:,.2f}"
+        return str(value)
+
+    def render_line(self) -> str:
+        elapsed = time.monotonic() - self._start
+        parts = [f"[{elapsed:,.0f}s]"]
+        parts.extend(f"{key} {self._fmt(value)}" for key, value in self.snapshot().items())
+        if elapsed > 0 and (requested := self.counters.get("requested")):
+            parts.append(f"{requested / elapsed:,.1f} tiles/s")
+        return " | ".join(parts)
+
+    def _write(self, text: str) -> None:
+        self.stream.write(text)
+        self.stream.flush()
+
+    def _clear_line(self) -> str:
+        return "\r" + " " * self._last_width + "\r" if self._last_width else ""
+
+    def flush(self) -> None:
+        """Render now"""
+        with self._lock:
+            if self.json_lines:
+                snap = self.snapshot()
+                if snap == self._last_snapshot:
+                    return
+                self._last_snapshot = snap
+                record = {"t": round(time.monotonic() - self._start, 3), **snap}
+                self._write(json.dumps(record, default=str) + "\n")
+                return
+            line = self.render_line()
+            pad = max(0, self._last_width - len(line))
+            self._last_width = len(line)
+            self._write("\r" + line + " " * pad)
+
+    def message(self, text: str) -> None:
+        """Report an occasional event on its own line"""
+        with self._lock:
+            if self.json_lines:
+                self._write(json.dumps({"t": round(time.monotonic() - self._start, 3), "message": text}) + "\n")
+                return
+            self._write(self._clear_line() + text + "\n")
+            self._last_width = 0
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self) -> ProgressReporter:
+        """Start rendering in the background; does nothing if already started"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ProgressReporter", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop rendering in the background, after one final render"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if not self.json_lines and self._last_width:
+            self._write("\n")
+            self._last_width = 0
+
+    def __enter__(self) -> ProgressReporter:
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
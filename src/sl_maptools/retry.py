@@ -0,0 +1,208 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+from __future__ import annotations
+
+import asyncio
+import email.utils
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Deque, FrozenSet, Literal, Optional
+
+JitterStrategy = Literal["none", "full", "equal", "decorrelated"]
+
+
+class RetryBudget:
+    """A limit on the total number of retries, shared by every fetch using the same RetryPolicy."""
+
+    def __init__(self, max_retries: int):
+        """
+        :param max_retries: Total number of retries allowed (for the lifetime of this object, usually one run)
+        """
+        self.max_retries = max_retries
+        self.spent: int = 0
+
+    @property
+    def exhausted(self) -> bool:
+        return self.spent >= self.max_retries
+
+    def try_spend(self) -> bool:
+        if self.exhausted:
+            return False
+        self.spent += 1
+        return True
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Decides whether and when a failed request is retried.
+
+    Delays grow exponentially from base_delay, capped at max_delay, with jitter applied according to the chosen
+    strategy (see https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/):
+    - "none": exactly the exponential delay
+    - "full": uniformly random between 0 and the exponential delay
+    - "equal": half the exponential delay, plus a random amount up to the other half
+    - "decorrelated": random between base_delay and thrice the previous delay
+
+    If the server sent a Retry-After header along with a status in retry_after_statuses, the delay will be at least
+    what the server asked for.
+    """
+
+    max_attempts: int = 6
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    jitter: JitterStrategy = "full"
+    budget: Optional[RetryBudget] = None
+    retry_after_statuses: FrozenSet[int] = frozenset({429, 503})
+    retries: int = field(default=0, init=False)
+
+    def should_retry(self, attempt: int, max_attempts: int = None) -> bool:
+        """
+        Determine whether another attempt may be made, spending from the budget if so.
+
+        :param attempt: Number of attempts made so far
+        :param max_attempts: Override of self.max_attempts for this one request
+        :return: True if a retry may be made
+        """
+        if attempt >= (self.max_attempts if max_attempts is None else max_attempts):
+            return False
+        if self.budget is not None and not self.budget.try_spend():
+            return False
+        self.retries += 1
+        return True
+
+    def delay(self, attempt: int, prev_delay: float = 0.0, retry_after: float = None) -> float:
+        """
+        Calculate how long to wait before the next attempt.
+
+        :param attempt: Number of attempts made so far (1 after the first failure)
+        :param prev_delay: The previous delay returned for the same request (used by "decorrelated")
+        :param retry_after: Seconds requested by the server through Retry-After, if any
+        :return: Delay in seconds
+        """
+        expo = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        match self.jitter:
+            case "none":
+                dly = expo
+            case "full":
+                dly = random.uniform(0, expo)
+            case "equal":
+                dly = expo / 2 + random.uniform(0, expo / 2)
+            case "decorrelated":
+                dly = min(self.max_delay, random.uniform(self.base_delay, max(self.base_delay, prev_delay * 3)))
+            case _:
+                raise ValueError(f"Unknown jitter strategy: {self.jitter}")
+        if retry_after is not None:
+            dly = max(dly, retry_after)
+        return dly
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """
+        Parse the value of a Retry-After header, which is either a number of seconds or an HTTP-date.
+
+        :param value: The header's value
+        :return: Seconds to wait, or None if the value is absent or unparseable
+        """
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return max(0.0, (when - datetime.now(tz=timezone.utc)).total_seconds())
+
+
+class CircuitBreaker:
+    """
+    Pauses all fetches when the error rate spikes.
+
+    Outcomes of requests are recorded in a sliding window. When the window holds at least min_samples outcomes and
+    the proportion of errors exceeds error_threshold, the breaker 'opens' for cooldown seconds; during that time,
+    everyone awaiting wait() is held back. If the breaker trips again shortly after closing, the cooldown is doubled
+    (up to max_cooldown); otherwise it is reset.
+
+    A pause can also be requested explicitly, e.g., to honour a Retry-After for everyone at once.
+    """
+
+    def __init__(
+        self,
+        window: int = 200,
+        error_threshold: float = 0.5,
+        min_samples: int = 50,
+        cooldown: float = 10.0,
+        max_cooldown: float = 120.0,
+        message: Callable[[str], None] = None,
+    ):
+        """
+        :param window: How many of the most recent outcomes to consider
+        :param error_threshold: Proportion of errors in the window that trips the breaker
+        :param min_samples: Don't trip unless the window holds at least this many outcomes
+        :param cooldown: Initial duration (seconds) of the pause when tripped
+        :param max_cooldown: Maximum duration (seconds) of the pause
+        :param message: Function to report trips with, e.g., ProgressReporter.message; None to not report them
+        """
+        self.error_threshold = error_threshold
+        self.min_samples = min_samples
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.message = message
+        self.trips: int = 0
+        self.paused_seconds: float = 0.0
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._errors: int = 0
+        self._open_until: float = 0.0
+        self._closed_at: float = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return time.monotonic() < self._open_until
+
+    def pause(self, seconds: float) -> None:
+        """Hold back all fetches for (at least) seconds from now"""
+        until = time.monotonic() + seconds
+        if until > self._open_until:
+            self.paused_seconds += until - max(self._open_until, time.monotonic())
+            self._open_until = until
+
+    def record(self, ok: bool) -> None:
+        """Record the outcome of a request"""
+        if len(self._outcomes) == self._outcomes.maxlen and not self._outcomes[0]:
+            self._errors -= 1
+        self._outcomes.append(ok)
+        if not ok:
+            self._errors += 1
+        if self.is_open or len(self._outcomes) < self.min_samples:
+            return
+        if self._errors / len(self._outcomes) <= self.error_threshold:
+            return
+        nao = time.monotonic()
+        if nao - self._closed_at < self.cooldown * 2:
+            self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+        else:
+            self.cooldown = self.base_cooldown
+        self.trips += 1
+        self.pause(self.cooldown)
+        self._closed_at = self._open_until
+        self._outcomes.clear()
+        self._errors = 0
+        if self.message is not None:
+            self.message(f"!!! Circuit breaker tripped, pausing fetches for {self.cooldown:,.0f}s")
+
+    async def wait(self) -> None:
+        """Wait until the breaker is closed"""
+        while (remaining := self._open_until - time.monotonic()) > 0:
+            await asyncio.sleep(remaining)
+
+    def __str__(self):
+        return f"{self.trips} trips, {self.paused_seconds:,.1f}s paused"
@@ -0,0 +1,71 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class _Call:
+    task: asyncio.Future
+    waiters: int = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one.
+
+    While a call for a key is in flight, further calls for the same key don't start their own; they wait for (and
+    share) the result -- or the exception -- of the one in flight. Once it completes, the key is forgotten, so later
+    calls will start afresh; this is not a cache.
+
+    A caller being cancelled does not cancel the shared call, unless it was the last one waiting for it.
+
+    May be shared by several objects, as long as they use distinct keys (e.g., by prefixing a namespace), and as
+    long as they run on the same event loop.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self.calls: int = 0
+        self.saved: int = 0
+
+    def __len__(self) -> int:
+        """Number of calls currently in flight"""
+        return len(self._calls)
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Call func, unless a call for the same key is already in flight, in which case just await that call.
+
+        :param key: Identifies calls that are interchangeable
+        :param func: Function returning the awaitable to await if no call for key is in flight
+        :return: The result of the (possibly shared) call
+        """
+        self.calls += 1
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(func()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.saved += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def __str__(self):
+        return f"{self.saved:,} duplicate requests saved out of {self.calls:,}"
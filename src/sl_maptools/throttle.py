@@ -0,0 +1,311 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+import urllib.parse
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+
+class LatencyTracker:
+    """Keeps the most recent latency samples and calculates percentiles over them."""
+
+    def __init__(self, maxlen: int = 1000):
+        """
+        :param maxlen: How many of the most recent samples to keep
+        """
+        self._samples: Deque[float] = deque(maxlen=maxlen)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, latency: float) -> None:
+        self._samples.append(latency)
+
+    def clear(self) -> None:
+        self._samples.clear()
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """
+        Calculate a percentile (nearest-rank) of the recorded samples.
+
+        :param pct: The percentile, 0 < pct <= 100
+        :return: Latency at that percentile, or None if there are no samples
+        """
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        rank = max(0, min(len(ordered) - 1, round(pct / 100.0 * len(ordered)) - 1))
+        return ordered[rank]
+
+
+class AdaptiveLimiter:
+    """
+    Limits the number of in-flight requests, adjusting the limit at run time using AIMD
+    (Additive Increase, Multiplicative Decrease).
+
+    Every completed request is reported using record(). Decisions are made per 'window' of samples:
+
+    - An error (timeout, unexpected HTTP status) immediately cuts the limit multiplicatively, but at most once per
+      window, so a burst of errors caused by the same congestion episode is only punished once.
+    - If a window's p90 latency exceeds latency_tolerance times the baseline latency (the lowest p50 ever observed),
+      the limit is cut multiplicatively as well.
+    - Otherwise, if the limit was actually reached during the window, it is raised additively.
+
+    Use as an async context manager:
+
+        async with limiter:
+            ...
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: int = None,
+        increase: int = 1,
+        decrease: float = 0.5,
+        window: int = 100,
+        latency_tolerance: float = 3.0,
+    ):
+        """
+        :param initial: Initial in-flight limit
+        :param min_limit: Limit will never go below this
+        :param max_limit: Limit will never go above this (default: same as initial)
+        :param increase: How much to raise the limit after a healthy window
+        :param decrease: Multiplier to apply to the limit upon congestion
+        :param window: How many completed requests make up a decision window
+        :param latency_tolerance: Ratio of window p90 latency to baseline p50 latency deemed to be congestion
+        """
+        self.min_limit = min_limit
+        self.max_limit = initial if max_limit is None else max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.latency_tolerance = latency_tolerance
+        self._limit: int = max(min_limit, min(initial, self.max_limit))
+        self._in_flight: int = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._window_lats = LatencyTracker(maxlen=window)
+        self._window_peak: int = 0
+        self._since_decrease: int = window
+        self._baseline: Optional[float] = None
+        self._start = time.monotonic()
+        self.history: List[Tuple[float, int, str]] = [(0.0, self._limit, "initial")]
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for w in self._waiters if not w.done())
+
+    async def acquire(self) -> None:
+        if self._in_flight < self._limit and not self._waiters:
+            self._grant()
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # A slot was granted, but we got cancelled before we could use it
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self._in_flight -= 1
+        self._wake()
+
+    async def __aenter__(self) -> AdaptiveLimiter:
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def _grant(self) -> None:
+        self._in_flight += 1
+        self._window_peak = max(self._window_peak, self._in_flight)
+
+    def _wake(self) -> None:
+        while self._waiters and self._in_flight < self._limit:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self._grant()
+                fut.set_result(None)
+
+    def _set_limit(self, new_limit: int, reason: str) -> None:
+        new_limit = max(self.min_limit, min(new_limit, self.max_limit))
+        if new_limit == self._limit:
+            return
+        self._limit = new_limit
+        self.history.append((time.monotonic() - self._start, new_limit, reason))
+        self._wake()
+
+    def _cut(self, reason: str) -> None:
+        if self._since_decrease < self.window:
+            return
+        self._since_decrease = 0
+        self._set_limit(int(self._limit * self.decrease), reason)
+
+    def record(self, latency: Optional[float], ok: bool) -> None:
+        """
+        Report the outcome of a completed request.
+
+        :param latency: How long the request took (seconds); None if unknown
+        :param ok: False if the request timed out or returned an unexpected status
+        """
+        self._since_decrease += 1
+        if not ok:
+            self._cut("error")
+            return
+        if latency is not None:
+            self._window_lats.add(latency)
+        if len(self._window_lats) < self.window:
+            return
+
+        p50 = self._window_lats.percentile(50)
+        p90 = self._window_lats.percentile(90)
+        saturated = self._window_peak >= self._limit
+        self._window_lats.clear()
+        self._window_peak = self._in_flight
+        if self._baseline is None or p50 < self._baseline:
+            self._baseline = p50
+
+        if p90 > self._baseline * self.latency_tolerance:
+            self._cut(f"p90 {p90:.2f}s")
+        elif saturated:
+            self._set_limit(self._limit + self.increase, "increase")
+
+    def history_summary(self, max_points: int = 10) -> str:
+        """Return a compact, human-readable rendition of the most recent limit changes."""
+        points = self.history[-max_points:]
+        return ", ".join(f"{lim}@{t:,.0f}s" for t, lim, _ in points)
+
+
+class TokenBucket:
+    """
+    A token bucket that is allowed to go into debt.
+
+    Rather than blocking, reserve() always takes the tokens and returns how long the caller must wait before
+    the bucket would have had enough tokens. This allows charging for costs only known after the fact
+    (e.g., bytes of a response body), which will then be paid off by later reservations.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        :param rate: Tokens added per second
+        :param capacity: Maximum tokens the bucket can hold, i.e., the burst size (default: same as rate)
+        """
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self._tokens: float = self.capacity
+        self._last = time.monotonic()
+
+    def _refill(self) -> None:
+        nao = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (nao - self._last) * self.rate)
+        self._last = nao
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take amount tokens from the bucket.
+
+        :param amount: How many tokens to take
+        :return: Seconds the caller must wait before proceeding
+        """
+        self._refill()
+        self._tokens -= amount
+        return max(0.0, -self._tokens / self.rate)
+
+    def debt_delay(self) -> float:
+        """Seconds until the bucket is out of debt"""
+        self._refill()
+        return max(0.0, -self._tokens / self.rate)
+
+
+class RateLimiter:
+    """
+    Limits requests/second and bytes/second, per host.
+
+    A single instance is meant to be shared by every HTTP client talking to the same host(s), so that the combined
+    load stays within budget. Works both for asyncio-based clients (acquire()) and synchronous clients
+    (acquire_sync()).
+
+    Response sizes are only known after the fact, so they are charged using consume_bytes(); the debt thus incurred
+    delays the next acquisition for the same host.
+    """
+
+    def __init__(
+        self,
+        requests_per_sec: float = None,
+        bytes_per_sec: float = None,
+        burst: float = 1.0,
+        host_limits: Dict[str, Tuple[Optional[float], Optional[float]]] = None,
+    ):
+        """
+        :param requests_per_sec: Default requests/second budget per host; None means unlimited
+        :param bytes_per_sec: Default bytes/second budget per host; None means unlimited
+        :param burst: Bucket capacity, in seconds' worth of budget
+        :param host_limits: Per-host overrides, a mapping of hostname to (requests_per_sec, bytes_per_sec)
+        """
+        self.requests_per_sec = requests_per_sec
+        self.bytes_per_sec = bytes_per_sec
+        self.burst = burst
+        self.host_limits = host_limits or {}
+        self.waited: float = 0.0
+        self._buckets: Dict[str, Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _host(url_or_host: str) -> str:
+        if "://" not in url_or_host:
+            return url_or_host
+        return urllib.parse.urlsplit(url_or_host).hostname or ""
+
+    def _buckets_for(self, host: str) -> Tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        if (buckets := self._buckets.get(host)) is None:
+            rps, bps = self.host_limits.get(host, (self.requests_per_sec, self.bytes_per_sec))
+            buckets = (
+                TokenBucket(rps, max(1.0, rps * self.burst)) if rps else None,
+                TokenBucket(bps, bps * self.burst) if bps else None,
+            )
+            self._buckets[host] = buckets
+        return buckets
+
+    def _reserve(self, url_or_host: str) -> float:
+        with self._lock:
+            req_bucket, byte_bucket = self._buckets_for(self._host(url_or_host))
+            delay = req_bucket.reserve(1) if req_bucket else 0.0
+            if byte_bucket:
+                delay = max(delay, byte_bucket.debt_delay())
+            self.waited += delay
+            return delay
+
+    async def acquire(self, url_or_host: str) -> None:
+        """Wait until a request to the host of url_or_host is within budget."""
+        if delay := self._reserve(url_or_host):
+            await asyncio.sleep(delay)
+
+    def acquire_sync(self, url_or_host: str) -> None:
+        """Like acquire() but for synchronous clients."""
+        if delay := self._reserve(url_or_host):
+            time.sleep(delay)
+
+    def consume_bytes(self, url_or_host: str, nbytes: int) -> None:
+        """Charge the bytes of a response against the host's bytes/second budget."""
+        with self._lock:
+            _, byte_bucket = self._buckets_for(self._host(url_or_host))
+            if byte_bucket:
+                byte_bucket.reserve(nbytes)
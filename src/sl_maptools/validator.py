@@ -20,6 +20,8 @@ import httpx
 import msgpack
 
 from sl_maptools import MapTile, MapCoord
+from sl_maptools.singleflight import SingleFlight
+from sl_maptools.throttle import RateLimiter
 
 """
 status online x 1000 y 1000 access moderate estate Mainland firstseen 2008-03-09 lastseen 2022-11-06 \
@@ -80,9 +82,18 @@ GridSurvey_NotRegion = GridSurveyError()
 class MapValidatorGridSurvey(object):
     GRIDSURVEY_API = "http://api.gridsurvey.com/simquery.php?xy={x},{y}"
 
-    def __init__(self, a_session: httpx.AsyncClient, cache_file: Path = None):
+    def __init__(
+        self,
+        a_session: httpx.AsyncClient,
+        cache_file: Path = None,
+        rate_limiter: RateLimiter = None,
+        flights: SingleFlight = None,
+    ):
         self.session = a_session
         self.cache_file = cache_file
+        self.rate_limiter = rate_limiter
+        # Concurrent queries for the same coordinate share one request
+        self.flights = SingleFlight() if flights is None else flights
         if cache_file is None or not cache_file.exists():
             self.cache: Dict[MapCoord, GridSurveyDatum] = {}
             return
@@ -98,7 +109,12 @@ class MapValidatorGridSurvey(object):
     ) -> Tuple[MapCoord, Union[GridSurveyDatum, GridSurveyError]]:
         if use_cache and (datum := self.cache.get(coord)):
             return coord, datum
+        return await self.flights.do(("gridsurvey", coord), lambda: self._query_gs(coord))
+
+    async def _query_gs(self, coord: MapCoord) -> Tuple[MapCoord, Union[GridSurveyDatum, GridSurveyError]]:
         url = self.GRIDSURVEY_API.format(x=coord.x, y=coord.y)
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(url)
         response = await self.session.get(url)
         status_code = response.status_code
 
@@ -141,15 +157,30 @@ class MapValidator(object):
     UUID = "b713fe80-283b-4585-af4d-a3b7d9a32492"
     URL = "https://cap.secondlife.com/cap/0/{uuid}?var=slRegionName&grid_x={x}&grid_y={y}"
 
-    def __init__(self, a_session: httpx.AsyncClient, retries: int = 5):
+    def __init__(
+        self,
+        a_session: httpx.AsyncClient,
+        retries: int = 5,
+        rate_limiter: RateLimiter = None,
+        flights: SingleFlight = None,
+    ):
         self.a_session = a_session
         self.retries = retries
+        self.rate_limiter = rate_limiter
+        # Concurrent queries for the same coordinate share one request
+        self.flights = SingleFlight() if flights is None else flights
 
     async def is_region(self, coord: MapCoord) -> Tuple[MapCoord, bool]:
+        return await self.flights.do(("cap", coord), lambda: self._query_cap(coord))
+
+    async def _query_cap(self, coord: MapCoord) -> Tuple[MapCoord, bool]:
         delay = 0.5
         url = self.URL.format(uuid=self.UUID, x=coord.x, y=coord.y)
         for _ in range(self.retries):
-            await asyncio.sleep(random.random() * 2.0)
+            if self.rate_limiter is None:
+                await asyncio.sleep(random.random() * 2.0)
+            else:
+                await self.rate_limiter.acquire(url)
             # noinspection PyBroadException
             try:
                 resp = await self.a_session.get(url)
@@ -0,0 +1,45 @@
+import pickle
+
+import pytest
+
+from mosaic_v3.color_processing import DominantColors
+from mosaic_v3.colorstore import KEYS, ColorStore
+from sl_maptools import MapCoord
+
+
+def _domc(seed: int) -> DominantColors:
+    domc = DominantColors()
+    for i, key in enumerate(KEYS):
+        domc[key] = (seed, i, 255 - i)
+    return domc
+
+
+def test_roundtrip():
+    regions = {MapCoord(0, 0): _domc(1), MapCoord(9, 4): _domc(2), MapCoord(3, 7): _domc(3)}
+    with ColorStore.from_regions(regions, 10, 8) as store:
+        assert len(store) == 3
+        assert MapCoord(9, 4) in store
+        assert MapCoord(4, 9) not in store
+        assert MapCoord(10, 0) not in store
+        assert store[MapCoord(3, 7)].encode() == regions[MapCoord(3, 7)].encode()
+        assert set(store.keys()) == set(regions)
+
+        del store[MapCoord(0, 0)]
+        assert store.pop(MapCoord(0, 0)) is None
+        assert MapCoord(0, 0) not in store
+        with pytest.raises(KeyError):
+            _ = store[MapCoord(0, 0)]
+        with pytest.raises(IndexError):
+            store[MapCoord(0, 8)] = _domc(4)
+        assert {co: d.encode() for co, d in store.to_dict().items()} == {
+            co: d.encode() for co, d in regions.items() if co != MapCoord(0, 0)
+        }
+
+
+def test_attach():
+    with ColorStore.create(10, 8) as store:
+        other = pickle.loads(pickle.dumps(store))
+        assert not other.owner
+        other[MapCoord(5, 5)] = _domc(7)
+        assert store[MapCoord(5, 5)].encode() == _domc(7).encode()
+        other.close()
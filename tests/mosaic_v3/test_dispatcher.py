@@ -0,0 +1,290 @@
+import asyncio
+import io
+
+from mosaic_v3.bench import SimulatedCDN, _SimulatedResponse
+from mosaic_v3.dispatcher import async_discover_area, async_fetch_area
+from mosaic_v3.progress import TileBitmap
+from sl_maptools import MapBounds, MapCoord
+from sl_maptools.cache import FingerprintStore, TileFingerprint
+from sl_maptools.fetcher import MapFetcher
+from sl_maptools.reporter import ProgressReporter
+from sl_maptools.retry import RetryPolicy
+from sl_maptools.throttle import AdaptiveLimiter
+
+
+def _fetch(cdn: SimulatedCDN, got: list, **kwargs):
+    return async_fetch_area(
+        cdn, 0, 9, 0, 4, callback=got.append, redo_rows=[], reporter=ProgressReporter(io.StringIO()), **kwargs
+    )
+
+
+def test_all_rows_fetched():
+    got = []
+    progress, errs = asyncio.run(_fetch(SimulatedCDN(0.001, seed=1), got, workers=7, save_every=20))
+    assert not errs
+    assert progress.fetched_rows == {0, 1, 2, 3, 4}
+    assert not progress.pending_rows
+    tiles = [g for g in got if isinstance(g, tuple)]
+    assert sorted(co for co, _ in tiles) == sorted({co for co, _ in tiles})
+    assert len(tiles) == 50
+    assert sorted(g for g in got if isinstance(g, str) and g.startswith("ROW:")) == [f"ROW:{y}" for y in range(5)]
+    assert got.count("SAVE") == 2
+
+
+def test_partial_rows():
+    got = []
+    done = TileBitmap()
+    for x in range(0, 10, 2):
+        done.add(x)
+    full = TileBitmap()
+    for x in range(10):
+        full.add(x)
+    progress, errs = asyncio.run(_fetch(SimulatedCDN(0.001, seed=1), got, partial={2: done, 3: full}))
+    assert progress.fetched_rows == {0, 1, 2, 3, 4}
+    tiles = [co for co, _ in (g for g in got if isinstance(g, tuple))]
+    assert sorted(co.x for co in tiles if co.y == 2) == [1, 3, 5, 7, 9]
+    assert not [co for co in tiles if co.y == 3]
+    assert len(tiles) == 35
+
+
+class _FlakyCDN(SimulatedCDN):
+    """Fails the first `failures` requests for one tile"""
+
+    def __init__(self, coord: MapCoord, failures: int):
+        super().__init__(0.001, seed=1)
+        self.url = MapFetcher.URL_TEMPLATE.format(zoom=1, map_x=coord.x, map_y=coord.y)
+        self.failures = failures
+
+    async def get(self, url, headers=None):
+        if url == self.url and self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError("Flaky")
+        return await super().get(url, headers)
+
+
+def test_failed_tile_requeued():
+    got = []
+    cdn = _FlakyCDN(MapCoord(3, 2), failures=2)
+    policy = RetryPolicy(max_attempts=1)
+    progress, errs = asyncio.run(_fetch(cdn, got, retry_policy=policy, tile_retries=3, tile_retry_delay=0.01))
+    assert not errs
+    assert progress.fetched_rows == {0, 1, 2, 3, 4}
+    assert MapCoord(3, 2) in [g[0] for g in got if isinstance(g, tuple)]
+
+
+def test_failed_tile_given_up():
+    got = []
+    cdn = _FlakyCDN(MapCoord(3, 2), failures=100)
+    policy = RetryPolicy(max_attempts=1)
+    progress, errs = asyncio.run(_fetch(cdn, got, retry_policy=policy, tile_retries=2, tile_retry_delay=0.01))
+    assert len(errs) == 1
+    assert cdn.failures == 97
+    assert progress.fetched_rows == {0, 1, 3, 4}
+    assert progress.pending_rows == {2}
+
+
+def test_cancel():
+    got = []
+
+    async def runner():
+        task = asyncio.create_task(_fetch(SimulatedCDN(0.5, seed=1), got, workers=4))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        return await task
+
+    progress, errs = asyncio.run(runner())
+    assert progress.pending_rows
+
+
+def test_backpressure():
+    got = []
+    backlog = []
+
+    def callback(signal):
+        got.append(signal)
+        if isinstance(signal, tuple):
+            backlog.append(signal)
+
+    def backpressure():
+        # The "consumer" works off one tile every time it's asked, and is full at 3 tiles
+        if backlog:
+            backlog.pop()
+        return len(backlog) >= 3
+
+    progress, errs = asyncio.run(
+        async_fetch_area(
+            SimulatedCDN(0.001, seed=1),
+            0,
+            9,
+            0,
+            4,
+            callback=callback,
+            redo_rows=[],
+            reporter=ProgressReporter(io.StringIO()),
+            workers=7,
+            backpressure=backpressure,
+        )
+    )
+    assert not errs
+    assert progress.fetched_rows == {0, 1, 2, 3, 4}
+    assert len([g for g in got if isinstance(g, tuple)]) == 50
+
+
+class _VoidWorldCDN(SimulatedCDN):
+    """Low-zoom tiles are all voids; every map-1 tile has content"""
+
+    def __init__(self):
+        super().__init__(0.001, void_ratio=0.0, seed=1)
+
+    async def get(self, url, headers=None):
+        if "/map-1-" not in url:
+            return _SimulatedResponse(403, b"")
+        return await super().get(url, headers)
+
+
+def test_discover_known_regions():
+    got = []
+    cdn = _VoidWorldCDN()
+    known = {MapCoord(3, 2), MapCoord(7, 4), MapCoord(50, 50)}
+    progress, errs = asyncio.run(_fetch(cdn, got, discover=True, known_regions=known))
+    assert not errs
+    assert progress.fetched_rows == {0, 1, 2, 3, 4}
+    # Discovery deems everything void, but known regions are fetched nonetheless
+    fetched = {u for u in cdn.answered if "/map-1-" in u}
+    assert fetched == {MapFetcher.URL_TEMPLATE.format(zoom=1, map_x=co.x, map_y=co.y) for co in known if co.y < 5}
+    tiles = {co: raw for co, raw in (g for g in got if isinstance(g, tuple))}
+    assert len(tiles) == 50
+    assert {co for co, raw in tiles.items() if raw is not None} == {MapCoord(3, 2), MapCoord(7, 4)}
+
+
+def test_discover_once_for_several_fetches():
+    got = []
+    cdn = _VoidWorldCDN()
+    known = {MapCoord(3, 2), MapCoord(7, 4)}
+    reporter = ProgressReporter(io.StringIO())
+
+    def low_zoom():
+        return {u: t for u, t in cdn.answered.items() if "/map-1-" not in u}
+
+    async def runner():
+        limiter = AdaptiveLimiter(10, min_limit=10, max_limit=10)
+        dmap = await async_discover_area(cdn, MapBounds(0, 0, 9, 4), reporter, limiter=limiter)
+        discovered = low_zoom()
+        results = []
+        for lo, hi in ((3, 4), (0, 2)):
+            results.append(
+                await async_fetch_area(
+                    cdn,
+                    0,
+                    9,
+                    lo,
+                    hi,
+                    callback=got.append,
+                    redo_rows=[],
+                    reporter=reporter,
+                    discover=True,
+                    known_regions=known,
+                    limiter=limiter,
+                    discovery=dmap,
+                )
+            )
+        return discovered, results
+
+    discovered, results = asyncio.run(runner())
+    assert all(not errs for _, errs in results)
+    # The fetches did no discovery pass of their own
+    assert low_zoom() == discovered
+    fetched = {u for u in cdn.answered if "/map-1-" in u}
+    assert fetched == {MapFetcher.URL_TEMPLATE.format(zoom=1, map_x=co.x, map_y=co.y) for co in known}
+    assert len([g for g in got if isinstance(g, tuple)]) == 50
+
+
+class _VersionedCDN(SimulatedCDN):
+    """Regions on even columns, each with an ETag of its version; answers HEAD requests, too"""
+
+    def __init__(self):
+        super().__init__(0.001, seed=1)
+        self.versions = {MapCoord(x, y): 1 for y in range(5) for x in range(0, 10, 2)}
+        self.changing = set()
+        self.gets = []
+
+    @staticmethod
+    def coord(url: str) -> MapCoord:
+        _, x, y, _ = url.rsplit("-", 3)
+        return MapCoord(int(x), int(y))
+
+    def respond(self, coord: MapCoord) -> _SimulatedResponse:
+        if coord not in self.versions:
+            return _SimulatedResponse(403, b"")
+        response = _SimulatedResponse(200, self.PAYLOAD)
+        response.headers["ETag"] = f'"v{self.versions[coord]}"'
+        return response
+
+    def fingerprint(self, coord: MapCoord) -> TileFingerprint:
+        return TileFingerprint.from_headers(self.respond(coord).headers)
+
+    async def head(self, url, headers=None):
+        response = self.respond(coord := self.coord(url))
+        if coord in self.changing:
+            # Changes again between the HEAD and the GET
+            self.versions[coord] += 1
+        return response
+
+    async def get(self, url, headers=None):
+        self.gets.append(url)
+        return self.respond(self.coord(url))
+
+
+def test_fingerprints_skip_unchanged():
+    got = []
+    cdn = _VersionedCDN()
+    store = FingerprintStore(None)
+    for co in (MapCoord(x, y) for y in range(5) for x in range(10)):
+        store.record(co, cdn.fingerprint(co) if co in cdn.versions else None)
+    cdn.versions[MapCoord(4, 2)] += 1
+    cdn.changing.add(MapCoord(4, 2))
+    del store._prints[MapCoord(6, 3)]
+
+    progress, errs = asyncio.run(_fetch(cdn, got, fingerprints=store))
+    assert not errs
+    assert progress.fetched_rows == {0, 1, 2, 3, 4}
+    assert sorted(g for g in got if isinstance(g, str) and g.startswith("ROW:")) == [f"ROW:{y}" for y in range(5)]
+    assert sorted(g[0] for g in got if isinstance(g, tuple)) == [MapCoord(4, 2), MapCoord(6, 3)]
+    assert len(cdn.gets) == 2
+    # Recorded from the GET, which saw a newer version than the probe did
+    assert store.get(MapCoord(4, 2)) == cdn.fingerprint(MapCoord(4, 2))
+    assert store.get(MapCoord(4, 2)).etag == '"v3"'
+    assert store.get(MapCoord(6, 3)) == cdn.fingerprint(MapCoord(6, 3))
+
+
+def test_abandon_rows():
+    got = []
+    abandon = {2}
+
+    def callback(signal):
+        got.append(signal)
+        if isinstance(signal, tuple) and signal[0].y == 3:
+            # E.g., the lease of row 3 just got lost
+            abandon.add(3)
+
+    progress, errs = asyncio.run(
+        async_fetch_area(
+            SimulatedCDN(0.001, seed=1),
+            0,
+            9,
+            0,
+            4,
+            callback=callback,
+            redo_rows=[],
+            reporter=ProgressReporter(io.StringIO()),
+            workers=2,
+            abandon_rows=abandon,
+        )
+    )
+    assert not errs
+    assert progress.fetched_rows == {0, 1, 4}
+    assert progress.pending_rows == {3}
+    rows = [g[0].y for g in got if isinstance(g, tuple)]
+    assert 2 not in rows
+    assert 0 < rows.count(3) < 10
+    assert "ROW:3" not in got
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from pathlib import Path
+
+from mosaic_v3.color_processing import DominantColors
+from mosaic_v3.dispatcher import FetchProgress
+from mosaic_v3.leases import LeaseRenewer, LeaseStore, fetch_leases, report_leases
+from mosaic_v3.progress import MosaicProgress
+from sl_maptools import MapCoord
+
+
+def _colors(value: int) -> DominantColors:
+    return DominantColors.from_serialized({"NW": (value, value, value)})
+
+
+def test_claim_and_expiry(tmp_path: Path):
+    with LeaseStore(tmp_path / "leases.sqlite", lease_seconds=100) as store:
+        assert store.add_rows(range(10)) == 10
+        assert store.add_rows(range(5)) == 0
+        lease_a = store.claim("a", 4, now=1000)
+        assert lease_a.rows == (9, 8, 7, 6)
+        lease_b = store.claim("b", 4, now=1050)
+        assert lease_b.rows == (5, 4, 3, 2)
+        # a keeps its lease alive; b does not, so its rows go to whoever claims after expiry
+        assert store.renew("a", now=1090) == {6, 7, 8, 9}
+        assert store.claim("c", 10, now=1160).rows == (5, 4, 3, 2, 1, 0)
+        assert store.renew("b", now=1160) == set()
+        assert store.claim("d", 10, now=1170) is None
+        assert store.counts(now=1170) == {"pending": 0, "leased": 10, "expired": 0, "done": 0}
+
+
+def test_complete_and_merge(tmp_path: Path):
+    with LeaseStore(tmp_path / "leases.sqlite") as store:
+        store.add_rows([1, 2])
+        store.claim("a", 2)
+        assert store.complete("a", 2, {MapCoord(0, 2): _colors(1)})
+        # First results win
+        assert not store.complete("b", 2, {})
+        store.release("a", [1])
+        assert store.counts()["pending"] == 1
+
+        progress = MosaicProgress(regions={MapCoord(5, 2): _colors(9), MapCoord(5, 1): _colors(9)}, failed_rows={2})
+        assert store.merge_into(progress) == 1
+    assert set(progress.regions) == {MapCoord(0, 2), MapCoord(5, 1)}
+    assert progress.regions[MapCoord(0, 2)].encode() == {"NW": (1, 1, 1)}
+    assert progress.completed_rows == {2}
+    assert not progress.failed_rows
+    assert 2 in progress.row_stamps
+
+
+def test_fetch_and_report(tmp_path: Path):
+    store = LeaseStore(tmp_path / "leases.sqlite")
+    store.add_rows(range(5))
+    fetched = []
+
+    async def fetch(y_min, y_max, rows):
+        fetched.append((y_min, y_max, rows))
+        fprog = FetchProgress(3)
+        for row in rows:
+            fprog.init(row)
+            fprog.start(row)
+            if row != 3:
+                fprog.complete(row)
+        return fprog, []
+
+    fprog, errs, leased = asyncio.run(fetch_leases(store, "a", fetch, 3, lease_rows=2, message=lambda _: None))
+    assert fetched == [(3, 4, {3, 4}), (1, 2, {1, 2}), (0, 0, {0})]
+    assert leased == {0, 1, 2, 3, 4}
+    assert fprog.fetched_rows == {0, 1, 2, 4}
+    assert fprog.pending_rows == {3}
+
+    progress = MosaicProgress(regions={MapCoord(0, 4): _colors(4)}, completed_rows=fprog.fetched_rows)
+    assert report_leases(store, "a", leased, progress) == (4, 1)
+    assert store.counts() == {"pending": 1, "leased": 0, "expired": 0, "done": 4}
+    store.close()
+
+
+def test_renewer_outlives_fetching(tmp_path: Path):
+    # Renewed every 0.5 seconds, leaving plenty of slack on a busy machine
+    store = LeaseStore(tmp_path / "leases.sqlite", lease_seconds=1.5)
+    store.add_rows(range(4))
+
+    async def fetch(y_min, y_max, rows):
+        fprog = FetchProgress(3)
+        for row in rows:
+            fprog.init(row)
+            fprog.start(row)
+            fprog.complete(row)
+        return fprog, []
+
+    with LeaseRenewer(store, "a", message=lambda _: None) as renewer:
+        _, _, leased = asyncio.run(fetch_leases(store, "a", fetch, 3, renewer=renewer, message=lambda _: None))
+        # Colour processing takes a while...
+        time.sleep(2.0)
+        assert store.counts() == {"pending": 0, "leased": 4, "expired": 0, "done": 0}
+        assert report_leases(store, "a", leased, MosaicProgress(completed_rows={0, 1, 2, 3}), renewer) == (4, 0)
+    assert renewer.lost == set()
+    store.close()
+
+
+def test_renewer_notices_lost_leases(tmp_path: Path):
+    store = LeaseStore(tmp_path / "leases.sqlite", lease_seconds=0.3)
+    store.add_rows(range(4))
+    messages = []
+    with LeaseRenewer(store, "a", message=messages.append) as renewer:
+        renewer.track(store.claim("a", 2).rows)
+        # Someone whose clock runs way ahead deems the lease expired
+        assert store.claim("b", 1, now=time.time() + 1000).rows == (3,)
+        deadline = time.monotonic() + 5.0
+        while not renewer.lost and time.monotonic() < deadline:
+            time.sleep(0.05)
+    assert renewer.lost == {3}
+    assert messages == ["!!! Leases lost: rows [3]"]
+    store.close()
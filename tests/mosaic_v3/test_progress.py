@@ -0,0 +1,59 @@
+import io
+import multiprocessing as MP
+
+import msgpack
+
+from mosaic_v3.progress import MosaicProgress, TileBitmap
+
+
+def test_tile_bitmap():
+    bitmap = TileBitmap()
+    for x in (0, 7, 8, 2000):
+        bitmap.add(x)
+    bitmap.add(7)
+    assert len(bitmap) == 4
+    assert all(x in bitmap for x in (0, 7, 8, 2000))
+    assert 1 not in bitmap
+    assert 2001 not in bitmap
+    assert 5000 not in bitmap
+    assert len(bitmap.encode()) == 251
+    assert TileBitmap(bitmap.encode()) == bitmap
+
+
+def test_row_stamps_roundtrip():
+    prog = MosaicProgress(completed_rows={1, 2}, row_stamps={1: 1234.5, 2: 2345.5})
+    buf = io.BytesIO()
+    prog.write_to_stream(buf)
+    buf.seek(0)
+    assert MosaicProgress.new_from_stream(buf).row_stamps == {1: 1234.5, 2: 2345.5}
+
+
+def test_row_stamps_through_proxies():
+    prog = MosaicProgress(completed_rows={1}, row_stamps={1: 1234.5})
+    with MP.Manager() as mgr:
+        proxy = prog.get_proxies(mgr)
+        try:
+            proxy.row_stamps[2] = 2345.5
+            assert proxy.unproxy().row_stamps == {1: 1234.5, 2: 2345.5}
+        finally:
+            proxy.regions.close()
+
+
+def test_partial_rows_roundtrip():
+    bitmap = TileBitmap()
+    bitmap.add(3)
+    prog = MosaicProgress(completed_rows={1}, failed_rows={2}, partial_rows={2: bitmap, 1: TileBitmap()})
+    prog.drop_finished_partials()
+    assert set(prog.partial_rows) == {2}
+    buf = io.BytesIO()
+    prog.write_to_stream(buf)
+    buf.seek(0)
+    assert MosaicProgress.new_from_stream(buf).partial_rows == {2: bitmap}
+
+
+def test_old_state_file():
+    buf = io.BytesIO(msgpack.packb({"__regions": [], "__completed": [1, 2], "__fails": [2]}))
+    prog = MosaicProgress.new_from_stream(buf)
+    assert prog.completed_rows == {1, 2}
+    assert prog.partial_rows == {}
+    assert prog.row_stamps == {}
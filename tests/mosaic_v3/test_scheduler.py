@@ -0,0 +1,40 @@
+from mosaic_v3.scheduler import (
+    HILBERT_BAND,
+    DensityScheduler,
+    FailedFirstScheduler,
+    HilbertScheduler,
+    Scheduler,
+    StaleFirstScheduler,
+    hilbert_index,
+)
+from sl_maptools import MapCoord
+
+
+def test_hilbert_curve_is_continuous():
+    order = 4
+    n = 1 << order
+    by_index = sorted((hilbert_index(order, x, y), (x, y)) for x in range(n) for y in range(n))
+    assert [d for d, _ in by_index] == list(range(n * n))
+    for (_, (x1, y1)), (_, (x2, y2)) in zip(by_index, by_index[1:]):
+        assert abs(x1 - x2) + abs(y1 - y2) == 1
+
+
+def test_row_orders():
+    rows = range(10)
+    assert Scheduler().order_rows(rows) == list(range(9, -1, -1))
+    regions = [MapCoord(x, 3) for x in range(5)] + [MapCoord(0, 7), MapCoord(1, 7)]
+    assert DensityScheduler(regions).order_rows(rows)[:3] == [3, 7, 9]
+    assert FailedFirstScheduler({2, 5}).order_rows(rows)[:3] == [5, 2, 9]
+    stale = StaleFirstScheduler({y: 1000.0 + y for y in range(10) if y != 4})
+    assert stale.order_rows(rows)[:3] == [4, 0, 1]
+
+
+def test_hilbert_bands():
+    sched = HilbertScheduler()
+    bands = sched.bands(range(40))
+    assert [len(b) for b in bands] == [HILBERT_BAND, HILBERT_BAND, 40 - 2 * HILBERT_BAND]
+    coords = [MapCoord(x, y) for y in bands[0] for x in range(32)]
+    ordered = sched.order_tiles(coords)
+    assert sorted(ordered) == sorted(coords)
+    assert ordered != coords
+
@@ -0,0 +1,91 @@
+import queue
+import time
+
+from mosaic_v3.workers import QueueFeeder, WorkTeam, Worker
+
+
+class _SlowQueue(queue.Queue):
+    def put(self, item, block=True, timeout=None):
+        time.sleep(0.01)
+        super().put(item, block, timeout)
+
+
+def test_feeder_keeps_order():
+    target = _SlowQueue()
+    feeder = QueueFeeder(target)
+    for i in range(20):
+        feeder.put(i)
+    # The slow put()s happen in the feeder's thread
+    assert feeder.submit_seconds < 0.1
+    feeder.close()
+    assert feeder.pending == 0
+    assert [target.get_nowait() for _ in range(20)] == list(range(20))
+    assert feeder.put_seconds >= 0.2
+    assert feeder.max_put_seconds >= 0.01
+
+
+def test_feeder_batches():
+    target = queue.Queue()
+    feeder = QueueFeeder(target, batch_size=4, batch_wait=1.0)
+    for i in range(6):
+        feeder.put(i)
+    feeder.put("SAVE")
+    feeder.put(6)
+    feeder.close()
+    got = []
+    while not target.empty():
+        got.append(target.get_nowait())
+    # Commands are never batched, and end the batch before them
+    assert got == [[0, 1, 2, 3], [4, 5], "SAVE", [6]]
+    assert feeder.fed == 8
+    assert feeder.messages == 4
+
+
+def test_feeder_batch_wait():
+    target = queue.Queue()
+    feeder = QueueFeeder(target, batch_size=100, batch_wait=0.05)
+    feeder.put(1)
+    # The batch goes out after batch_wait, even though it's not full
+    assert target.get(timeout=1.0) == [1]
+    feeder.close()
+
+
+def test_processor_counts_failures(capsys):
+    from mosaic_v3.workers.tile_processor import TileProcessor
+    from sl_maptools import MapCoord
+
+    class _Processor(TileProcessor):
+        CommandQueue = queue.Queue()
+
+    err_q = queue.Queue()
+    coordfail_q = queue.Queue()
+    proc = _Processor(output_q=queue.Queue(), coordfail_q=coordfail_q, err_q=err_q)
+    assert proc._process(MapCoord(3, 4), b"not a jpeg") is None
+    assert proc._process(MapCoord(5, 6), b"") == (MapCoord(5, 6), None)
+    assert proc.failed_count == 1
+    assert "(3,4)" in err_q.get_nowait()
+    assert coordfail_q.get_nowait()[0] == MapCoord(3, 4)
+    assert capsys.readouterr().out == ""
+
+
+class _IdleWorker(Worker):
+    """Does nothing with jobs; just waits to be told to DIE"""
+
+    def run(self) -> None:
+        while self.command_queue.get() != "DIE":
+            pass
+
+
+def test_team_not_full_once_dead():
+    team = WorkTeam(2, _IdleWorker, capacity=2)
+    team.start()
+    team.submit((1, b""))
+    assert not team.full
+    team.submit((2, b""))
+    assert team.full
+    for _ in range(2):
+        team.submit("DIE")
+    for w in team._workers:
+        w.join(5.0)
+    assert team.alive_count == 0
+    assert not team.full
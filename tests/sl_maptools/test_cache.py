@@ -0,0 +1,130 @@
+from pathlib import Path
+
+import pytest
+
+from sl_maptools import MapCoord
+from sl_maptools.cache import FingerprintStore, TileCache, TileFingerprint, VoidRegistry
+
+BLOB_A = b"\xff\xd8" + b"A" * 100 + b"\xff\xd9"
+BLOB_B = b"\xff\xd8" + b"B" * 100 + b"\xff\xd9"
+
+
+def test_store_and_revalidate(tmp_path: Path):
+    cache = TileCache(tmp_path)
+    co = MapCoord(1000, 1000)
+    assert cache.conditional_headers(co) == {}
+    cache.store(co, BLOB_A, etag='"abc"', last_modified="Wed, 09 Nov 2022 00:00:00 GMT")
+    assert cache.conditional_headers(co) == {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "Wed, 09 Nov 2022 00:00:00 GMT",
+    }
+    assert cache.revalidated(co) == BLOB_A
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 1
+    assert cache.stats.hit_rate == pytest.approx(0.5)
+
+
+def test_content_addressed(tmp_path: Path):
+    cache = TileCache(tmp_path)
+    cache.store(MapCoord(1, 1), BLOB_A)
+    cache.store(MapCoord(2, 2), BLOB_A)
+    assert len(cache) == 2
+    assert cache.total_bytes == len(BLOB_A)
+    cache.invalidate(MapCoord(1, 1))
+    assert cache.read(MapCoord(2, 2)) == BLOB_A
+    cache.invalidate(MapCoord(2, 2))
+    assert cache.total_bytes == 0
+    assert not list(tmp_path.glob("*/*.jpg"))
+
+
+def test_restore_same_content(tmp_path: Path):
+    cache = TileCache(tmp_path)
+    co = MapCoord(5, 5)
+    cache.store(co, BLOB_A, etag="1")
+    cache.store(co, BLOB_A, etag="2")
+    assert cache.conditional_headers(co) == {"If-None-Match": "2"}
+    assert cache.read(co) == BLOB_A
+
+
+def test_lru_eviction(tmp_path: Path):
+    cache = TileCache(tmp_path, max_bytes=len(BLOB_A) + len(BLOB_B))
+    cache.store(MapCoord(1, 1), BLOB_A)
+    cache.store(MapCoord(2, 2), BLOB_B)
+    # Touch (1, 1) so that (2, 2) becomes the least-recently-used
+    assert cache.read(MapCoord(1, 1)) == BLOB_A
+    cache.store(MapCoord(3, 3), b"\xff\xd8" + b"C" * 100 + b"\xff\xd9")
+    assert MapCoord(1, 1) in cache
+    assert MapCoord(2, 2) not in cache
+    assert MapCoord(3, 3) in cache
+    assert cache.stats.evictions == 1
+
+
+def test_persistence(tmp_path: Path):
+    with TileCache(tmp_path) as cache:
+        cache.store(MapCoord(1, 1), BLOB_A, etag="x")
+        cache.store(MapCoord(2, 2), BLOB_B)
+    cache2 = TileCache(tmp_path)
+    assert len(cache2) == 2
+    assert cache2.conditional_headers(MapCoord(1, 1)) == {"If-None-Match": "x"}
+    assert cache2.read(MapCoord(2, 2)) == BLOB_B
+
+
+def test_void_registry_skip_and_revive():
+    reg = VoidRegistry(width=10, height=10, reprobe_fraction=0.0, pinned=[MapCoord(9, 9)])
+    co = MapCoord(3, 4)
+    assert co not in reg
+    assert MapCoord(9, 9) in reg
+    reg.record_void(co)
+    assert reg.should_skip(co)
+    assert reg.stats.skipped == 1
+    reg.record_region(co)
+    assert co not in reg
+    assert reg.stats.revived == 1
+    # Outside the world is never void
+    assert MapCoord(100, 100) not in reg
+
+
+def test_void_registry_reprobes_oldest(tmp_path: Path):
+    path = tmp_path / "voids.msgp"
+    day = VoidRegistry.DAY
+    with VoidRegistry(path, width=10, height=10) as reg:
+        # 10 voids, the first 2 of them much older than the rest
+        for x in range(10):
+            reg.record_void(MapCoord(x, 0), when=(1_000_000 if x < 2 else 1_000_000 + 10 * day))
+    reg2 = VoidRegistry(path, width=10, height=10, reprobe_fraction=0.2, max_age_days=1e9)
+    assert reg2.stats.reprobes == 2
+    assert MapCoord(0, 0) not in reg2
+    assert MapCoord(1, 0) not in reg2
+    assert all(MapCoord(x, 0) in reg2 for x in range(2, 10))
+
+
+def test_void_registry_max_age(tmp_path: Path):
+    path = tmp_path / "voids.msgp"
+    with VoidRegistry(path, width=10, height=10) as reg:
+        reg.record_void(MapCoord(1, 1), when=1_000_000)
+        reg.record_void(MapCoord(2, 2))
+    reg2 = VoidRegistry(path, width=10, height=10, reprobe_fraction=0.0, max_age_days=30)
+    assert MapCoord(1, 1) not in reg2
+    assert MapCoord(2, 2) in reg2
+
+
+def test_fingerprint_changes(tmp_path: Path):
+    path = tmp_path / "fingerprints.msgp"
+    fp_a = TileFingerprint.from_headers({"Content-Length": "1234", "ETag": '"a"'})
+    fp_b = TileFingerprint.from_headers({"Content-Length": "1234", "ETag": '"b"'})
+    with FingerprintStore(path) as store:
+        # Never seen: regions must be fetched, voids needn't be unless a region is known to be there
+        assert store.has_changed(MapCoord(0, 0), fp_a)
+        assert not store.has_changed(MapCoord(1, 0), None)
+        assert store.has_changed(MapCoord(2, 0), None, known_region=True)
+        store.record(MapCoord(0, 0), fp_a)
+        store.record(MapCoord(1, 0), None)
+    store2 = FingerprintStore(path)
+    assert len(store2) == 2
+    assert store2.get(MapCoord(0, 0)) == fp_a
+    assert not store2.has_changed(MapCoord(0, 0), fp_a)
+    assert store2.has_changed(MapCoord(0, 0), fp_b)
+    assert store2.has_changed(MapCoord(0, 0), None)
+    assert store2.has_changed(MapCoord(1, 0), fp_a)
+    assert not store2.has_changed(MapCoord(1, 0), None)
+    assert (store2.stats.probed, store2.stats.changed, store2.stats.unchanged) == (5, 3, 2)
@@ -0,0 +1,475 @@
+import asyncio
+import contextlib
+import io
+import re
+import threading
+
+from PIL import Image
+
+from sl_maptools import MapBounds, MapCoord, MapTile
+from sl_maptools.fetcher import (
+    HEDGE_MIN_SAMPLES,
+    JPEG_EOI,
+    JPEG_SOI,
+    VOID_COLOR,
+    AreaProgress,
+    BoundedMapFetcher,
+    Checkpoint,
+    RowComplete,
+    RowFailed,
+    TileDecoder,
+    _box_has_content,
+    jpeg_defect,
+)
+from sl_maptools.cache import FingerprintStore
+from sl_maptools.metrics import FetchMetrics
+from sl_maptools.retry import RetryPolicy
+
+
+class _FakeResponse:
+    def __init__(self, status_code: int, content: bytes = b"", headers: dict = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = content
+
+
+class _SlowFirstClient:
+    """Answers the first request to each URL after `slow` seconds, and subsequent ones after `fast` seconds"""
+
+    def __init__(self, slow: float, fast: float):
+        self.slow = slow
+        self.fast = fast
+        self.seen = set()
+        self.calls = 0
+        self.cancelled = 0
+
+    async def get(self, url, headers=None):
+        self.calls += 1
+        delay = self.fast if url in self.seen else self.slow
+        self.seen.add(url)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return _FakeResponse(200, JPEG_SOI + url.encode() + JPEG_EOI)
+
+
+def _warmed_up(client, budget: float) -> BoundedMapFetcher:
+    fetcher = BoundedMapFetcher(10, client, hedge_budget=budget)
+    for _ in range(HEDGE_MIN_SAMPLES):
+        fetcher._observe(0.01, 200)
+    fetcher.hedge_stats.requests = HEDGE_MIN_SAMPLES
+    return fetcher
+
+
+def test_hedge_wins():
+    client = _SlowFirstClient(slow=5.0, fast=0.01)
+    fetcher = _warmed_up(client, budget=0.05)
+
+    async def runner():
+        return await asyncio.wait_for(fetcher.async_fetch(MapCoord(1000, 1000)), 2.0)
+
+    coord, raw = asyncio.run(runner())
+    assert raw.endswith(b"map-1-1000-1000-objects.jpg" + JPEG_EOI)
+    assert client.calls == 2
+    assert client.cancelled == 1
+    assert fetcher.hedge_stats.hedged == 1
+    assert fetcher.hedge_stats.hedge_won == 1
+
+
+def test_hedge_loser_awaited():
+    client = _SlowFirstClient(slow=5.0, fast=0.01)
+    fetcher = _warmed_up(client, budget=0.05)
+
+    async def runner():
+        await fetcher._send("https://example.com/map-1-1000-1000-objects.jpg")
+        # The losing request has been cancelled, and is done with by the time the request returns
+        assert client.cancelled == 1
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+
+    asyncio.run(runner())
+
+
+def test_no_hedge_without_samples_or_budget():
+    client = _SlowFirstClient(slow=0.05, fast=0.01)
+    fetcher = BoundedMapFetcher(10, client, hedge_budget=0.05)
+    asyncio.run(fetcher.async_fetch(MapCoord(1000, 1000)))
+    assert client.calls == 1
+
+    client = _SlowFirstClient(slow=0.05, fast=0.01)
+    fetcher = _warmed_up(client, budget=0.0)
+    asyncio.run(fetcher.async_fetch(MapCoord(1000, 1000)))
+    assert client.calls == 1
+    assert fetcher.hedge_stats.hedged == 0
+
+
+def test_metrics_recorded():
+    metrics = FetchMetrics()
+    client = _SlowFirstClient(slow=0.0, fast=0.0)
+    fetcher = BoundedMapFetcher(10, client, metrics=metrics)
+    asyncio.run(fetcher.async_fetch(MapCoord(1000, 1000)))
+    assert metrics.responses.value(status=200) == 1
+    assert metrics.request_latency.count() == 1
+    assert metrics.limiter_wait.count() == 1
+    assert metrics.bytes.value() == len(b"https://secondlife-maps-cdn.akamaized.net/map-1-1000-1000-objects.jpg") + 4
+    assert metrics.in_flight.value() == 0
+    assert metrics.limit.value() == 10
+
+
+class _HeadClient:
+    """Answers HEAD requests only; tiles with odd x are voids"""
+
+    def __init__(self):
+        self.heads = 0
+
+    async def head(self, url, headers=None):
+        self.heads += 1
+        if "-1001-" in url:
+            return _FakeResponse(403)
+        return _FakeResponse(200, headers={"Content-Length": "42", "ETag": '"abc"'})
+
+
+def test_probe():
+    client = _HeadClient()
+    fetcher = BoundedMapFetcher(10, client)
+
+    async def runner():
+        return await asyncio.gather(*(fetcher.async_probe(MapCoord(x, 1000)) for x in (1000, 1001, 1000)))
+
+    (_, fp), (_, void), _ = asyncio.run(runner())
+    assert fp.content_length == 42
+    assert fp.etag == '"abc"'
+    assert void is None
+    # Concurrent probes of the same tile are coalesced
+    assert client.heads == 2
+
+
+class _BadLengthClient:
+    """Answers with a malformed Content-Length; GETs are gzipped, so jpeg_defect() doesn't look at it"""
+
+    PAYLOAD = JPEG_SOI + b"x" * 10 + JPEG_EOI
+
+    async def head(self, url, headers=None):
+        return _FakeResponse(200, headers={"Content-Length": "abc", "ETag": '"abc"'})
+
+    async def get(self, url, headers=None):
+        headers = {"Content-Length": "abc", "Content-Encoding": "gzip", "ETag": '"abc"'}
+        return _FakeResponse(200, self.PAYLOAD, headers=headers)
+
+
+def test_malformed_content_length():
+    store = FingerprintStore(None)
+    fetcher = BoundedMapFetcher(10, _BadLengthClient(), fingerprints=store)
+    _, fp = asyncio.run(fetcher.async_probe(MapCoord(1000, 1000)))
+    assert fp.content_length is None
+    assert fp.etag == '"abc"'
+    assert asyncio.run(fetcher.async_fetch(MapCoord(1000, 1000))) == (MapCoord(1000, 1000), _BadLengthClient.PAYLOAD)
+    assert store.get(MapCoord(1000, 1000)) == fp
+
+
+def test_jpeg_defect():
+    good = JPEG_SOI + b"x" * 10 + JPEG_EOI
+    assert jpeg_defect(good, {"Content-Length": str(len(good))}) is None
+    assert jpeg_defect(good + b"\x00\x00", {}) is None
+    assert jpeg_defect(good[:-1], {}) is not None
+    assert jpeg_defect(b"<html>" + good, {}) is not None
+    assert jpeg_defect(good, {"Content-Length": str(len(good) + 100)}) is not None
+    assert jpeg_defect(good, {"Content-Length": "5", "Content-Encoding": "gzip"}) is None
+    assert jpeg_defect(good, {"Content-Length": "12, 12"}) is not None
+    assert jpeg_defect(good, {"Content-Length": ""}) is not None
+
+
+class _TruncatingClient:
+    """Truncates the payload of the first `bad` responses"""
+
+    def __init__(self, bad: int):
+        self.bad = bad
+        self.calls = 0
+
+    async def get(self, url, headers=None):
+        self.calls += 1
+        payload = JPEG_SOI + b"x" * 10 + JPEG_EOI
+        if self.calls <= self.bad:
+            return _FakeResponse(200, payload[:8], headers={"Content-Length": str(len(payload))})
+        return _FakeResponse(200, payload)
+
+
+def test_corrupt_payload_refetched():
+    metrics = FetchMetrics()
+    client = _TruncatingClient(bad=2)
+    fetcher = BoundedMapFetcher(10, client, metrics=metrics)
+    coord, content = asyncio.run(fetcher.async_fetch(MapCoord(1000, 1000)))
+    assert content == JPEG_SOI + b"x" * 10 + JPEG_EOI
+    assert client.calls == 3
+    assert metrics.corrupt.value() == 2
+
+
+def test_box_has_content():
+    img = Image.new("RGB", (256, 256), VOID_COLOR)
+    img.paste((200, 180, 120), (128, 0, 256, 128))
+    assert not _box_has_content(img, (0, 0, 128, 128))
+    assert not _box_has_content(img, (0, 128, 256, 256))
+    assert _box_has_content(img, (128, 0, 256, 128))
+    # Partly covered
+    assert _box_has_content(img, (64, 0, 192, 128))
+    # Noise around the void colour is content, too
+    noisy = Image.effect_noise((256, 256), 50).convert("RGB")
+    assert _box_has_content(noisy, (0, 0, 128, 128))
+
+
+_TILE_URL = re.compile(r"map-(\d+)-(\d+)-(\d+)-objects\.jpg")
+
+
+class _LowZoomClient:
+    """Serves low-zoom tiles of a world having regions at `regions`; blocks without any region are 403"""
+
+    def __init__(self, regions, broken=()):
+        self.regions = set(regions)
+        self.broken = set(broken)
+        self.requested = []
+
+    async def get(self, url, headers=None):
+        level, x, y = (int(g) for g in _TILE_URL.search(url).groups())
+        self.requested.append((level, x, y))
+        if (level, x, y) in self.broken:
+            # Passes jpeg_defect(), but can't be decoded
+            return _FakeResponse(200, JPEG_SOI + b"garbage" + JPEG_EOI)
+        span = 2 ** (level - 1)
+        inside = [co for co in self.regions if x <= co.x < x + span and y <= co.y < y + span]
+        if not inside:
+            return _FakeResponse(403)
+        cell = 256 // span
+        img = Image.new("RGB", (256, 256), VOID_COLOR)
+        for co in inside:
+            i, j = co.x - x, co.y - y
+            img.paste((200, 180, 120), (i * cell, (span - 1 - j) * cell, (i + 1) * cell, (span - j) * cell))
+        with io.BytesIO() as bio:
+            img.save(bio, "JPEG", quality=95)
+            return _FakeResponse(200, bio.getvalue())
+
+
+def test_discover():
+    client = _LowZoomClient({MapCoord(5, 6)})
+    fetcher = BoundedMapFetcher(10, client)
+    dmap = asyncio.run(fetcher.async_discover(MapBounds(0, 0, 15, 7), top_level=4, leaf_level=2))
+    assert dmap.candidates == {MapCoord(5, 6)}
+    # Two top-level blocks, then one block per level down to the region
+    assert sorted(client.requested) == [(2, 4, 6), (3, 4, 4), (4, 0, 0), (4, 8, 0)]
+    assert dmap.requests == 4
+    # Within a 403 block
+    assert dmap.is_void(MapCoord(10, 3))
+    assert MapCoord(5, 6) not in dmap.voids
+    # Flat void fill at low zoom doesn't make a void, as it might be open water
+    assert not dmap.is_void(MapCoord(4, 6))
+    assert not dmap.is_void(MapCoord(0, 0))
+    assert dmap.known_voids == {MapCoord(x, y) for x in range(8, 16) for y in range(8)}
+    assert dmap.unsure_count == 16 * 8 - 1 - 64
+
+
+class _FlatWorldClient:
+    """A world whose regions are all flat open water, hence look like void fill at low zoom"""
+
+    async def get(self, url, headers=None):
+        with io.BytesIO() as bio:
+            Image.new("RGB", (256, 256), VOID_COLOR).save(bio, "JPEG", quality=95)
+            return _FakeResponse(200, bio.getvalue())
+
+
+def test_discover_flat_water():
+    fetcher = BoundedMapFetcher(10, _FlatWorldClient())
+    dmap = asyncio.run(fetcher.async_discover(MapBounds(0, 0, 15, 7), top_level=4, leaf_level=2))
+    assert not dmap.candidates
+    assert not any(dmap.is_void(MapCoord(x, y)) for x in range(16) for y in range(8))
+
+
+def test_discover_undecodable_block():
+    client = _LowZoomClient({MapCoord(5, 6)}, broken={(4, 8, 0)})
+    fetcher = BoundedMapFetcher(10, client)
+    dmap = asyncio.run(fetcher.async_discover(MapBounds(0, 0, 15, 7), top_level=4, leaf_level=2))
+    # The whole broken block is deemed to have content
+    assert dmap.candidates == {MapCoord(5, 6)} | {MapCoord(x, y) for x in range(8, 16) for y in range(8)}
+
+
+class _ThreadNotingDecoder(TileDecoder):
+    def __init__(self):
+        super().__init__(max_workers=2)
+        self.threads = set()
+
+    def _decode(self, raw):
+        self.threads.add(threading.get_ident())
+        return super()._decode(raw)
+
+
+def test_tile_decoder():
+    with io.BytesIO() as bio:
+        Image.new("RGB", (256, 256), VOID_COLOR).save(bio, "JPEG")
+        raw = bio.getvalue()
+    decoder = _ThreadNotingDecoder()
+
+    async def runner():
+        return threading.get_ident(), await asyncio.gather(*(decoder.decode(raw) for _ in range(5)))
+
+    loop_thread, images = asyncio.run(runner())
+    decoder.shutdown()
+    assert all(img.size == (256, 256) for img in images)
+    assert decoder.threads and loop_thread not in decoder.threads
+    assert decoder.stats.count == 5
+    assert decoder.stats.seconds > 0
+    assert decoder.stats.average == decoder.stats.seconds / 5
+
+
+class _AreaClient:
+    """All tiles are voids, answered after `delay` seconds (or as per `delays`); tiles in `fail` raise"""
+
+    def __init__(self, delay: float = 0.005, delays: dict = None, fail=()):
+        self.delay = delay
+        self.delays = delays or {}
+        self.fail = set(fail)
+        self.requested = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def get(self, url, headers=None):
+        _, x, y = (int(g) for g in _TILE_URL.search(url).groups())
+        coord = MapCoord(x, y)
+        self.requested.append(coord)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if coord in self.fail:
+                raise RuntimeError(f"Failing {coord}")
+            await asyncio.sleep(self.delays.get(coord, self.delay))
+            return _FakeResponse(403)
+        finally:
+            self.in_flight -= 1
+
+
+def _iterate(fetcher: BoundedMapFetcher, width: int, rows: int, consume=None, **kwargs):
+    async def runner():
+        events = []
+        async for event in fetcher.iter_area(MapCoord(0, 0), MapCoord(width - 1, rows - 1), **kwargs):
+            events.append(event)
+            if consume is not None:
+                await consume(event)
+        return events
+
+    return asyncio.run(runner())
+
+
+def test_iter_area():
+    client = _AreaClient()
+    fetcher = BoundedMapFetcher(10, client)
+    events = _iterate(fetcher, 10, 3, lookahead=4, save_every=7)
+    assert client.max_in_flight == 4
+    tiles = [e for e in events if isinstance(e, MapTile)]
+    assert len(tiles) == 30
+    assert [e.row for e in events if isinstance(e, RowComplete)] == [2, 1, 0]
+    # Rows are done one after the other
+    assert [t.coord.y for t in tiles] == [2] * 10 + [1] * 10 + [0] * 10
+    # A Checkpoint right after every 7th tile
+    indexes = [i for i, e in enumerate(events) if isinstance(e, Checkpoint)]
+    assert [sum(isinstance(e, MapTile) for e in events[:i]) for i in indexes] == [7, 14, 21, 28]
+
+
+def test_iter_area_backpressure():
+    client = _AreaClient(delay=0.0)
+    fetcher = BoundedMapFetcher(10, client)
+
+    async def consume(event):
+        # Nothing new gets requested while the consumer is busy
+        requested = len(client.requested)
+        await asyncio.sleep(0.01)
+        assert len(client.requested) == requested
+
+    events = _iterate(fetcher, 5, 2, consume=consume, lookahead=3)
+    assert len([e for e in events if isinstance(e, MapTile)]) == 10
+
+
+def test_iter_area_row_failed():
+    client = _AreaClient(delay=0.05, fail={MapCoord(0, 1)})
+    fetcher = BoundedMapFetcher(10, client, retry_policy=RetryPolicy(max_attempts=1))
+    progress = AreaProgress()
+    events = _iterate(fetcher, 10, 2, lookahead=3, progress=progress)
+    failed = [e for e in events if isinstance(e, RowFailed)]
+    assert [e.row for e in failed] == [1]
+    # None of the failed row's tiles are yielded, and none beyond the window are even requested
+    assert not [e for e in events if isinstance(e, MapTile) and e.coord.y == 1]
+    assert len([co for co in client.requested if co.y == 1]) == 3
+    assert [e.row for e in events if isinstance(e, RowComplete)] == [0]
+    assert progress.last_fail_rows == {1}
+
+
+def test_iter_area_early_exit():
+    client = _AreaClient(delay=0.05, delays={MapCoord(0, 0): 0.0})
+    fetcher = BoundedMapFetcher(10, client)
+
+    async def runner():
+        async with contextlib.aclosing(fetcher.iter_area(MapCoord(0, 0), MapCoord(9, 0), lookahead=5)) as events:
+            async for _ in events:
+                break
+        # The fetches still in flight have been cancelled and waited for
+        return [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+
+    assert asyncio.run(runner()) == []
+    assert client.in_flight == 0
+
+
+def test_async_get_area():
+    client = _AreaClient(fail={MapCoord(3, 0)})
+    fetcher = BoundedMapFetcher(10, client, retry_policy=RetryPolicy(max_attempts=1))
+    got = []
+    errors = []
+    progress = AreaProgress()
+    asyncio.run(
+        fetcher.async_get_area(
+            MapCoord(0, 0),
+            MapCoord(4, 2),
+            got.append,
+            save_every=4,
+            progress=progress,
+            err_callback=errors.append,
+            quiet=True,
+        )
+    )
+    assert [e.row for e in got if isinstance(e, RowComplete)] == [2, 1]
+    assert len([e for e in got if isinstance(e, MapTile) and e.coord.y > 0]) == 10
+    assert any(isinstance(e, Checkpoint) for e in got)
+    assert len(errors) == 1
+    assert progress.last_fail_rows == {0}
+
+
+def test_iter_area_sliding():
+    # One slow tile holds up its row, but not the fetching of the next rows
+    client = _AreaClient(delay=0.005, delays={MapCoord(0, 2): 0.2})
+    fetcher = BoundedMapFetcher(20, client)
+    events = _iterate(fetcher, 4, 3, lookahead=6, sliding=True)
+    tiles = [e for e in events if isinstance(e, MapTile)]
+    assert len(tiles) == 12
+    row_events = [i for i, e in enumerate(events) if isinstance(e, RowComplete)]
+    assert [events[i].row for i in row_events] == [2, 1, 0]
+    # Tiles of later rows came out before the first row was complete
+    assert any(isinstance(e, MapTile) and e.coord.y < 2 for e in events[: row_events[0]])
+    # Yet every row event comes after all of its row's tiles
+    for i in row_events:
+        assert not [e for e in events[i:] if isinstance(e, MapTile) and e.coord.y == events[i].row]
+
+
+def test_iter_area_sliding_row_failed():
+    client = _AreaClient(delay=0.05, fail={MapCoord(0, 1)})
+    fetcher = BoundedMapFetcher(10, client, retry_policy=RetryPolicy(max_attempts=1))
+    progress = AreaProgress()
+    events = _iterate(fetcher, 10, 2, lookahead=3, progress=progress, sliding=True)
+    assert [e.row for e in events if isinstance(e, RowFailed)] == [1]
+    assert [e.row for e in events if isinstance(e, RowComplete)] == [0]
+    # The rest of the failed row is not even requested
+    assert len([co for co in client.requested if co.y == 1]) == 3
+    assert len([e for e in events if isinstance(e, MapTile)]) == 10
+    assert progress.last_fail_rows == {1}
+
+
+def test_iter_area_sliding_last_row_failed():
+    client = _AreaClient(delay=0.05, fail={MapCoord(0, 0)})
+    fetcher = BoundedMapFetcher(10, client, retry_policy=RetryPolicy(max_attempts=1))
+    events = _iterate(fetcher, 10, 1, lookahead=3, sliding=True)
+    assert [e.row for e in events if isinstance(e, RowFailed)] == [0]
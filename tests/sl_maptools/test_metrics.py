@@ -0,0 +1,59 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from sl_maptools.metrics import FetchMetrics, MetricsRegistry
+
+
+def test_counter_and_gauge_render():
+    reg = MetricsRegistry(prefix="t_")
+    c = reg.counter("responses_total", "Responses", ["status"])
+    c.inc(status=200)
+    c.inc(2, status=403)
+    g = reg.gauge("limit", "Limit")
+    g.set_function(lambda: 42)
+    text = reg.render()
+    assert "# TYPE t_responses_total counter" in text
+    assert 't_responses_total{status="200"} 1' in text
+    assert 't_responses_total{status="403"} 2' in text
+    assert "t_limit 42" in text
+    assert reg.counter("responses_total", "Responses", ["status"]) is c
+    with pytest.raises(ValueError):
+        c.inc(code=200)
+    with pytest.raises(ValueError):
+        reg.gauge("responses_total", "Clash")
+
+
+def test_histogram_buckets():
+    reg = MetricsRegistry()
+    h = reg.histogram("lat", "Latency", buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 3.0):
+        h.observe(v)
+    lines = reg.render().splitlines()
+    assert 'lat_bucket{le="0.1"} 2' in lines
+    assert 'lat_bucket{le="1"} 3' in lines
+    assert 'lat_bucket{le="+Inf"} 4' in lines
+    assert "lat_count 4" in lines
+    assert h.sum() == pytest.approx(3.65)
+
+
+def test_serve_and_dump(tmp_path: Path):
+    metrics = FetchMetrics()
+    metrics.responses.inc(status=200)
+
+    async def runner():
+        server = await metrics.registry.serve(0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+        data = await reader.read()
+        writer.close()
+        server.close()
+        return data
+
+    data = asyncio.run(runner())
+    assert data.startswith(b"HTTP/1.0 200 OK")
+    assert b'slmap_responses_total{status="200"} 1' in data
+    metrics.registry.dump(tmp_path / "m" / "metrics.prom")
+    assert "slmap_in_flight_limit" in (tmp_path / "m" / "metrics.prom").read_text()
@@ -0,0 +1,46 @@
+import asyncio
+
+from sl_maptools.pool import ClientPool
+
+
+class _FakeClient:
+    def __init__(self):
+        self.calls = 0
+        self.gate = asyncio.Event()
+
+    async def get(self, url, **kwargs):
+        self.calls += 1
+        await self.gate.wait()
+        return url
+
+
+def test_least_outstanding():
+    async def runner():
+        clients = [_FakeClient() for _ in range(3)]
+        pool = ClientPool(clients)
+        tasks = [asyncio.create_task(pool.get(f"u{i}")) for i in range(6)]
+        await asyncio.sleep(0)
+        assert [c.calls for c in clients] == [2, 2, 2]
+        # Let client 0 finish; the next requests should go there
+        clients[0].gate.set()
+        await asyncio.sleep(0)
+        assert pool.outstanding == [0, 2, 2]
+        tasks.append(asyncio.create_task(pool.get("next")))
+        await asyncio.sleep(0)
+        assert clients[0].calls == 3
+        for c in clients:
+            c.gate.set()
+        await asyncio.gather(*tasks)
+        assert pool.outstanding == [0, 0, 0]
+        assert sum(pool.requests) == 7
+
+    asyncio.run(runner())
+
+
+def test_create_divides_connections():
+    async def runner():
+        async with ClientPool.create(3, http2=False, max_connections=20) as pool:
+            assert len(pool) == 3
+            assert all(c._transport._pool._max_connections == 7 for c in pool.clients)
+
+    asyncio.run(runner())
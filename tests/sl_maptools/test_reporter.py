@@ -0,0 +1,48 @@
+import io
+import json
+
+from sl_maptools.reporter import ProgressReporter
+
+
+class _Tty(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def test_tty_status_line():
+    out = _Tty()
+    rep = ProgressReporter(stream=out)
+    assert not rep.json_lines
+    rep.count("requested", 3)
+    rep.count("fetched")
+    rep.add_source("processed", lambda: 7)
+    rep.flush()
+    line = out.getvalue()
+    assert line.startswith("\r[")
+    assert "requested 3 | fetched 1 | processed 7" in line
+    assert "\n" not in line
+    rep.message("Row 5 begins")
+    assert out.getvalue().endswith("Row 5 begins\n")
+    rep.stop()
+
+
+def test_json_lines_only_on_change():
+    out = io.StringIO()
+    rep = ProgressReporter(stream=out)
+    assert rep.json_lines
+    rep.count("void", 2)
+    rep.set("rows", "1/10")
+    rep.flush()
+    rep.flush()
+    rep.message("hello")
+    lines = [json.loads(s) for s in out.getvalue().splitlines()]
+    assert len(lines) == 2
+    assert lines[0]["void"] == 2 and lines[0]["rows"] == "1/10"
+    assert lines[1]["message"] == "hello"
+
+
+def test_background_rendering():
+    out = io.StringIO()
+    with ProgressReporter(stream=out, interval=0.01) as rep:
+        rep.count("requested")
+    assert '"requested": 1' in out.getvalue()
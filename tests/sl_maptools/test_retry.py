@@ -0,0 +1,115 @@
+import asyncio
+import email.utils
+import time
+
+import httpx
+import pytest
+
+from sl_maptools import MapCoord
+from sl_maptools.fetcher import MapConnectionError, MapFetcher
+from sl_maptools.retry import CircuitBreaker, RetryBudget, RetryPolicy
+
+
+@pytest.mark.parametrize(
+    "jitter, attempt, lo, hi",
+    [
+        ("none", 1, 0.5, 0.5),
+        ("none", 4, 4.0, 4.0),
+        ("none", 20, 30.0, 30.0),
+        ("full", 3, 0.0, 2.0),
+        ("equal", 3, 1.0, 2.0),
+        ("decorrelated", 3, 0.5, 3.0),
+    ],
+)
+def test_delay_bounds(jitter: str, attempt: int, lo: float, hi: float):
+    policy = RetryPolicy(jitter=jitter)
+    for _ in range(50):
+        assert lo <= policy.delay(attempt, prev_delay=1.0) <= hi
+
+
+def test_delay_honours_retry_after():
+    policy = RetryPolicy(jitter="none")
+    assert policy.delay(1, retry_after=7.0) == 7.0
+    assert policy.delay(10, retry_after=7.0) == pytest.approx(30.0)
+
+
+def test_parse_retry_after():
+    assert RetryPolicy.parse_retry_after("120") == 120.0
+    assert RetryPolicy.parse_retry_after(None) is None
+    assert RetryPolicy.parse_retry_after("soon") is None
+    when = email.utils.formatdate(time.time() + 60, usegmt=True)
+    assert RetryPolicy.parse_retry_after(when) == pytest.approx(60, abs=2)
+
+
+def test_budget():
+    policy = RetryPolicy(max_attempts=10, budget=RetryBudget(2))
+    assert policy.should_retry(1)
+    assert policy.should_retry(1)
+    assert not policy.should_retry(1)
+    assert policy.retries == 2
+    assert not RetryPolicy(max_attempts=3).should_retry(3)
+
+
+def test_breaker_trips_and_escalates():
+    messages = []
+    breaker = CircuitBreaker(window=10, error_threshold=0.5, min_samples=4, cooldown=0.05, message=messages.append)
+    for ok in (True, False, False):
+        breaker.record(ok)
+    assert not breaker.is_open
+    breaker.record(False)
+    assert breaker.is_open
+    assert breaker.trips == 1
+    assert len(messages) == 1
+    asyncio.run(breaker.wait())
+    assert not breaker.is_open
+    # Tripping again shortly after closing doubles the cooldown
+    for _ in range(4):
+        breaker.record(False)
+    assert breaker.cooldown == pytest.approx(0.1)
+
+
+class _FakeResponse:
+    def __init__(self, status_code: int, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = b"\xff\xd8\xff\xd9" if status_code == 200 else b""
+
+
+class _FakeClient:
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = 0
+
+    async def get(self, url, headers=None):
+        self.calls += 1
+        item = self.script.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+
+def test_fetch_retries_then_succeeds():
+    client = _FakeClient([httpx.ReadTimeout("x"), _FakeResponse(500), _FakeResponse(200)])
+    fetcher = MapFetcher(a_session=client, retry_policy=RetryPolicy(jitter="none", base_delay=0.001))
+    coord, raw = asyncio.run(fetcher.async_get_tile_raw(MapCoord(1000, 1000), quiet=True))
+    assert raw == b"\xff\xd8\xff\xd9"
+    assert client.calls == 3
+
+
+def test_fetch_gives_up():
+    client = _FakeClient([_FakeResponse(500)] * 5)
+    fetcher = MapFetcher(a_session=client, retry_policy=RetryPolicy(max_attempts=3, base_delay=0.001))
+    with pytest.raises(MapConnectionError):
+        asyncio.run(fetcher.async_get_tile_raw(MapCoord(1000, 1000), quiet=True))
+    assert client.calls == 3
+
+
+def test_fetch_retry_after_pauses_everyone():
+    client = _FakeClient([_FakeResponse(429, {"Retry-After": "1"}), _FakeResponse(403)])
+    breaker = CircuitBreaker()
+    fetcher = MapFetcher(a_session=client, retry_policy=RetryPolicy(base_delay=0.001), breaker=breaker)
+    start = time.monotonic()
+    coord, raw = asyncio.run(fetcher.async_get_tile_raw(MapCoord(1000, 1000), quiet=True))
+    assert raw is None
+    assert time.monotonic() - start >= 0.9
+    assert breaker.paused_seconds == pytest.approx(1.0, abs=0.1)
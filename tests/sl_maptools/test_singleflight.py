@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from sl_maptools import MapCoord
+from sl_maptools.fetcher import MapFetcher
+from sl_maptools.singleflight import SingleFlight
+
+
+def test_coalesces_concurrent_calls():
+    calls = []
+
+    async def work(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key * 2
+
+    async def runner():
+        sf = SingleFlight()
+        results = await asyncio.gather(*(sf.do(k, lambda k=k: work(k)) for k in (1, 1, 2, 1)))
+        assert results == [2, 2, 4, 2]
+        assert sorted(calls) == [1, 2]
+        assert sf.saved == 2
+        assert len(sf) == 0
+        # Not a cache: once done, the next call starts afresh
+        await sf.do(1, lambda: work(1))
+        assert len(calls) == 3
+
+    asyncio.run(runner())
+
+
+def test_exception_shared():
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def runner():
+        sf = SingleFlight()
+        results = await asyncio.gather(sf.do("k", boom), sf.do("k", boom), return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+        assert sf.saved == 1
+
+    asyncio.run(runner())
+
+
+def test_cancelled_caller_does_not_cancel_shared_call():
+    async def work():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def runner():
+        sf = SingleFlight()
+        first = asyncio.create_task(sf.do("k", work))
+        second = asyncio.create_task(sf.do("k", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == "done"
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    asyncio.run(runner())
+
+
+def test_fetcher_coalesces_same_tile():
+    class _Client:
+        calls = 0
+
+        async def get(self, url, headers=None):
+            self.calls += 1
+            await asyncio.sleep(0.01)
+            resp = type("R", (), {})()
+            resp.status_code, resp.headers, resp.content = 200, {}, b"\xff\xd8\xff\xd9"
+            return resp
+
+    async def runner():
+        client = _Client()
+        fetcher = MapFetcher(a_session=client)
+        co = MapCoord(1000, 1000)
+        results = await asyncio.gather(*(fetcher.async_get_tile_raw(co, quiet=True) for _ in range(3)))
+        assert all(r == (co, b"\xff\xd8\xff\xd9") for r in results)
+        assert client.calls == 1
+        assert fetcher.flights.saved == 2
+
+    asyncio.run(runner())
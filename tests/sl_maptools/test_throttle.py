@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from sl_maptools.throttle import AdaptiveLimiter, LatencyTracker, RateLimiter, TokenBucket
+
+
+@pytest.mark.parametrize(
+    "pct, expekt",
+    [
+        (50, 5.0),
+        (90, 9.0),
+        (100, 10.0),
+        (1, 1.0),
+    ],
+)
+def test_percentile(pct: float, expekt: float):
+    lt = LatencyTracker()
+    for i in range(10, 0, -1):
+        lt.add(float(i))
+    assert lt.percentile(pct) == expekt
+
+
+def test_percentile_empty():
+    assert LatencyTracker().percentile(50) is None
+
+
+async def _saturate(limiter: AdaptiveLimiter, latency: float, ok: bool = True, count: int = None):
+    count = count or limiter.window
+    for _ in range(limiter.limit):
+        await limiter.acquire()
+    for _ in range(count):
+        limiter.record(latency, ok)
+    for _ in range(limiter.in_flight):
+        limiter.release()
+
+
+def test_additive_increase():
+    limiter = AdaptiveLimiter(10, max_limit=20, window=10)
+    asyncio.run(_saturate(limiter, 0.1))
+    assert limiter.limit == 11
+    asyncio.run(_saturate(limiter, 0.1))
+    assert limiter.limit == 12
+
+
+def test_no_increase_when_unsaturated():
+    limiter = AdaptiveLimiter(10, max_limit=20, window=10)
+    for _ in range(10):
+        limiter.record(0.1, True)
+    assert limiter.limit == 10
+
+
+def test_multiplicative_decrease_on_error():
+    limiter = AdaptiveLimiter(16, min_limit=2, max_limit=20, window=10)
+    limiter.record(None, False)
+    assert limiter.limit == 8
+    # Only one cut per window
+    limiter.record(None, False)
+    assert limiter.limit == 8
+    for _ in range(10):
+        limiter.record(0.1, True)
+    limiter.record(None, False)
+    assert limiter.limit == 4
+    assert [h[1] for h in limiter.history] == [16, 8, 4]
+
+
+def test_decrease_on_latency():
+    limiter = AdaptiveLimiter(16, max_limit=20, window=10, latency_tolerance=2.0)
+    asyncio.run(_saturate(limiter, 0.1))
+    assert limiter.limit == 17
+    asyncio.run(_saturate(limiter, 0.5))
+    assert limiter.limit == 8
+
+
+def test_min_limit():
+    limiter = AdaptiveLimiter(4, min_limit=3, window=1)
+    limiter.record(None, False)
+    assert limiter.limit == 3
+
+
+def test_acquire_blocks_at_limit():
+    async def runner():
+        limiter = AdaptiveLimiter(2)
+        await limiter.acquire()
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        assert limiter.waiting == 1
+        limiter.release()
+        await asyncio.wait_for(waiter, 1.0)
+        assert limiter.in_flight == 2
+
+    asyncio.run(runner())
+
+
+def test_token_bucket_debt():
+    bucket = TokenBucket(rate=10.0, capacity=2.0)
+    assert bucket.reserve(1) == 0.0
+    assert bucket.reserve(1) == 0.0
+    assert bucket.reserve(1) == pytest.approx(0.1, abs=0.01)
+    assert bucket.debt_delay() == pytest.approx(0.1, abs=0.01)
+
+
+def test_rate_limiter_per_host():
+    rl = RateLimiter(requests_per_sec=1.0)
+    assert rl._reserve("https://a.example.com/x") == 0.0
+    assert rl._reserve("https://a.example.com/y") > 0.0
+    # Different host has its own budget
+    assert rl._reserve("https://b.example.com/x") == 0.0
+
+
+def test_rate_limiter_bytes():
+    rl = RateLimiter(bytes_per_sec=1000.0)
+    assert rl._reserve("host") == 0.0
+    rl.consume_bytes("host", 3000)
+    assert rl._reserve("host") == pytest.approx(2.0, abs=0.05)
+
+
+def test_rate_limiter_host_override():
+    rl = RateLimiter(requests_per_sec=1.0, host_limits={"fast": (None, None)})
+    for _ in range(10):
+        assert rl._reserve("http://fast/page") == 0.0